@@ -126,19 +126,150 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # -----------------------------------------------------------------------------
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "medicalcoder.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
-        "rest_framework.permissions.AllowAny",
+        "rest_framework.permissions.IsAuthenticated",  # public views opt in with AllowAny
+    ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "medicalcoder.renderers.FastJSONRenderer",  # orjson when installed
+        "rest_framework.renderers.BrowsableAPIRenderer",
     ),
     "EXCEPTION_HANDLER": "medicalcoder.exception_handler.custom_exception_handler",
+    # Token buckets for the pipeline upload endpoints (medicalcoder/throttling.py)
+    "DEFAULT_THROTTLE_RATES": {
+        "pipeline_upload_user": env.str("PIPELINE_UPLOAD_RATE_PER_USER", default="10/hour"),
+        "pipeline_upload": env.str("PIPELINE_UPLOAD_RATE", default="120/hour"),
+    },
+}
+# Bucket sizes: uploads accepted back-to-back before the rate applies
+THROTTLE_BURSTS = {
+    "pipeline_upload_user": env.int("PIPELINE_UPLOAD_BURST_PER_USER", default=3),
+    "pipeline_upload": env.int("PIPELINE_UPLOAD_BURST", default=10),
+}
+
+# -----------------------------------------------------------------------------
+# Pipeline admission control (see medicalcoder/admission.py). Running-run caps
+# are PipelineSlot rows, shared by every web process; queues are per process.
+# Size PIPELINE_MAX_CONCURRENT to upstream OCR/model capacity.
+# Per-upstream limits by lane: UPSTREAM_LIMITS* (medicalcoder/upstream_limits.py)
+# -----------------------------------------------------------------------------
+PIPELINE_MAX_CONCURRENT = env.int("PIPELINE_MAX_CONCURRENT", default=4)
+PIPELINE_MAX_PER_USER = env.int("PIPELINE_MAX_PER_USER", default=1)
+PIPELINE_MAX_QUEUED_PER_USER = env.int("PIPELINE_MAX_QUEUED_PER_USER", default=2)
+PIPELINE_QUEUE_TIMEOUT_SECONDS = env.int("PIPELINE_QUEUE_TIMEOUT_SECONDS", default=120)
+# Waiting requests re-check the shared caps this often (slots freed by other processes)
+PIPELINE_QUEUE_POLL_SECONDS = env.float("PIPELINE_QUEUE_POLL_SECONDS", default=1.0)
+# A slot still held after this long belongs to a process that died mid-run
+PIPELINE_SLOT_LEASE_SECONDS = env.int("PIPELINE_SLOT_LEASE_SECONDS", default=2 * 60 * 60)
+# Priority lanes, highest first: WFQ weight, concurrency cap and queue size.
+# Backfill is capped below the total so interactive uploads find a free slot
+# instead of waiting out a backfill run (benchmark_admission: half keeps p95 flat);
+# it usually runs under one service account, so its per-user limits match the lane's.
+# Only staff and the usernames in PIPELINE_BACKFILL_USERS may ask for backfill.
+PIPELINE_BACKFILL_USERS = env.list("PIPELINE_BACKFILL_USERS", default=[])
+PIPELINE_BACKFILL_MAX_CONCURRENT = env.int("PIPELINE_BACKFILL_MAX_CONCURRENT", default=max(PIPELINE_MAX_CONCURRENT // 2, 1))
+PIPELINE_BACKFILL_MAX_QUEUED = env.int("PIPELINE_BACKFILL_MAX_QUEUED", default=64)
+PIPELINE_LANES = {
+    "interactive": {
+        "weight": env.int("PIPELINE_INTERACTIVE_WEIGHT", default=8),
+        "max_concurrent": PIPELINE_MAX_CONCURRENT,
+        "max_queued": env.int("PIPELINE_MAX_QUEUED", default=16),
+    },
+    "backfill": {
+        "weight": 1,
+        "max_concurrent": PIPELINE_BACKFILL_MAX_CONCURRENT,
+        "max_queued": PIPELINE_BACKFILL_MAX_QUEUED,
+        "max_per_user": PIPELINE_BACKFILL_MAX_CONCURRENT,
+        "max_queued_per_user": PIPELINE_BACKFILL_MAX_QUEUED,
+    },
 }
+# Import the pipeline, load the ICD index and open HTTP pools at boot (see
+# medicalcoder/pipeline.py) instead of on the first upload; only in serving processes.
+PIPELINE_WARMUP = env.bool("PIPELINE_WARMUP", default=False)
+
+# -----------------------------------------------------------------------------
+# Document payload storage (see medicalcoder/artifacts.py)
+# -----------------------------------------------------------------------------
+# "inline": code JSON stays on the MedicalDocument row
+# "artifact": code JSON is stored compressed and loaded on detail access
+DOCUMENT_PAYLOAD_STORAGE = env.str("DOCUMENT_PAYLOAD_STORAGE", default="inline")
+DOCUMENT_PAYLOAD_CODEC = env.str("DOCUMENT_PAYLOAD_CODEC", default="zstd")  # gzip if zstandard is missing
+
+# -----------------------------------------------------------------------------
+# Password hashing
+# -----------------------------------------------------------------------------
+# PASSWORD_HASHER picks the hasher for new/updated hashes (argon2 needs
+# argon2-cffi, bcrypt needs bcrypt); the others stay listed so existing hashes
+# verify and are upgraded on the next login. Hashing itself runs on the
+# dedicated pool in medicalcoder/hashing_pool.py (HASHING_WORKERS, HASHING_MAX_PENDING).
+PASSWORD_HASHER = env.str("PASSWORD_HASHER", default="pbkdf2")
+PASSWORD_PBKDF2_ITERATIONS = env.int("PASSWORD_PBKDF2_ITERATIONS", default=1_000_000)
+PASSWORD_ARGON2_TIME_COST = env.int("PASSWORD_ARGON2_TIME_COST", default=2)
+PASSWORD_ARGON2_MEMORY_COST = env.int("PASSWORD_ARGON2_MEMORY_COST", default=65536)  # KiB
+PASSWORD_ARGON2_PARALLELISM = env.int("PASSWORD_ARGON2_PARALLELISM", default=2)
+PASSWORD_BCRYPT_ROUNDS = env.int("PASSWORD_BCRYPT_ROUNDS", default=12)
+
+_PASSWORD_HASHERS = {
+    "pbkdf2": "medicalcoder.hashers.TunedPBKDF2PasswordHasher",
+    "argon2": "medicalcoder.hashers.TunedArgon2PasswordHasher",
+    "bcrypt": "medicalcoder.hashers.TunedBCryptSHA256PasswordHasher",
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+# Cache for progress events, JWT users, document payloads and upload throttle
+# buckets. Set CACHE_URL to a shared backend (e.g. redis://host:6379/1) when
+# running more than one web process: the local-memory default is per process,
+# so AppConfig.ready() refuses it when WEB_CONCURRENCY (gunicorn's worker
+# count) is above 1.
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+WEB_CONCURRENCY = env.int("WEB_CONCURRENCY", default=1)
+# Longest a progress SSE response holds a worker; clients reconnect with Last-Event-ID
+PROGRESS_STREAM_SECONDS = env.int("PROGRESS_STREAM_SECONDS", default=55)
+
+# Seconds serialized document list/detail payloads stay cached (0 = off).
+# Conditional GETs (ETag / Last-Modified -> 304) work either way.
+DOCUMENT_RESPONSE_CACHE_TTL = env.int("DOCUMENT_RESPONSE_CACHE_TTL", default=300)
+# Streaming list responses (?stream=1): rows fetched per DB round trip / written per chunk
+DOCUMENT_STREAM_CHUNK_SIZE = env.int("DOCUMENT_STREAM_CHUNK_SIZE", default=2000)
+DOCUMENT_STREAM_BATCH_SIZE = env.int("DOCUMENT_STREAM_BATCH_SIZE", default=500)
+
+# Code exports (medicalcoder/exports.py). Larger ranges than EXPORT_SYNC_MAX_DOCUMENTS
+# must go through a background ExportJob; EXPORT_WORKERS = 0 leaves jobs to
+# `manage.py run_export_jobs`.
+EXPORT_ROOT = env.str("EXPORT_ROOT", default=str(BASE_DIR / "exports"))
+EXPORT_SYNC_MAX_DOCUMENTS = env.int("EXPORT_SYNC_MAX_DOCUMENTS", default=5000)
+EXPORT_WORKERS = env.int("EXPORT_WORKERS", default=1)
+EXPORT_CHUNK_SIZE = env.int("EXPORT_CHUNK_SIZE", default=1000)
+EXPORT_BATCH_SIZE = env.int("EXPORT_BATCH_SIZE", default=5000)
+# A running export not finished within EXPORT_JOB_LEASE_SECONDS (its process died)
+# is requeued by `run_export_jobs` until EXPORT_JOB_MAX_ATTEMPTS is reached.
+EXPORT_JOB_LEASE_SECONDS = env.int("EXPORT_JOB_LEASE_SECONDS", default=2 * 60 * 60)
+EXPORT_JOB_MAX_ATTEMPTS = env.int("EXPORT_JOB_MAX_ATTEMPTS", default=3)
+
+# Queued pipeline runs (medicalcoder/coding_jobs.py), executed by
+# `manage.py run_coding_workers` outside the web processes. A job whose worker
+# has not started it within CODING_JOB_LEASE_SECONDS of claiming it, or not
+# finished it within CODING_JOB_LEASE_SECONDS of starting it, goes back to the
+# queue (resuming from its checkpoints) until CODING_JOB_MAX_ATTEMPTS is reached.
+CODING_JOB_ROOT = env.str("CODING_JOB_ROOT", default=str(BASE_DIR / "coding_jobs"))
+CODING_JOB_MAX_ATTEMPTS = env.int("CODING_JOB_MAX_ATTEMPTS", default=3)
+CODING_JOB_LEASE_SECONDS = env.int("CODING_JOB_LEASE_SECONDS", default=60 * 60)
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
 }
 
+# Seconds an authenticated user record stays cached (0 = query on every request).
+# Use a shared cache (Redis/Memcached) when running several workers.
+JWT_USER_CACHE_TTL = env.int("JWT_USER_CACHE_TTL", default=60)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
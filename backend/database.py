@@ -5,41 +5,127 @@ Compatible with SQLite now, easily portable to MSSQL later.
 
 import os
 import uuid
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from sqlalchemy import (
     create_engine, Column, String, ForeignKey, event, JSON
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from passlib.hash import bcrypt
+from passlib.context import CryptContext
+
+from medicalcoder.hashing_pool import run_hashing
 
 # ------------- Load environment variables -------------
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ai_medical_coder.db")
 
+# Production profile (all optional; defaults suit a small API worker)
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+BULK_BATCH_SIZE = int(os.getenv("DB_BULK_BATCH_SIZE", "500"))
+
+# Password hashing: first scheme hashes new passwords, the rest only verify
+# (and are upgraded on the next successful login). argon2 needs argon2-cffi.
+PASSWORD_SCHEMES = [s.strip() for s in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if s.strip()]
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", "2"))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", "65536"))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", "2"))
+
+# ------------- Password context -------------
+pwd_context = CryptContext(
+    schemes=PASSWORD_SCHEMES + [x for x in ("bcrypt",) if x not in PASSWORD_SCHEMES],
+    deprecated="auto",
+    bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS,
+    argon2__time_cost=PASSWORD_ARGON2_TIME_COST,
+    argon2__memory_cost=PASSWORD_ARGON2_MEMORY_COST,
+    argon2__parallelism=PASSWORD_ARGON2_PARALLELISM,
+)
+
 # ------------- Base ORM class -------------
 Base = declarative_base()
 
+
 # ------------- Engine Creation -------------
+def engine_options(url):
+    """
+    create_engine() keyword arguments for `url`.
+
+    SQLite uses its default pool (pooling buys nothing for a local file);
+    MSSQL / PostgreSQL get a sized QueuePool with pre-ping so connections
+    dropped by the server or a load balancer are replaced transparently.
+    """
+    options = {"echo": DB_ECHO, "future": True}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+    return options
+
+
 # SQLite engine will create a local .db file automatically
 # MSSQL / PostgreSQL will just work when you change DATABASE_URL
-engine = create_engine(
-    DATABASE_URL,
-    echo=True,          # logs SQL in console
-    future=True,
-)
+# Set DB_ECHO=true to log every SQL statement while debugging
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
 
-# Enable foreign keys in SQLite (disabled by default)
+# SQLite pragmas for development: foreign keys (disabled by default), WAL so
+# readers don't block the writer, and a busy timeout instead of "database is locked"
 @event.listens_for(engine, "connect")
-def enable_sqlite_fk(dbapi_connection, connection_record):
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
     try:
-        cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON;")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};")
+        if ":memory:" not in DATABASE_URL:
+            cursor.execute("PRAGMA journal_mode=WAL;")
+            cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.execute("PRAGMA temp_store=MEMORY;")
+    finally:
         cursor.close()
-    except Exception:
-        pass
+
+
+@contextmanager
+def count_queries(bind=None):
+    """
+    Collect the SQL statements executed on `bind` (default: engine) inside the block.
+
+        with count_queries() as queries:
+            get_user_documents(user_id)
+        assert len(queries) <= 2, queries
+    """
+    bind = bind or engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", _record)
+
 
 # ------------- Session Factory -------------
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# expire_on_commit=False: objects returned by database_crud stay readable
+# after their session closes without a refresh SELECT per write
+SessionLocal = sessionmaker(
+    bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True
+)
 
 
 # =====================================================
@@ -67,11 +153,18 @@ class User(Base):
         """Hash and set a user's password"""
         # Prevent overly long passwords (>72 bytes for bcrypt)
         password = password[:72]
-        self.password_hash = bcrypt.hash(password)
+        self.password_hash = run_hashing(pwd_context.hash, password)
 
     def verify_password(self, password: str) -> bool:
-        """Verify a plain password against stored hash"""
-        return bcrypt.verify(password, self.password_hash)
+        """
+        Verify a plain password against stored hash.
+        If the hash uses an old scheme or cost it is replaced in place;
+        the caller commits (see database_crud.authenticate_user).
+        """
+        valid, new_hash = run_hashing(pwd_context.verify_and_update, password[:72], self.password_hash)
+        if valid and new_hash:
+            self.password_hash = new_hash
+        return valid
 
 
 class MedicalDocument(Base):
@@ -85,7 +178,8 @@ class MedicalDocument(Base):
     generated_parent_codes = Column(JSON, nullable=True)
     generated_specified_codes = Column(JSON, nullable=True)
 
-    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Indexed: every listing filters on the owner
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
 
     # Relationship back to User
     user = relationship("User", back_populates="documents")
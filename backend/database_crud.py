@@ -3,7 +3,40 @@ crud.py — CRUD operations for AI Medical Coder Prototype
 Uses models and session from database.py
 """
 
-from database import SessionLocal, User, MedicalDocument
+import logging
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import selectinload
+
+from database import BULK_BATCH_SIZE, SessionLocal, User, MedicalDocument
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DocumentSummary:
+    """Read-only row for document listings; safe to use after the session closes."""
+    id: str
+    file_name: str
+    user_id: str
+    username: str
+    generated_parent_codes: Optional[dict]
+    generated_specified_codes: Optional[dict]
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 
 # --------------- CREATE ---------------
 
@@ -14,8 +47,7 @@ def create_user(email: str, username: str, password: str):
         user.set_password(password)
         session.add(user)
         session.commit()
-        session.refresh(user)
-        print(f"✅ Created user: {user.username}")
+        logger.debug("Created user: %s", user.username)
         return user
 
 
@@ -30,11 +62,39 @@ def create_medical_document(user_id: str, file_name: str, parent_codes: dict, sp
         )
         session.add(doc)
         session.commit()
-        session.refresh(doc)
-        print(f"✅ Created medical document: {doc.file_name}")
+        logger.debug("Created medical document: %s", doc.file_name)
         return doc
 
 
+def bulk_create_medical_documents(documents, batch_size: int = BULK_BATCH_SIZE):
+    """
+    Insert many documents in one transaction and return their ids.
+
+    `documents` is an iterable of dicts with user_id, file_name and optionally
+    parent_codes / specified_codes. Rows are sent in executemany batches of
+    `batch_size` (multi-row INSERT ... VALUES where the driver supports it);
+    no ORM objects are built and nothing is re-selected.
+    """
+    ids = []
+    with SessionLocal() as session:
+        for batch in _batches(documents, batch_size):
+            rows = [
+                {
+                    "id": doc.get("id") or str(uuid.uuid4()),
+                    "user_id": doc["user_id"],
+                    "file_name": doc["file_name"],
+                    "generated_parent_codes": doc.get("parent_codes"),
+                    "generated_specified_codes": doc.get("specified_codes"),
+                }
+                for doc in batch
+            ]
+            session.execute(insert(MedicalDocument), rows)
+            ids.extend(row["id"] for row in rows)
+        session.commit()
+    logger.info("Bulk-created %d medical documents", len(ids))
+    return ids
+
+
 # --------------- READ (GET) ---------------
 
 def get_user_by_email(email: str):
@@ -43,22 +103,64 @@ def get_user_by_email(email: str):
         return session.query(User).filter(User.email == email).first()
 
 
-def get_all_users():
-    """Get all users"""
+def authenticate_user(email: str, password: str):
+    """Return the user if the password matches (re-hashing outdated hashes), else None"""
     with SessionLocal() as session:
-        return session.query(User).all()
+        user = session.scalars(select(User).where(User.email == email)).first()
+        if user is None or not user.verify_password(password):
+            return None
+        if session.is_modified(user):
+            session.commit()
+        return user
+
+
+def get_all_users(with_documents: bool = False):
+    """Get all users (documents loaded up front with one extra query if requested)"""
+    stmt = select(User)
+    if with_documents:
+        stmt = stmt.options(selectinload(User.documents))
+    with SessionLocal() as session:
+        return session.scalars(stmt).all()
 
 
 def get_user_documents(user_id: str):
-    """Get all documents uploaded by a user"""
+    """
+    Get all documents uploaded by a user.
+
+    `doc.user` is loaded eagerly (one extra query in total), so it can be
+    read after the session closes without a lazy load per document.
+    """
+    stmt = (
+        select(MedicalDocument)
+        .where(MedicalDocument.user_id == user_id)
+        .options(selectinload(MedicalDocument.user))
+    )
     with SessionLocal() as session:
-        return session.query(MedicalDocument).filter(MedicalDocument.user_id == user_id).all()
+        return session.scalars(stmt).all()
+
+
+def list_document_summaries(user_id: str):
+    """Documents of a user as DocumentSummary rows, in a single query"""
+    stmt = (
+        select(
+            MedicalDocument.id,
+            MedicalDocument.file_name,
+            MedicalDocument.user_id,
+            User.username,
+            MedicalDocument.generated_parent_codes,
+            MedicalDocument.generated_specified_codes,
+        )
+        .join(User, MedicalDocument.user_id == User.id)
+        .where(MedicalDocument.user_id == user_id)
+    )
+    with SessionLocal() as session:
+        return [DocumentSummary(*row) for row in session.execute(stmt)]
 
 
 def get_document_by_id(doc_id: str):
-    """Get a single medical document by ID"""
+    """Get a single medical document by ID (with its user)"""
     with SessionLocal() as session:
-        return session.query(MedicalDocument).filter(MedicalDocument.id == doc_id).first()
+        return session.get(MedicalDocument, doc_id, options=[selectinload(MedicalDocument.user)])
 
 
 # --------------- UPDATE ---------------
@@ -66,27 +168,52 @@ def get_document_by_id(doc_id: str):
 def update_document_codes(doc_id: str, new_parent: dict, new_specified: dict):
     """Update the generated codes for a document"""
     with SessionLocal() as session:
-        doc = session.query(MedicalDocument).filter(MedicalDocument.id == doc_id).first()
+        doc = session.get(MedicalDocument, doc_id)
         if not doc:
-            print("❌ Document not found.")
+            logger.warning("Document not found: %s", doc_id)
             return None
         doc.generated_parent_codes = new_parent
         doc.generated_specified_codes = new_specified
         session.commit()
-        session.refresh(doc)
-        print(f"✅ Updated document: {doc.file_name}")
+        logger.debug("Updated document: %s", doc.file_name)
         return doc
 
 
+def bulk_update_document_codes(updates, batch_size: int = BULK_BATCH_SIZE):
+    """
+    Update codes for many documents in one transaction.
+
+    `updates` is an iterable of dicts with id, parent_codes and
+    specified_codes. Uses an executemany UPDATE ... WHERE id = ? per batch
+    without loading the rows first. Returns the number of updates sent.
+    """
+    count = 0
+    with SessionLocal() as session:
+        for batch in _batches(updates, batch_size):
+            rows = [
+                {
+                    "id": item["id"],
+                    "generated_parent_codes": item.get("parent_codes"),
+                    "generated_specified_codes": item.get("specified_codes"),
+                }
+                for item in batch
+            ]
+            session.execute(update(MedicalDocument), rows)
+            count += len(rows)
+        session.commit()
+    logger.info("Bulk-updated %d medical documents", count)
+    return count
+
+
 # --------------- DELETE ---------------
 
 def delete_document(doc_id: str):
     """Delete a single document"""
     with SessionLocal() as session:
-        doc = session.query(MedicalDocument).filter(MedicalDocument.id == doc_id).first()
+        doc = session.get(MedicalDocument, doc_id)
         if doc:
             session.delete(doc)
             session.commit()
-            print(f"🗑️ Deleted document: {doc.file_name}")
+            logger.debug("Deleted document: %s", doc.file_name)
         else:
-            print("❌ Document not found.")
+            logger.warning("Document not found: %s", doc_id)
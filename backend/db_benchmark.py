@@ -0,0 +1,96 @@
+"""
+db_benchmark.py — Rows/sec for per-row vs bulk CRUD in database_crud.py,
+plus query counts for the listing reads
+
+Both sides run the current database_crud.py on the current engine. "Per
+row" calls create_medical_document() / update_document_codes() once per row
+(a session and commit each); "bulk" calls bulk_create_medical_documents() /
+bulk_update_document_codes(). The speedups are bulk over per-row, not over
+the original module. The per-row functions no longer refresh() the row or
+print(), and they now use the pooled engine, so the original code did
+more work per row than is measured here.
+
+Runs against a throwaway SQLite file unless BENCH_DATABASE_URL is set
+(point it at a scratch MSSQL/PostgreSQL database, never a real one):
+
+    python db_benchmark.py [rows]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp(prefix="mc_bench_")
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+)
+
+import database  # noqa: E402  (must see the DATABASE_URL above)
+import database_crud as crud  # noqa: E402
+
+PARENT = {"icd_codes": ["F41", "F32", "R53"]}
+SPECIFIED = {"icd10_codes": [
+    {"code": "F41.1", "description": "Generalized anxiety disorder"},
+    {"code": "F32.1", "description": "Major depressive disorder, single episode, moderate"},
+]}
+
+
+def _rate(rows, seconds):
+    return round(rows / seconds, 1) if seconds else float("inf")
+
+
+def run_benchmark(rows=2000):
+    database.init_db()
+    user = crud.create_user(f"bench-{time.time_ns()}@example.com", "bench", "bench-password")
+    results = {"database": database.engine.url.render_as_string(hide_password=True), "rows": rows}
+
+    # Per row: one session + commit per call
+    t0 = time.perf_counter()
+    ids = [
+        crud.create_medical_document(user.id, f"row-{i}.pdf", PARENT, SPECIFIED).id
+        for i in range(rows)
+    ]
+    results["per_row_insert_rows_per_sec"] = _rate(rows, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for doc_id in ids:
+        crud.update_document_codes(doc_id, PARENT, SPECIFIED)
+    results["per_row_update_rows_per_sec"] = _rate(rows, time.perf_counter() - t0)
+
+    # Bulk: batched executemany in one transaction
+    t0 = time.perf_counter()
+    ids = crud.bulk_create_medical_documents(
+        {"user_id": user.id, "file_name": f"bulk-{i}.pdf", "parent_codes": PARENT, "specified_codes": SPECIFIED}
+        for i in range(rows)
+    )
+    results["bulk_insert_rows_per_sec"] = _rate(rows, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    crud.bulk_update_document_codes(
+        {"id": doc_id, "parent_codes": PARENT, "specified_codes": SPECIFIED} for doc_id in ids
+    )
+    results["bulk_update_rows_per_sec"] = _rate(rows, time.perf_counter() - t0)
+
+    # Reads: statement count must not grow with the number of documents
+    with database.count_queries() as queries:
+        docs = crud.get_user_documents(user.id)
+        owners = {doc.user.username for doc in docs}
+    assert len(queries) <= 2 and owners == {"bench"}, queries
+    results["list_documents"] = len(docs)
+    results["list_documents_queries"] = len(queries)
+    with database.count_queries() as queries:
+        summaries = crud.list_document_summaries(user.id)
+    assert len(queries) == 1 and len(summaries) == len(docs), queries
+    results["list_summaries_queries"] = len(queries)
+
+    results["bulk_vs_per_row_insert_speedup"] = round(results["bulk_insert_rows_per_sec"] / results["per_row_insert_rows_per_sec"], 1)
+    results["bulk_vs_per_row_update_speedup"] = round(results["bulk_update_rows_per_sec"] / results["per_row_update_rows_per_sec"], 1)
+    return results
+
+
+if __name__ == "__main__":
+    import json
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(json.dumps(run_benchmark(count), indent=2))
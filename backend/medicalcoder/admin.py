@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, MedicalDocument
+from .models import User, MedicalDocument, DocumentArtifact, ExportJob, CodingJob, UsageRollup
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -8,6 +8,39 @@ class UserAdmin(admin.ModelAdmin):
 
 @admin.register(MedicalDocument)
 class MedicalDocumentAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "file_path", "created_at")
+    # Sort by "Total tokens" to find the most expensive documents
+    list_display = ("id", "user", "file_path", "total_tokens", "pipeline_ms", "degraded_mode", "created_at")
+    list_select_related = ("user",)
     search_fields = ("file_path", "user__username")
-    list_filter = ("created_at",)
\ No newline at end of file
+    list_filter = ("created_at", "degraded_mode")
+    readonly_fields = ("token_usage", "total_tokens", "pipeline_ms", "degraded_mode")
+
+@admin.register(DocumentArtifact)
+class DocumentArtifactAdmin(admin.ModelAdmin):
+    list_display = ("id", "document", "kind", "codec", "raw_size", "created_at")
+    list_filter = ("kind", "codec")
+    list_select_related = ("document__user",)
+    exclude = ("data",)
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "format", "status", "document_count", "row_count", "created_at", "finished_at")
+    list_filter = ("status", "format")
+    list_select_related = ("user",)
+    search_fields = ("user__username",)
+
+@admin.register(CodingJob)
+class CodingJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "original_name", "lane", "status", "attempts", "worker", "created_at", "finished_at")
+    list_filter = ("status", "lane")
+    list_select_related = ("user",)
+    search_fields = ("user__username", "original_name")
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    list_display = ("day", "user", "stage", "documents", "calls", "skipped",
+                    "prompt_tokens", "completion_tokens", "latency_ms")
+    list_filter = ("stage", "day")
+    list_select_related = ("user",)
+    search_fields = ("user__username",)
+    date_hierarchy = "day"
@@ -0,0 +1,364 @@
+"""
+admission.py — Capacity reservation and priority lanes for pipeline runs
+
+Every upload holds one pipeline slot while OCR, redaction and the model calls
+run. `admit(user_id, lane)` reserves the slot before the pipeline starts:
+
+    PIPELINE_MAX_CONCURRENT        runs at once, all lanes (size to upstream capacity)
+    PIPELINE_MAX_PER_USER          runs at once for one user in one lane
+    PIPELINE_MAX_QUEUED_PER_USER   requests one user may have waiting in a lane
+                                   (both can be overridden per lane)
+    PIPELINE_QUEUE_TIMEOUT_SECONDS longest wait before giving up
+    PIPELINE_LANES                 per lane: WFQ weight, concurrency cap, queue size
+
+Lanes are priority classes: "interactive" (dashboard uploads) and "backfill"
+(bulk re-coding, staff and PIPELINE_BACKFILL_USERS service accounts only). Free slots go to lanes by weighted fair queuing, so with
+both lanes backlogged interactive gets weight-proportionally more starts,
+and backfill's lower concurrency cap keeps slots free for interactive
+arrivals; an idle interactive lane leaves backfill everything up to its cap.
+Within a lane, waiting users are served round-robin (oldest request first
+within a user), so one user's backlog cannot starve everyone else. When a
+lane's queue is full, or a wait times out, PipelineBusy is raised and the
+view answers 429 with Retry-After. The lane also applies to upstream calls
+made inside the block (upstream_limits.py).
+
+The running-run caps (all lanes, per lane, per user in a lane) are shared by
+every web process: each admitted run holds a PipelineSlot row (SharedSlots)
+for its duration, so N processes together start at most
+PIPELINE_MAX_CONCURRENT runs. Queues, their order and the queue limits are
+per process; a waiting request re-checks the shared caps every
+PIPELINE_QUEUE_POLL_SECONDS to pick up slots freed elsewhere. A slot still
+held after PIPELINE_SLOT_LEASE_SECONDS (its process died mid-run) stops
+counting. Request rates are limited separately by the upload throttles in
+throttling.py.
+"""
+
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .progress import report
+from .upstream_limits import DEFAULT_LANE, LANES, in_lane
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_MAX_SECONDS = 300
+
+
+class PipelineBusy(RuntimeError):
+    """No pipeline capacity for this request; the client should retry later."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SharedSlots:
+    """
+    Running-run caps as PipelineSlot rows, shared by every process using the database.
+
+    reserve() inserts a row, then counts the live rows competing with it; over
+    any cap, it deletes its row and refuses. Two requests racing for the last
+    slot may both refuse (and retry on their next poll) but never both run.
+    """
+
+    def __init__(self, max_concurrent, max_per_user, lanes, lease_seconds):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.lanes = lanes
+        self.lease_seconds = lease_seconds
+
+    def reserve(self, lane, user_id):
+        """Id of the slot taken for `user_id` in `lane`, or None when a cap is reached."""
+        from .models import PipelineSlot
+
+        now = timezone.now()
+        live = PipelineSlot.objects.filter(expires_at__gte=now)
+        PipelineSlot.objects.filter(expires_at__lt=now).delete()
+        slot = PipelineSlot.objects.create(
+            user_id=user_id, lane=lane, worker=f"{socket.gethostname()}:{os.getpid()}",
+            expires_at=now + timedelta(seconds=self.lease_seconds),
+        )
+        counts = live.aggregate(
+            total=Count("pk"),
+            in_lane=Count("pk", filter=Q(lane=lane)),
+            for_user=Count("pk", filter=Q(lane=lane, user_id=user_id)),
+        )
+        limits = self.lanes[lane]
+        if (counts["total"] > self.max_concurrent or counts["in_lane"] > limits["max_concurrent"]
+                or counts["for_user"] > limits.get("max_per_user", self.max_per_user)):
+            slot.delete()
+            return None
+        return slot.pk
+
+    def release(self, slot_id):
+        from .models import PipelineSlot
+
+        PipelineSlot.objects.filter(pk=slot_id).delete()
+
+
+class _Ticket:
+    __slots__ = ("user_id", "lane", "granted", "event")
+
+    def __init__(self, user_id, lane):
+        self.user_id = user_id
+        self.lane = lane
+        self.granted = False
+        self.event = threading.Event()
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_per_user, max_queued_per_user, queue_timeout, lanes,
+                 shared=None, poll_seconds=1.0):
+        """
+        `lanes`: {name: {"weight", "max_concurrent", "max_queued"}}, highest
+        priority first; a lane may override "max_per_user" / "max_queued_per_user".
+        `shared`: SharedSlots enforcing the caps across processes (None: this
+        process only).
+        """
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.lanes = lanes
+        self.shared = shared
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._slot_ids = defaultdict(list)                        # (lane, user_id) -> held SharedSlots ids
+        self._running = Counter()                                 # (lane, user_id) -> active runs
+        self._lane_running = Counter()                            # lane -> active runs
+        self._waiting = {lane: OrderedDict() for lane in lanes}   # lane -> user_id -> deque, round-robin order
+        self._queued = Counter()                                  # lane -> waiting requests
+        self._vtime = {lane: 0.0 for lane in lanes}               # WFQ virtual start times
+        self._clock = 0.0
+        self._avg_run_seconds = 60.0                              # moving average, for Retry-After
+
+    # -----------------------------
+    # STEP 1: ADMIT / QUEUE
+    # -----------------------------
+    def acquire(self, user_id, lane=DEFAULT_LANE):
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown pipeline lane: {lane}")
+        with self._lock:
+            if self._queued[lane] == 0 and self._has_room(lane, user_id) and self._reserve(lane, user_id):
+                self._start(lane, user_id)
+                return
+            waiting = self._waiting[lane].get(user_id, ())
+            max_queued_per_user = self.lanes[lane].get("max_queued_per_user", self.max_queued_per_user)
+            if self._queued[lane] >= self.lanes[lane]["max_queued"] or len(waiting) >= max_queued_per_user:
+                raise PipelineBusy("Too many documents are being processed, retry later.", self._retry_after(lane))
+            ticket = _Ticket(user_id, lane)
+            self._waiting[lane].setdefault(user_id, deque()).append(ticket)
+            self._queued[lane] += 1
+            position = self._queued[lane]
+            self._dispatch()
+
+        if not ticket.granted:
+            report("queued", position=position, lane=lane)
+        deadline = time.monotonic() + self.queue_timeout
+        while not ticket.event.wait(min(self.poll_seconds, max(deadline - time.monotonic(), 0))):
+            with self._lock:
+                if ticket.granted:  # granted between the wait and the lock
+                    return
+                if time.monotonic() >= deadline:
+                    self._remove(ticket)
+                    raise PipelineBusy("Timed out waiting for pipeline capacity, retry later.",
+                                       self._retry_after(lane))
+                if self.shared is not None:
+                    self._dispatch()  # slots freed by other processes
+
+    def release(self, user_id, lane=DEFAULT_LANE, elapsed=None):
+        with self._lock:
+            if self.shared is not None:
+                self.shared.release(self._slot_ids[(lane, user_id)].pop())
+                if not self._slot_ids[(lane, user_id)]:
+                    del self._slot_ids[(lane, user_id)]
+            self._running[(lane, user_id)] -= 1
+            if self._running[(lane, user_id)] <= 0:
+                del self._running[(lane, user_id)]
+            self._lane_running[lane] -= 1
+            if elapsed is not None:
+                self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * elapsed
+            self._dispatch()
+
+    # -----------------------------
+    # STEP 2: WEIGHTED FAIR DISPATCH (lock held)
+    # -----------------------------
+    def _lane_open(self, lane):
+        return (
+            sum(self._lane_running.values()) < self.max_concurrent
+            and self._lane_running[lane] < self.lanes[lane]["max_concurrent"]
+        )
+
+    def _user_open(self, lane, user_id):
+        return self._running[(lane, user_id)] < self.lanes[lane].get("max_per_user", self.max_per_user)
+
+    def _has_room(self, lane, user_id):
+        return self._lane_open(lane) and self._user_open(lane, user_id)
+
+    def _reserve(self, lane, user_id):
+        """Take the shared slot for a run this process has room for; False when another process has it."""
+        if self.shared is None:
+            return True
+        slot_id = self.shared.reserve(lane, user_id)
+        if slot_id is None:
+            return False
+        self._slot_ids[(lane, user_id)].append(slot_id)
+        return True
+
+    def _start(self, lane, user_id):
+        self._running[(lane, user_id)] += 1
+        self._lane_running[lane] += 1
+        # Start-time fair queuing: an idle lane does not bank credit
+        start = max(self._vtime[lane], self._clock)
+        self._vtime[lane] = start + 1.0 / self.lanes[lane]["weight"]
+        self._clock = start
+
+    def _next_user(self, lane, refused=()):
+        """First waiting user in `lane`'s rotation who is under the per-user cap."""
+        if not self._lane_open(lane):
+            return None
+        for user_id in self._waiting[lane]:
+            if self._user_open(lane, user_id) and (lane, user_id) not in refused:
+                return user_id
+        return None
+
+    def _dispatch(self):
+        """Grant free slots: lane with the lowest virtual time, then round-robin across its users."""
+        refused = set()  # capped by runs in other processes
+        while True:
+            ready = [(lane, user_id) for lane in self.lanes
+                     if (user_id := self._next_user(lane, refused)) is not None]
+            if not ready:
+                return
+            lane, user_id = min(ready, key=lambda item: max(self._vtime[item[0]], self._clock))
+            if not self._reserve(lane, user_id):
+                refused.add((lane, user_id))
+                continue
+            tickets = self._waiting[lane].pop(user_id)
+            ticket = tickets.popleft()
+            if tickets:
+                self._waiting[lane][user_id] = tickets  # back of the rotation
+            self._queued[lane] -= 1
+            self._start(lane, user_id)
+            ticket.granted = True
+            ticket.event.set()
+
+    def _remove(self, ticket):
+        tickets = self._waiting[ticket.lane].get(ticket.user_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            self._queued[ticket.lane] -= 1
+            if not tickets:
+                del self._waiting[ticket.lane][ticket.user_id]
+
+    def _retry_after(self, lane):
+        # Time for the lane's queue to drain through the slots it can use
+        slots = min(self.max_concurrent, self.lanes[lane]["max_concurrent"])
+        waves = (self._queued[lane] + 1) / max(slots, 1)
+        return min(max(1, math.ceil(waves * self._avg_run_seconds)), RETRY_AFTER_MAX_SECONDS)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                lane: {
+                    "running": self._lane_running[lane],
+                    "queued": self._queued[lane],
+                    "queued_by_user": {user_id: len(t) for user_id, t in self._waiting[lane].items()},
+                }
+                for lane in self.lanes
+            }
+
+
+_lock = threading.Lock()
+_controller = None
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        with _lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    max_concurrent=settings.PIPELINE_MAX_CONCURRENT,
+                    max_per_user=settings.PIPELINE_MAX_PER_USER,
+                    max_queued_per_user=settings.PIPELINE_MAX_QUEUED_PER_USER,
+                    queue_timeout=settings.PIPELINE_QUEUE_TIMEOUT_SECONDS,
+                    lanes=settings.PIPELINE_LANES,
+                    shared=SharedSlots(
+                        max_concurrent=settings.PIPELINE_MAX_CONCURRENT,
+                        max_per_user=settings.PIPELINE_MAX_PER_USER,
+                        lanes=settings.PIPELINE_LANES,
+                        lease_seconds=settings.PIPELINE_SLOT_LEASE_SECONDS,
+                    ),
+                    poll_seconds=settings.PIPELINE_QUEUE_POLL_SECONDS,
+                )
+    return _controller
+
+
+# Cache backends that keep their data inside one process
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def check_shared_cache():
+    """
+    Refuse a per-process cache when several web processes serve: the upload
+    throttle buckets (and progress events, cached users and payloads) would
+    each be per process.
+    """
+    backend = settings.CACHES["default"]["BACKEND"]
+    if settings.WEB_CONCURRENCY > 1 and backend in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f"WEB_CONCURRENCY={settings.WEB_CONCURRENCY} needs a shared cache: set CACHE_URL "
+            f"(e.g. redis://host:6379/1) instead of {backend.rsplit('.', 1)[-1]}."
+        )
+
+
+def may_use_lane(user, lane):
+    """Lanes other than the default (backfill) are for staff and PIPELINE_BACKFILL_USERS."""
+    if lane == DEFAULT_LANE:
+        return True
+    return bool(user and (user.is_staff or user.get_username() in settings.PIPELINE_BACKFILL_USERS))
+
+
+def request_lane(request):
+    """
+    Lane asked for with the `priority` field/query param; interactive by default.
+
+    Backfill has larger per-user caps, so other users asking for it get the
+    interactive lane.
+    """
+    value = request.data.get("priority") or request.query_params.get("priority")
+    if value not in LANES:
+        return DEFAULT_LANE
+    if not may_use_lane(request.user, value):
+        logger.info("User %s may not use the %s lane; running as %s", request.user.pk, value, DEFAULT_LANE)
+        return DEFAULT_LANE
+    return value
+
+
+@contextmanager
+def admit(user_id, lane=DEFAULT_LANE):
+    """Hold a pipeline slot for `user_id` in `lane` for the duration of the block."""
+    controller = get_controller()
+    controller.acquire(user_id, lane)
+    started = time.monotonic()
+    try:
+        with in_lane(lane):
+            yield
+    finally:
+        controller.release(user_id, lane, time.monotonic() - started)
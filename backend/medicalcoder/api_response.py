@@ -1,7 +1,14 @@
-from typing import Any, Dict, Optional
+import logging
+from typing import Any, Dict, Iterable, Optional
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework import status as http
 
+from .renderers import encode_json
+
+logger = logging.getLogger(__name__)
+
 def ok(
     data: Optional[Dict[str, Any]] = None,
     message: str = "OK",
@@ -33,3 +40,41 @@ def fail(
             "detail": detail
         }
     }, status=http_status)
+
+def stream_ok(
+    rows: Iterable[Any],
+    message: str = "OK",
+    code: str = "OK",
+    http_status: int = http.HTTP_200_OK,
+    batch_size: Optional[int] = None,
+) -> StreamingHttpResponse:
+    """
+    Same envelope as ok() with `data` as a list, written incrementally so only
+    `batch_size` rows are held in memory at a time. Pass a lazy iterable
+    (e.g. a queryset `.iterator(chunk_size=...)`).
+
+    The status line is sent before the rows are read, so "success" and "error"
+    come after "data": a failure halfway through still ends as valid JSON with
+    success=false.
+    """
+    batch_size = batch_size or getattr(settings, "DOCUMENT_STREAM_BATCH_SIZE", 500)
+
+    def generate():
+        yield b'{"message":' + encode_json(message) + b',"code":' + encode_json(code) + b',"data":['
+        batch, first = [], True
+        try:
+            for row in rows:
+                batch.append(encode_json(row))
+                if len(batch) >= batch_size:
+                    yield (b"" if first else b",") + b",".join(batch)
+                    batch, first = [], False
+            if batch:
+                yield (b"" if first else b",") + b",".join(batch)
+        except Exception as e:
+            logger.exception("Streaming response failed (%s)", code)
+            error = {"fields": {}, "detail": str(e)}
+            yield b'],"success":false,"error":' + encode_json(error) + b"}"
+            return
+        yield b'],"success":true,"error":null}'
+
+    return StreamingHttpResponse(generate(), status=http_status, content_type="application/json")
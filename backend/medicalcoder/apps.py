@@ -4,7 +4,26 @@ class MedicalcoderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'medicalcoder'
 
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
 
+        from .authentication import user_changed
+        from .http_cache import document_deleted
+        from .models import MedicalDocument, User
 
+        post_save.connect(user_changed, sender=User, dispatch_uid="jwt-user-cache-save")
+        post_delete.connect(user_changed, sender=User, dispatch_uid="jwt-user-cache-delete")
+        post_delete.connect(document_deleted, sender=MedicalDocument, dispatch_uid="document-cache-delete")
 
+        # Several web processes must share the cache (throttle buckets, progress, cached users)
+        from .admission import check_shared_cache
 
+        check_shared_cache()
+
+        # Opt-in: pay the pipeline's import and index cost at boot, not on the first upload
+        from django.conf import settings
+
+        from .pipeline import is_serving, warm_up
+
+        if settings.PIPELINE_WARMUP and is_serving():
+            warm_up()
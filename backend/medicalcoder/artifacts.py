@@ -0,0 +1,191 @@
+"""
+artifacts.py — Compressed storage for large per-document payloads
+
+The five code JSONFields, the evidence snippets and the raw model outputs
+can be stored as compressed DocumentArtifact blobs instead of on the
+MedicalDocument row. Rows then only carry `code_summary` (counts + top
+codes), which is all the list endpoints read; the full payload is
+decompressed lazily on detail access.
+
+    DOCUMENT_PAYLOAD_STORAGE = "inline" | "artifact"   (settings / env)
+    DOCUMENT_PAYLOAD_CODEC   = "zstd" | "gzip"         (zstd needs `zstandard`)
+"""
+
+import gzip
+import json
+
+from django.conf import settings
+from django.db import transaction
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, gzip is always available
+    zstandard = None
+
+CODE_FIELDS = ("icd_parent_codes", "icd_specified_codes", "cpt_codes", "modifiers", "hcpcs_codes")
+EMPTY_CODES = {"icd_parent_codes": {}, "icd_specified_codes": {}, "cpt_codes": {}, "modifiers": {}, "hcpcs_codes": {}}
+SUMMARY_TOP_N = 3
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+
+
+# -----------------------------
+# STEP 1: CODECS
+# -----------------------------
+def _codec(name=None):
+    name = name or getattr(settings, "DOCUMENT_PAYLOAD_CODEC", "zstd")
+    if name == "zstd" and zstandard is None:
+        return "gzip"
+    return name
+
+
+def compress(value, codec=None):
+    """JSON-encode `value` and compress it. Returns (codec, raw_size, blob)."""
+    raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    codec = _codec(codec)
+    if codec == "zstd":
+        blob = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    elif codec == "gzip":
+        blob = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    else:
+        raise ValueError(f"Unknown payload codec: {codec}")
+    return codec, len(raw), blob
+
+
+def decompress(codec, blob):
+    blob = bytes(blob)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This artifact is zstd-compressed; install `zstandard` to read it.")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    elif codec == "gzip":
+        raw = gzip.decompress(blob)
+    else:
+        raise ValueError(f"Unknown payload codec: {codec}")
+    return json.loads(raw)
+
+
+# -----------------------------
+# STEP 2: SLIM SUMMARY
+# -----------------------------
+def _codes(items):
+    return [item.get("code") for item in items or [] if isinstance(item, dict) and item.get("code")]
+
+
+def code_summary(fields):
+    """Counts and first few codes per code type, for list views."""
+    icd = _codes((fields.get("icd_specified_codes") or {}).get("icd10_codes"))
+    cpt = _codes((fields.get("cpt_codes") or {}).get("cpt"))
+    hcpcs = _codes(fields.get("hcpcs_codes"))
+    return {
+        "icd_count": len(icd),
+        "cpt_count": len(cpt),
+        "hcpcs_count": len(hcpcs),
+        "top_icd": icd[:SUMMARY_TOP_N],
+        "top_cpt": cpt[:SUMMARY_TOP_N],
+    }
+
+
+# -----------------------------
+# STEP 3: STORE / LOAD
+# -----------------------------
+def _save_artifact(document, kind, value):
+    from .models import DocumentArtifact
+
+    codec, raw_size, blob = compress(value)
+    DocumentArtifact.objects.update_or_create(
+        document=document, kind=kind,
+        defaults={"codec": codec, "raw_size": raw_size, "data": blob},
+    )
+
+
+def document_codes(parsed):
+    """MedicalDocument code fields from a parse_ai_result() result."""
+    return {
+        "icd_parent_codes": parsed["icd_parent_codes"],
+        "icd_specified_codes": parsed["icd_codes"],
+        "cpt_codes": {"cpt": parsed["cpt_codes"]["cpt_codes"]},
+        "modifiers": {"Modifiers": parsed["modifiers"]},
+        "hcpcs_codes": parsed["cpt_codes"]["hcpcs_codes"],
+    }
+
+
+def pipeline_artifacts(ai_result, parse_errors=None):
+    """
+    Evidence, raw model outputs and parse errors kept alongside a document
+    (compressed). A section that failed to parse is saved empty, so its
+    error and the raw output it came from are what explains that.
+    """
+    from .models import DocumentArtifact
+
+    return {
+        DocumentArtifact.KIND_EVIDENCE: ai_result.get("evidence"),
+        DocumentArtifact.KIND_MODEL_OUTPUT: {
+            key: ai_result.get(key) for key in ("icd_parent_codes", "icd_codes", "cpt_codes")
+        },
+        DocumentArtifact.KIND_PARSE_ERRORS: parse_errors or None,
+    }
+
+
+def create_document(user, file_path, codes, content_hash="", artifacts=None, storage=None):
+    """
+    Create a MedicalDocument from the five code fields in `codes`.
+
+    With "artifact" storage the code fields are written compressed to a
+    DocumentArtifact and left empty on the row. `artifacts` ({kind: value},
+    e.g. evidence or raw model output) are always stored compressed.
+    """
+    from .models import DocumentArtifact, MedicalDocument
+
+    storage = storage or getattr(settings, "DOCUMENT_PAYLOAD_STORAGE", "inline")
+    external = storage == "artifact"
+    with transaction.atomic():
+        document = MedicalDocument.objects.create(
+            user=user,
+            file_path=file_path,
+            content_hash=content_hash,
+            code_summary=code_summary(codes),
+            payload_external=external,
+            **(EMPTY_CODES if external else {f: codes[f] for f in CODE_FIELDS}),
+        )
+        if external:
+            _save_artifact(document, DocumentArtifact.KIND_CODES, {f: codes[f] for f in CODE_FIELDS})
+        for kind, value in (artifacts or {}).items():
+            if value is not None:
+                _save_artifact(document, kind, value)
+    document._codes_cache = {f: codes[f] for f in CODE_FIELDS}
+    return document
+
+
+def load_artifact(document, kind, default=None):
+    from .models import DocumentArtifact
+
+    row = DocumentArtifact.objects.filter(document=document, kind=kind).values_list("codec", "data").first()
+    return decompress(*row) if row else default
+
+
+def load_codes(document):
+    """The five code fields, decompressed on first access for external payloads."""
+    cached = getattr(document, "_codes_cache", None)
+    if cached is None:
+        from .models import DocumentArtifact
+
+        if document.payload_external:
+            cached = load_artifact(document, DocumentArtifact.KIND_CODES, default=dict(EMPTY_CODES))
+        else:
+            cached = {f: getattr(document, f) for f in CODE_FIELDS}
+        document._codes_cache = cached
+    return cached
+
+
+def update_codes(document, changes):
+    """Apply code-field `changes` to an external payload and refresh the summary."""
+    from .models import DocumentArtifact
+
+    codes = {**load_codes(document), **changes}
+    with transaction.atomic():
+        _save_artifact(document, DocumentArtifact.KIND_CODES, codes)
+        document.code_summary = code_summary(codes)
+        document.save(update_fields=["code_summary", "updated_at"])
+    document._codes_cache = codes
+    return document
@@ -0,0 +1,76 @@
+"""
+authentication.py — JWT authentication with a cached user lookup
+
+simplejwt's JWTAuthentication loads the User row on every request. Tokens
+issued by CustomLoginView carry the user's `token_version` ("ver"); the
+fields the API reads (CACHED_FIELDS: profile, is_active/is_staff/
+is_superuser, token_version) are cached per user id for JWT_USER_CACHE_TTL
+seconds and only served to tokens whose version matches, so authenticated
+requests cost no query while the entry is warm. The password hash, login
+dates and anything else are never cached; request.user loads them from the
+database when first accessed, as with QuerySet.only().
+
+Invalidation:
+  * any User save/delete drops the cached record (email update, admin edits)
+  * password change/reset bumps token_version, which also revokes tokens
+    issued before the change
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+TOKEN_VERSION_CLAIM = "ver"
+CACHED_FIELDS = (
+    "id", "username", "email", "first_name", "last_name",
+    "is_active", "is_staff", "is_superuser", "token_version",
+)
+
+
+def _key(user_id):
+    return f"jwt-user:{user_id}"
+
+
+def invalidate_cached_user(user):
+    cache.delete(_key(user.pk))
+
+
+def _partial_user(values):
+    """User with only CACHED_FIELDS loaded; the rest load from the database on access."""
+    model = get_user_model()
+    # from_db() takes the values in the model's field order
+    names = [f.attname for f in model._meta.concrete_fields if f.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        ttl = getattr(settings, "JWT_USER_CACHE_TTL", 60)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            return super().get_user(validated_token)  # raises InvalidToken
+        version = validated_token.get(TOKEN_VERSION_CLAIM, 0)
+
+        values = cache.get(_key(user_id)) if ttl else None
+        if values is not None and values["token_version"] == version:
+            if api_settings.CHECK_USER_IS_ACTIVE and not values["is_active"]:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            return _partial_user(values)
+
+        user = super().get_user(validated_token)
+        if user.token_version != version:
+            raise AuthenticationFailed(_("Token has been revoked."), code="token_revoked")
+        if ttl:
+            cache.set(_key(user_id), {field: getattr(user, field) for field in CACHED_FIELDS}, ttl)
+        return user
+
+
+def user_changed(sender, instance, **kwargs):
+    """post_save / post_delete receiver for the user model (see apps.py)."""
+    invalidate_cached_user(instance)
@@ -0,0 +1,161 @@
+"""
+checkpoints.py — Resume the pipeline from the last completed stage
+
+Each stage (ocr, redaction = the redaction server's output file, download =
+the redacted text, parent, per-category specified, cpt) stores its output
+under the document's content hash and the stage's version once it succeeds:
+
+    CHECKPOINT_DIR/<sha256 of the file>/<stage>.v<version>.json
+
+A retry or a re-run after a crash finds the completed stages and skips their
+upstream calls. No local paths are stored: upload and redaction use per-run
+file names and are redone together, and "redaction" keeps only the remote
+name of the redacted output, so a failed download is retried without
+redacting again. Bump a stage's entry in STAGE_VERSIONS when its logic or
+prompt changes so old outputs are not reused.
+
+The active store lives in a context variable (like progress.py), so stage
+code only calls `checkpointed(stage, fn)`. Checkpoints hold OCR text (PHI):
+files are private to the service user, the caller clears them once the
+document is saved, and `prune()` removes anything older than
+CHECKPOINT_TTL_SECONDS.
+
+No Django imports: hippa_pipeline.py also runs as a plain script.
+"""
+
+import contextvars
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+CHECKPOINT_DIR = os.getenv(
+    "CHECKPOINT_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".checkpoints")
+)
+CHECKPOINT_TTL_SECONDS = int(os.getenv("CHECKPOINT_TTL_SECONDS", str(24 * 60 * 60)))
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "1") == "1"
+
+STAGE_VERSIONS = {
+    "ocr": 1,
+    "redaction": 1,
+    "download": 1,
+    "parent": 1,
+    "specified": 1,
+    "cpt": 1,
+}
+
+_MISSING = object()
+_current = contextvars.ContextVar("pipeline_checkpoints", default=None)
+
+
+def document_key(path):
+    """Content hash of the input file (same as MedicalDocument.content_hash)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """Stage outputs for one document, as JSON files in its own directory."""
+
+    def __init__(self, key, root=CHECKPOINT_DIR):
+        self.key = key
+        self.path = os.path.join(root, key)
+
+    def _file(self, stage):
+        # "specified:F41" -> specified family version, one file per category
+        version = STAGE_VERSIONS.get(stage.split(":", 1)[0], 1)
+        safe = stage.replace(os.sep, "_").replace(":", "__")
+        return os.path.join(self.path, f"{safe}.v{version}.json")
+
+    def get(self, stage, default=None):
+        try:
+            with open(self._file(stage), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def put(self, stage, value):
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        # Write-then-rename: a crash never leaves a half-written checkpoint
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp, self._file(stage))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def discard(self, stage):
+        try:
+            os.remove(self._file(stage))
+        except OSError:
+            pass
+
+    def completed(self):
+        try:
+            return sorted(name.rsplit(".v", 1)[0].replace("__", ":") for name in os.listdir(self.path)
+                          if name.endswith(".json"))
+        except OSError:
+            return []
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@contextmanager
+def checkpoint_scope(key):
+    """Make `key`'s checkpoints active for stage code inside the block."""
+    store = CheckpointStore(key) if CHECKPOINTS_ENABLED and key else None
+    token = _current.set(store)
+    try:
+        yield store
+    finally:
+        _current.reset(token)
+
+
+def active_store():
+    return _current.get()
+
+
+def checkpointed(stage, fn, *args, on_resume=None, **kwargs):
+    """
+    Return `stage`'s stored output, or run `fn(*args, **kwargs)` and store it.
+    A None result means the stage failed and is not stored. `on_resume(value)`
+    is called when the stored output is used. Without an active scope this is
+    just `fn(*args, **kwargs)`.
+    """
+    store = _current.get()
+    if store is None:
+        return fn(*args, **kwargs)
+    value = store.get(stage, _MISSING)
+    if value is not _MISSING:
+        if on_resume is not None:
+            on_resume(value)
+        return value
+    value = fn(*args, **kwargs)
+    if value is not None:
+        store.put(stage, value)
+    return value
+
+
+def prune(max_age_seconds=CHECKPOINT_TTL_SECONDS, root=CHECKPOINT_DIR):
+    """Remove checkpoint directories untouched for `max_age_seconds`. Returns how many."""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+    for entry in entries:
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
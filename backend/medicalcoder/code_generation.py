@@ -0,0 +1,210 @@
+"""
+code_generation.py — The coding pipeline: document → ICD-10, CPT and HCPCS codes
+
+process_icd_codes(file_path) codes one document (views and coding workers
+call it through pipeline.py):
+
+    1. hipaa_main()          OCR + HIPAA redaction (hippa_pipeline.py)
+    2. "parent" stage        parent ICD-10 categories (prompt_for_parent_codes)
+    3. "specified" stages    one per category, against its Provided Code List
+                             (code_retrieval.py; the full hierarchy when
+                             retrieval is unsure)
+    4. "cpt" stage           cpt_rules.py codes clear time-based visits; the
+                             model is only asked when the rules are unsure
+
+Every model call goes through pipeline_stages.run_stage(): output that does
+not parse repeats only that stage's call, validated results are
+checkpointed (a retried document resumes after the last completed stage),
+each call holds a "model" upstream slot in the document's lane and its
+tokens are recorded in the active ledger (token_usage.py), whose budget can
+compact the note contexts or skip the specified stage. Each prompt gets its
+own compacted copy of the note (note_compaction.py).
+
+    OPENAI_MODEL             model name (default "gpt-5")
+    OPENAI_TIMEOUT_SECONDS   per request (default 120)
+    OPENAI_API_KEY           read by the OpenAI client
+
+Returns {"status": "success", "icd_parent_codes", "icd_codes", "cpt_codes",
+"stage_errors"} or {"status": "error", "message"}; parse_ai_result()
+normalises it for storage. A stage whose output never parses is left empty
+and its error is listed in "stage_errors" (by stage, "specified:<category>"
+per category), which parse_ai_result() reports with its own parse errors.
+
+From backend/:
+    python -m medicalcoder.code_generation document.pdf
+"""
+
+import logging
+import os
+import threading
+
+from .code_retrieval import provided_code_list
+from .cpt_rules import precode_cpt
+from .hippa_pipeline import hipaa_main
+from .icd_hierarchy import load_category
+from .note_compaction import build_prompt_context
+from .output_parser import OutputParseError
+from .pipeline_stages import run_stage
+from .progress import report
+from .prompts import PROPMT_FOR_cpt_CODES, prompt_for_parent_codes, prompt_for_specified_codes
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# CONFIGURATION
+# -----------------------------
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+
+REPORT_PLACEHOLDER = "[Insert patient report text here]"
+CODE_LIST_PLACEHOLDER = "[Insert AI-generated or provided ICD-10 codes here]"
+
+
+# -----------------------------
+# STEP 1: MODEL CLIENT
+# -----------------------------
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    """Process-wide OpenAI client (created on first use; pipeline.warm_up() creates it early)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                _client = OpenAI(timeout=OPENAI_TIMEOUT_SECONDS)
+    return _client
+
+
+def _reset_client():
+    # httpx connection pools do not survive a fork; children open their own
+    global _client, _client_lock
+    _client, _client_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_client)
+
+
+def ask_model(prompt):
+    """One chat completion. Returns the API response; run_stage() reads its text and token usage."""
+    return client().chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+    )
+
+
+# -----------------------------
+# STEP 2: PROMPTS
+# -----------------------------
+def parent_prompt(note):
+    context, _ = build_prompt_context(note, "parent")
+    return f"{prompt_for_parent_codes}\nPatient Report:\n{context}"
+
+
+def specified_prompt(note, code_list):
+    context, _ = build_prompt_context(note, "specified")
+    return prompt_for_specified_codes.replace(REPORT_PLACEHOLDER, context).replace(CODE_LIST_PLACEHOLDER, code_list)
+
+
+def cpt_prompt(note):
+    context, _ = build_prompt_context(note, "cpt")
+    return f"{PROPMT_FOR_cpt_CODES}\nClinical Documentation:\n{context}"
+
+
+def code_list_for(note, category):
+    """Provided Code List for one parent category, or None when no hierarchy is available."""
+    code_list = provided_code_list(note, category)
+    if code_list is None:
+        # Not bundled and not in the code set index: scrape it (json_pipeline.py)
+        try:
+            from .json_pipeline import get_icd_hierarchy
+
+            code_list = get_icd_hierarchy(category)[1] or None
+        except Exception as e:
+            logger.warning("No ICD hierarchy for %s: %s", category, e)
+    return code_list
+
+
+def _category_codes(category):
+    """The category itself as the answer, for runs whose token budget skips refinement."""
+    entries = load_category(category)
+    description = entries[0].full_description if entries else ""
+    return {"icd10_codes": [{"code": category, "description": description}]}
+
+
+# -----------------------------
+# STEP 3: STAGES
+# -----------------------------
+def _stage(stage, prompt, errors, **kwargs):
+    """run_stage() with ask_model; None (and the reason in `errors`) when the output never parses."""
+    name = kwargs.get("checkpoint", stage)
+    try:
+        return run_stage(stage, lambda: ask_model(prompt), prompt=prompt, **kwargs)
+    except OutputParseError as exc:
+        logger.warning("Stage %s gave up: %s", name, exc)
+        errors[name] = str(exc)
+        return None
+
+
+def code_parents(note, errors):
+    return _stage("parent", parent_prompt(note), errors) or []
+
+
+def code_specified(note, parents, errors):
+    """Specified codes for every parent category, in parent order."""
+    codes, seen = [], set()
+    for category in parents:
+        code_list = code_list_for(note, category)
+        if code_list is None:
+            continue
+        result = _stage(
+            "specified", specified_prompt(note, code_list), errors,
+            checkpoint=f"specified:{category}", parent_codes=[category],
+            fallback=lambda category=category: _category_codes(category),
+        )
+        for item in (result or {}).get("icd10_codes", []):
+            if item["code"] not in seen:
+                seen.add(item["code"])
+                codes.append(item)
+    return {"icd10_codes": codes}
+
+
+def code_cpt(note, errors):
+    rules = precode_cpt(note)
+    if not rules.needs_model:
+        result = rules.as_dict()
+        report("cpt", result=result, source="rules")
+        return result
+    logger.info("CPT rules deferred to the model: %s", "; ".join(rules.reasons))
+    return _stage("cpt", cpt_prompt(note), errors) or {"cpt_codes": [], "hcpcs_codes": []}
+
+
+# -----------------------------
+# STEP 4: WHOLE DOCUMENT
+# -----------------------------
+def process_icd_codes(file_path):
+    """Code one document. See the module docstring for the result."""
+    note = hipaa_main(file_path)
+    if not note:
+        return {"status": "error", "message": "OCR or HIPAA redaction failed"}
+
+    errors = {}
+    parents = code_parents(note, errors)
+    return {
+        "status": "success",
+        "icd_parent_codes": {"icd_codes": parents},
+        "icd_codes": code_specified(note, parents, errors),
+        "cpt_codes": code_cpt(note, errors),
+        "stage_errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else input("Enter path to the original medical document: ").strip()
+    print(json.dumps(process_icd_codes(path), indent=2))
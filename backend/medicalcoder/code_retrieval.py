@@ -0,0 +1,302 @@
+"""
+code_retrieval.py — BM25 candidate retrieval for the specified-code prompt
+
+prompt_for_specified_codes receives the whole hierarchy for every parent
+code (78 lines for F19). This module builds a CPU-only BM25 index over the
+expanded code descriptions as a SciPy sparse matrix, scores every code
+against the note with one sparse matrix product, and keeps only the top-k
+children per parent (plus their ancestors, so the model still sees the tree
+path) for the "Provided Code List".
+
+Sibling descriptions differ by a word or two, so scores near the cut are
+often tied or nearly so. Children within TIE_MARGIN of the k-th score are
+kept too; when that is more than MAX_CANDIDATES_FACTOR * k children, or the
+note matches none of the category's children, retrieval is not confident
+and the category's full hierarchy is sent as before.
+
+Benchmark from backend/ (prompt size and latency for one note; recall only
+with labelled notes, one {"note": "<text file>", "codes": ["F33.1", ...]}
+per line, note paths relative to the labels file; testdata/retrieval/ has a
+small labelled set that the test suite checks):
+    python -m medicalcoder.code_retrieval note.txt | labels.jsonl [k ...]
+"""
+
+import re
+import time
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from .icd_hierarchy import hierarchy_text, load_all, load_category
+
+# -----------------------------
+# CONFIGURATION
+# -----------------------------
+DEFAULT_TOP_K = 8
+TIE_MARGIN = 0.1  # children scoring >= (1 - TIE_MARGIN) * the k-th score are kept
+MAX_CANDIDATES_FACTOR = 3  # more near-ties than this * k: send the full hierarchy
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or other
+than that the their this to was were which with without not no unspecified
+specified disorder disorders due patient
+""".split())
+TOKEN_RE = re.compile(r"[a-z]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed and a light plural strip."""
+    tokens = []
+    for tok in TOKEN_RE.findall((text or "").lower()):
+        if tok in STOPWORDS or len(tok) < 3:
+            continue
+        if len(tok) > 4 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+# -----------------------------
+# INDEX
+# -----------------------------
+class CodeRetrievalIndex:
+    """BM25 index over ICD code descriptions (rows = codes, cols = terms)."""
+
+    def __init__(self, categories=None, k1=BM25_K1, b=BM25_B):
+        categories = load_all() if categories is None else categories
+        self.entries = [e for entries in categories.values() for e in entries]
+        self.row_of = {e.code: i for i, e in enumerate(self.entries)}
+        self.rows_by_category = {}
+        for i, e in enumerate(self.entries):
+            self.rows_by_category.setdefault(e.category, []).append(i)
+
+        docs = [tokenize(e.full_description) for e in self.entries]
+        self.vocab = {}
+        rows, cols, tfs = [], [], []
+        for row, tokens in enumerate(docs):
+            for term, tf in Counter(tokens).items():
+                col = self.vocab.setdefault(term, len(self.vocab))
+                rows.append(row)
+                cols.append(col)
+                tfs.append(tf)
+
+        n_docs, n_terms = len(docs), len(self.vocab)
+        tf = np.asarray(tfs, dtype=np.float32)
+        doc_len = np.asarray([len(d) for d in docs], dtype=np.float32)
+        avg_len = float(doc_len.mean()) if n_docs else 1.0
+        df = np.bincount(np.asarray(cols, dtype=np.int64), minlength=n_terms).astype(np.float32)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+
+        norm = k1 * (1.0 - b + b * doc_len[np.asarray(rows, dtype=np.int64)] / avg_len)
+        weights = idf[np.asarray(cols, dtype=np.int64)] * tf * (k1 + 1.0) / (tf + norm)
+        self.matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(n_docs, n_terms), dtype=np.float32)
+        self._extra = {}  # category -> index over its code set entries
+
+    def query_matrix(self, notes):
+        """Binary term-presence matrix for a batch of notes (rows = notes)."""
+        rows, cols = [], []
+        for row, note in enumerate(notes):
+            for term in set(tokenize(note)):
+                col = self.vocab.get(term)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        data = np.ones(len(rows), dtype=np.float32)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(notes), len(self.vocab)))
+
+    def score(self, notes):
+        """Dense (n_notes × n_codes) BM25 scores in a single sparse product."""
+        return (self.query_matrix(notes) @ self.matrix.T).toarray()
+
+    def select(self, scores, category, k=DEFAULT_TOP_K):
+        """
+        Child codes of `category` to offer for one row of scores: the top k
+        plus near-ties, or None when the whole hierarchy should be sent.
+        """
+        rows = np.asarray([r for r in self.rows_by_category.get(category, []) if self.entries[r].depth > 0])
+        if len(rows) <= k:
+            return None
+        sub = scores[rows]
+        order = np.argsort(-sub, kind="stable")
+        if sub[order[0]] <= 0:
+            return None  # nothing in the note matches any child
+        keep = int((sub >= sub[order[k - 1]] * (1.0 - TIE_MARGIN)).sum())
+        if keep > MAX_CANDIDATES_FACTOR * k:
+            return None
+        return [self.entries[r].code for r in rows[order[:keep]]]
+
+    def candidate_entries(self, category, codes):
+        """Selected codes plus their ancestors, in hierarchy order."""
+        wanted = set()
+        for code in codes:
+            entry = self.entries[self.row_of[code]]
+            while entry is not None:
+                wanted.add(entry.code)
+                entry = self.entries[self.row_of[entry.parent]] if entry.parent else None
+        return [self.entries[r] for r in self.rows_by_category.get(category, [])
+                if self.entries[r].code in wanted]
+
+    def candidates_for_note(self, note, parent_codes, k=DEFAULT_TOP_K):
+        """
+        Provided Code List text per parent code for one note.
+
+        Parents without a bundled hierarchy are ranked against their ICD code
+        set entries (indexed on first use); parents found in neither are omitted.
+        Categories where retrieval is not confident (select) get their full
+        hierarchy.
+        """
+        scores = self.score([note])[0]
+        out = {}
+        for parent in parent_codes:
+            category = parent.upper().strip()[:3]
+            index, index_scores = self, scores
+            if category not in self.rows_by_category:
+                index = self.category_index(category)
+                if index is None:
+                    continue
+                index_scores = index.score([note])[0]
+            codes = index.select(index_scores, category, k)
+            if codes is None:
+                out[category] = hierarchy_text([index.entries[r] for r in index.rows_by_category[category]])
+            elif codes:
+                out[category] = hierarchy_text(index.candidate_entries(category, codes))
+        return out
+
+    def category_index(self, category):
+        """Index over one category from the ICD code set, or None when it has no entries."""
+        if category not in self._extra:
+            entries = load_category(category)
+            self._extra[category] = CodeRetrievalIndex({category: entries}) if entries else None
+        return self._extra[category]
+
+
+_INDEX = None
+
+
+def get_index():
+    """Process-wide index over the bundled hierarchy files (built on first use)."""
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = CodeRetrievalIndex()
+    return _INDEX
+
+
+def provided_code_list(note, parent_code, k=DEFAULT_TOP_K):
+    """Top-k hierarchy text for one parent, or None when it is not indexed."""
+    return get_index().candidates_for_note(note, [parent_code], k).get(parent_code.upper().strip()[:3])
+
+
+# -----------------------------
+# BENCHMARK
+# -----------------------------
+def load_labels(path):
+    """[(note text, [codes])] from a labels file (JSON lines, see the module docstring)."""
+    import json
+    import os
+
+    base = os.path.dirname(os.path.abspath(path))
+    labelled = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            with open(os.path.join(base, item["note"]), "r", encoding="utf-8", errors="ignore") as nf:
+                labelled.append((nf.read(), [c.upper().strip() for c in item["codes"]]))
+    return labelled
+
+
+def recall_at_k(index, labelled, ks=(DEFAULT_TOP_K,)):
+    """
+    ({k: recall}, {k: full-list fallback rate}, codes counted) over `labelled` notes.
+
+    A labelled code is recalled when it is among the candidates offered for
+    its category (a full-hierarchy fallback counts as offering it). Codes
+    whose category is not indexed are left out.
+    """
+    scores = index.score([text for text, _ in labelled])
+    wanted = [(i, code) for i, (_, codes) in enumerate(labelled) for code in codes if code in index.row_of]
+    recall, fallback = {}, {}
+    for k in ks:
+        hits = fallbacks = 0
+        for i, code in wanted:
+            selected = index.select(scores[i], index.entries[index.row_of[code]].category, k)
+            fallbacks += selected is None
+            hits += selected is None or code in selected
+        recall[k] = hits / len(wanted) if wanted else 0.0
+        fallback[k] = fallbacks / len(wanted) if wanted else 0.0
+    return recall, fallback, len(wanted)
+
+
+def run_benchmark(note, ks=(5, 8, 10, 20), labelled=None):
+    """Prompt size and latency for `note`; recall@k over `labelled` notes (see recall_at_k)."""
+    from .note_compaction import count_tokens
+
+    t0 = time.perf_counter()
+    index = CodeRetrievalIndex()
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    result = {
+        "codes_indexed": len(index.entries),
+        "vocabulary": len(index.vocab),
+        "build_ms": round(build_ms, 2),
+    }
+
+    if labelled:
+        t0 = time.perf_counter()
+        recall, fallback, wanted = recall_at_k(index, labelled, ks)
+        batch_ms = (time.perf_counter() - t0) * 1000
+        result.update({
+            "labelled_notes": len(labelled),
+            "labelled_codes": wanted,
+            "batch_score_ms": round(batch_ms, 2),
+            "recall_at_k": {k: round(v, 4) for k, v in recall.items()},
+            "full_list_fallback_at_k": {k: round(v, 4) for k, v in fallback.items()},
+        })
+
+    full_tokens = top_tokens = 0
+    categories = list(index.rows_by_category)
+    single = index.score([note])[0]
+    fallbacks = []
+    for category in categories:
+        full = count_tokens(hierarchy_text([index.entries[r] for r in index.rows_by_category[category]]))
+        full_tokens += full
+        codes = index.select(single, category, DEFAULT_TOP_K)
+        if codes is None:
+            fallbacks.append(category)
+            top_tokens += full
+        else:
+            top_tokens += count_tokens(hierarchy_text(index.candidate_entries(category, codes)))
+
+    t0 = time.perf_counter()
+    runs = 50
+    for _ in range(runs):
+        index.candidates_for_note(note, categories)
+    query_ms = (time.perf_counter() - t0) * 1000 / runs
+
+    result.update({
+        "per_note_all_parents_ms": round(query_ms, 3),
+        "provided_list_tokens_full": full_tokens,
+        f"provided_list_tokens_top{DEFAULT_TOP_K}": top_tokens,
+        "provided_list_reduction": round(1 - top_tokens / full_tokens, 4) if full_tokens else 0.0,
+        "full_list_categories": fallbacks,
+    })
+    return result
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "REDACTED_result.txt"
+    ks = tuple(int(k) for k in sys.argv[2:]) or (5, 8, 10, 20)
+    labelled = load_labels(path) if path.endswith(".jsonl") else None
+    if labelled:
+        note = labelled[0][0]
+    else:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            note = f.read()
+    print(json.dumps(run_benchmark(note, ks, labelled), indent=2))
@@ -0,0 +1,211 @@
+"""
+coding_jobs.py — Database-backed queue for pipeline runs
+
+Uploads sent with `?defer=1` (or POSTed to medical-documents/jobs/) are stored
+under CODING_JOB_ROOT and queued as CodingJob rows instead of running inside
+the web worker. `manage.py run_coding_workers` processes claim them:
+
+    pending --claim--> claimed --start--> running --> completed | failed
+                          |                  |
+                          +--- release / lease expired / error ---> pending
+
+Claims use SELECT ... FOR UPDATE SKIP LOCKED where the database has it
+(PostgreSQL, MySQL 8), so concurrent workers never wait on each other's rows;
+on SQLite, where writes are serialized, a conditional UPDATE on the status
+claims atomically instead. Every later transition is conditional on the
+claiming worker, so a job whose lease expired and was re-claimed elsewhere
+is not written by the old worker. The lease (CODING_JOB_LEASE_SECONDS) runs
+from the claim and starts again when the job starts running. Interactive jobs are claimed before
+backfill ones and run in their lane (upstream_limits.py); a failed job is
+retried up to CODING_JOB_MAX_ATTEMPTS times and resumes from its
+checkpoints (checkpoints.py). An interactive job for a file the user already
+had coded (same content_hash) completes with that document without running
+the pipeline; backfill jobs always re-code.
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .artifacts import create_document, document_codes, pipeline_artifacts
+from .checkpoints import checkpoint_scope
+from .progress import track
+from .token_usage import accounting
+from .upstream_limits import LANES, in_lane
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------------
+# STEP 1: ENQUEUE
+# -----------------------------
+def enqueue(user, uploaded, lane=LANES[0]):
+    """Store an uploaded file under CODING_JOB_ROOT and queue a CodingJob for it."""
+    from .models import CodingJob
+
+    os.makedirs(settings.CODING_JOB_ROOT, mode=0o700, exist_ok=True)
+    suffix = os.path.splitext(uploaded.name)[1] or ".pdf"
+    path = os.path.join(settings.CODING_JOB_ROOT, f"{uuid.uuid4().hex}{suffix}")
+    digest = hashlib.sha256()
+    with open(path, "wb") as dest:
+        for chunk in uploaded.chunks():
+            dest.write(chunk)
+            digest.update(chunk)
+    try:
+        return CodingJob.objects.create(
+            user=user, file_path=path, original_name=uploaded.name, content_hash=digest.hexdigest(), lane=lane,
+        )
+    except Exception:
+        os.remove(path)
+        raise
+
+
+# -----------------------------
+# STEP 2: CLAIM / RELEASE
+# -----------------------------
+def _lane_priority():
+    return Case(
+        *[When(lane=lane, then=Value(i)) for i, lane in enumerate(LANES)],
+        default=Value(len(LANES)), output_field=IntegerField(),
+    )
+
+
+def claim_jobs(worker, limit):
+    """Claim up to `limit` pending jobs for `worker`, interactive lane first, oldest first."""
+    from .models import CodingJob
+
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    pending = CodingJob.objects.filter(status=CodingJob.STATUS_PENDING).order_by(_lane_priority(), "created_at")
+    claim = {"status": CodingJob.STATUS_CLAIMED, "worker": worker, "claimed_at": now}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(pending.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit])
+            CodingJob.objects.filter(pk__in=ids).update(**claim)
+    else:
+        ids = list(pending.values_list("id", flat=True)[:limit])
+        CodingJob.objects.filter(pk__in=ids, status=CodingJob.STATUS_PENDING).update(**claim)
+    # Only the rows this call claimed (another worker may have won some of `ids`)
+    claimed = CodingJob.objects.filter(pk__in=ids, status=CodingJob.STATUS_CLAIMED, worker=worker, claimed_at=now)
+    return sorted(claimed.select_related("user"), key=lambda job: ids.index(job.pk))
+
+
+def release_jobs(worker, job_ids):
+    """Put claimed jobs that `worker` has not started back in the queue."""
+    from .models import CodingJob
+
+    return CodingJob.objects.filter(pk__in=job_ids, worker=worker, status=CodingJob.STATUS_CLAIMED).update(
+        status=CodingJob.STATUS_PENDING, worker="", claimed_at=None
+    )
+
+
+def requeue_expired(lease_seconds=None):
+    """Requeue claimed/running jobs older than the lease (their worker died). Returns how many."""
+    from .models import CodingJob
+
+    lease_seconds = lease_seconds or settings.CODING_JOB_LEASE_SECONDS
+    now = timezone.now()
+    expired = CodingJob.objects.filter(
+        status__in=[CodingJob.STATUS_CLAIMED, CodingJob.STATUS_RUNNING],
+        claimed_at__lt=now - timedelta(seconds=lease_seconds),
+    )
+    for job in expired.filter(attempts__gte=settings.CODING_JOB_MAX_ATTEMPTS):
+        _finish(job, job.worker, job.status, status=CodingJob.STATUS_FAILED,
+                error="Worker lease expired on the last attempt.")
+    return expired.update(status=CodingJob.STATUS_PENDING, worker="", claimed_at=None)
+
+
+# -----------------------------
+# STEP 3: RUN
+# -----------------------------
+def _finish(job, worker, current_status, **fields):
+    """Final transition (only if `worker` still owns the job); removes the stored upload."""
+    from .models import CodingJob
+
+    fields["finished_at"] = timezone.now()
+    updated = CodingJob.objects.filter(pk=job.pk, worker=worker, status=current_status).update(**fields)
+    if updated and os.path.exists(job.file_path):
+        os.remove(job.file_path)
+    return updated
+
+
+def run_coding_job(job, worker):
+    """Run a job claimed by `worker`. Returns its final status, or None if it is no longer ours."""
+    from .models import CodingJob, MedicalDocument
+    from .output_parser import parse_ai_result
+    from .pipeline import process_icd_codes
+
+    mine = CodingJob.objects.filter(pk=job.pk, worker=worker, status=CodingJob.STATUS_CLAIMED)
+    # The lease restarts here: a prefetched job may have waited in the worker's queue since its claim
+    now = timezone.now()
+    if not mine.update(status=CodingJob.STATUS_RUNNING, claimed_at=now, started_at=now, attempts=F("attempts") + 1):
+        return None
+    job.refresh_from_db(fields=["attempts"])
+    # Interactive re-uploads of a file already coded get that document back;
+    # backfill jobs exist to re-code, so they always run the pipeline
+    if job.lane != "backfill":
+        duplicate = MedicalDocument.objects.duplicate_of(job.user, job.content_hash)
+        if duplicate is not None:
+            if not _finish(job, worker, CodingJob.STATUS_RUNNING, status=CodingJob.STATUS_COMPLETED, document=duplicate):
+                return None
+            with track(str(job.pk), job.user_id) as progress:
+                progress.publish("completed", document_id=duplicate.pk, duplicate_of=duplicate.pk)
+            return CodingJob.STATUS_COMPLETED
+    # The job id doubles as the progress id: medical-documents/progress/<job id>/
+    with track(str(job.pk), job.user_id) as progress:
+        try:
+            with in_lane(job.lane), checkpoint_scope(job.content_hash) as checkpoints, \
+                    accounting(job.user_id) as usage:
+                ai_result = process_icd_codes(job.file_path)
+                if ai_result.get("status") != "success":
+                    raise RuntimeError(ai_result.get("message") or "AI code generation failed")
+                parsed = parse_ai_result(ai_result)
+                with transaction.atomic():
+                    document = create_document(
+                        user=job.user,
+                        file_path=job.original_name,
+                        content_hash=job.content_hash,
+                        codes=document_codes(parsed),
+                        artifacts=pipeline_artifacts(ai_result, parsed["parse_errors"]),
+                    )
+                    usage.attach(document)
+                    # Completed with empty sections: say which, so the job list shows it
+                    parse_errors = "; ".join(f"{stage}: {error}" for stage, error in parsed["parse_errors"].items())
+                    if not _finish(job, worker, CodingJob.STATUS_RUNNING,
+                                   status=CodingJob.STATUS_COMPLETED, document=document, error=parse_errors):
+                        transaction.set_rollback(True)  # lease lost: the new owner saves it
+                        return None
+        except Exception as e:
+            # Handled inside track(), which would otherwise publish a terminal
+            # "failed" event for a job that is about to be retried
+            logger.exception("Coding job %s failed (attempt %d)", job.pk, job.attempts)
+            if job.attempts >= settings.CODING_JOB_MAX_ATTEMPTS:
+                _finish(job, worker, CodingJob.STATUS_RUNNING, status=CodingJob.STATUS_FAILED, error=str(e))
+                progress.publish("failed", message=str(e))
+                return CodingJob.STATUS_FAILED
+            mine = CodingJob.objects.filter(pk=job.pk, worker=worker, status=CodingJob.STATUS_RUNNING)
+            mine.update(status=CodingJob.STATUS_PENDING, worker="", claimed_at=None, error=str(e))
+            progress.publish("retrying", message=str(e), attempt=job.attempts,
+                             max_attempts=settings.CODING_JOB_MAX_ATTEMPTS)
+            return CodingJob.STATUS_PENDING
+        if checkpoints is not None:
+            checkpoints.clear()
+        progress.publish("completed", document_id=document.pk)
+        return CodingJob.STATUS_COMPLETED
+
+
+def run_in_thread(job, worker):
+    """run_coding_job() for worker threads, which each hold their own DB connection."""
+    close_old_connections()
+    try:
+        return run_coding_job(job, worker)
+    finally:
+        close_old_connections()
@@ -0,0 +1,470 @@
+"""
+cpt_rules.py — Deterministic pre-coder for time-based psychiatry CPT codes
+
+Most of what PROPMT_FOR_cpt_CODES asks the model to do is mechanical:
+read the session minutes, decide whether the visit was an E/M, psychotherapy
+or both, and apply modifier 25 / 95. This module does that locally with
+compiled patterns (about 1.1 ms for the 18k-character sample note, against
+seconds for a model call) and returns
+candidates in the same JSON shape the CPT prompt returns:
+
+    {"cpt_codes": [{"code", "description", "modifier", "description_modifier"}],
+     "hcpcs_codes": [{"code", "description"}]}
+
+When the note is ambiguous (no minutes, psychotherapy without a separate
+time, conflicting service types, ...) the result is flagged with
+`needs_model=True` and the caller should fall back to the model prompt.
+
+A service only counts when the note documents it for this encounter: a
+mention in a sentence about the past ("prior psychotherapy with another
+provider in 2019") or under a history heading is ignored, and a note whose
+services are all historical goes to the model. Time-based codes are never
+derived from such mentions.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+# -----------------------------
+# CODE TABLES
+# -----------------------------
+# (min_minutes, max_minutes, code, description); max is inclusive, None = open.
+PSYCHOTHERAPY_CODES = [
+    (16, 37, "90832", "Psychotherapy, 30 minutes with patient"),
+    (38, 52, "90834", "Psychotherapy, 45 minutes with patient"),
+    (53, None, "90837", "Psychotherapy, 60 minutes with patient"),
+]
+PSYCHOTHERAPY_ADDON_CODES = [
+    (16, 37, "90833", "Psychotherapy, 30 minutes with patient, with E/M service (add-on)"),
+    (38, 52, "90836", "Psychotherapy, 45 minutes with patient, with E/M service (add-on)"),
+    (53, None, "90838", "Psychotherapy, 60 minutes with patient, with E/M service (add-on)"),
+]
+EM_ESTABLISHED_CODES = [
+    (10, 19, "99212", "Office/outpatient visit, established patient, straightforward MDM or 10+ minutes"),
+    (20, 29, "99213", "Office/outpatient visit, established patient, low MDM or 20+ minutes"),
+    (30, 39, "99214", "Office/outpatient visit, established patient, moderate MDM or 30+ minutes"),
+    (40, None, "99215", "Office/outpatient visit, established patient, high MDM or 40+ minutes"),
+]
+EM_NEW_CODES = [
+    (15, 29, "99202", "Office/outpatient visit, new patient, straightforward MDM or 15+ minutes"),
+    (30, 44, "99203", "Office/outpatient visit, new patient, low MDM or 30+ minutes"),
+    (45, 59, "99204", "Office/outpatient visit, new patient, moderate MDM or 45+ minutes"),
+    (60, None, "99205", "Office/outpatient visit, new patient, high MDM or 60+ minutes"),
+]
+# Medicare prolonged service (G2212) starts 15 minutes past the CMS threshold.
+PROLONGED_THRESHOLDS = {"99215": 69, "99205": 89}
+PROLONGED_HCPCS = ("G2212", "Prolonged office/outpatient E/M service, each additional 15 minutes")
+
+DIAGNOSTIC_EVAL = ("90791", "Psychiatric diagnostic evaluation")
+DIAGNOSTIC_EVAL_MEDICAL = ("90792", "Psychiatric diagnostic evaluation with medical services")
+CRISIS_FIRST = ("90839", "Psychotherapy for crisis, first 60 minutes")
+CRISIS_ADDON = ("90840", "Psychotherapy for crisis, each additional 30 minutes")
+FAMILY_WITHOUT_PATIENT = ("90846", "Family psychotherapy without the patient present, 50 minutes")
+FAMILY_WITH_PATIENT = ("90847", "Family psychotherapy with the patient present, 50 minutes")
+GROUP_PSYCHOTHERAPY = ("90853", "Group psychotherapy")
+INTERACTIVE_COMPLEXITY = ("90785", "Interactive complexity (add-on)")
+
+MODIFIERS = {
+    "25": "Significant, separately identifiable E/M service",
+    "95": "Synchronous telemedicine service via real-time audio and video",
+    "93": "Synchronous telemedicine service via audio-only communication",
+}
+
+# -----------------------------
+# COMPILED PATTERNS
+# -----------------------------
+# Patterns are lowercase and run on note.lower(); that is several times faster
+# than re.IGNORECASE on long notes. The time patterns are anchored the same
+# way as the rules below (see _search).
+_MINUTES = r"(\d{1,3})\s*(?:-|to)?\s*(?:\d{1,3}\s*)?(?:min(?:ute)?s?\b|m\b)"
+_HOURS = r"(\d(?:\.\d+)?)\s*(?:hours?|hrs?)\b"
+
+# "psychotherapy time: 30 min", "psychotherapy (30 minutes)", "psychotherapy lasting 30 minutes",
+# "30 minutes of psychotherapy", "spent 30 minutes in psychotherapy",
+# "30 minutes were spent providing supportive psychotherapy", "30-minute psychotherapy session"
+_PSYCHOTHERAPY_WORDS = r"(?:was|were|is|of|for|in|on|spent|provided|providing|performed|performing|doing|lasting" \
+                       r"|lasted|totaling|totaled|totalling|devoted to|approximately|about)"
+PSYCHOTHERAPY_TIME_RE = re.compile(
+    rf"psychotherapy(?:\s+(?:time|session|duration))?(?:\s+{_PSYCHOTHERAPY_WORDS})*\s*[:\-(x]?\s*{_MINUTES}"
+    rf"|{_MINUTES}(?:\s+{_PSYCHOTHERAPY_WORDS})*\s+(?:individual\s+|supportive\s+)?psychotherapy",
+)
+TOTAL_TIME_RE = re.compile(
+    r"(?:total(?:\s+face[- ]to[- ]face)?(?:\s+visit|\s+session|\s+encounter)?\s+time"
+    r"|face[- ]to[- ]face\s+time|time\s+spent|session\s+(?:length|duration|time)|visit\s+duration)"
+    rf"(?:\s+(?:was|of|with the patient))*\s*[:\-]?\s*(?:(?:approximately|about|over)\s+)?(?:{_MINUTES}|{_HOURS})",
+)
+CLOCK_RANGE_RE = re.compile(
+    r"start(?:\s+time)?\s*[:\-]?\s*(\d{1,2}):(\d{2})\s*([ap]\.?m\.?)?"
+    r"[\s,;]+end(?:\s+time)?\s*[:\-]?\s*(\d{1,2}):(\d{2})\s*([ap]\.?m\.?)?",
+)
+
+# (pattern, anchor words). A pattern is only run in a small window around its
+# anchors, found with str.find, so a long note costs a few memchr scans
+# instead of a full regex pass per rule.
+AUDIO_VIDEO_RULE = (re.compile(
+    r"audio[- ]?visual|audio and video|video (?:platform|visit|call|session|conference)"
+    r"|real[- ]time (?:audio and )?video|via (?:zoom|doxy\.me|teams)|telehealth video"
+), ("audio", "video", "zoom", "doxy", "teams"))
+AUDIO_ONLY_RULE = (re.compile(r"audio[- ]only|telephone (?:visit|session|encounter)|via (?:tele)?phone"),
+                   ("audio", "telephone", "phone"))
+
+NEW_PATIENT_RULE = (re.compile(r"new patient|initial (?:psychiatric )?(?:visit|evaluation|assessment)|intake"),
+                    ("new patient", "initial", "intake"))
+ESTABLISHED_RULE = (re.compile(r"return visit|follow[- ]?up visit|established patient|med(?:ication)? check"),
+                    ("return", "follow", "established", "check"))
+
+DIAGNOSTIC_EVAL_RULE = (re.compile(
+    r"psychiatric (?:diagnostic )?evaluation|diagnostic evaluation|initial psychiatric assessment"
+), ("evaluation", "assessment"))
+EVALUATION_MANAGEMENT_RULE = (re.compile(
+    r"medication management|pharmacologic management|medication treatment plan|\be/m\b"
+    r"|evaluation and management|prescri(?:be|bed|ption)"
+), ("management", "medication treatment", "e/m", "prescri"))
+PSYCHOTHERAPY_RULE = (re.compile(r"\bpsychotherapy\b"), ("psychotherapy",))
+THERAPY_MENTION_RULE = (re.compile(
+    r"cognitive behavioral therapy|\bcbt\b|supportive therapy|\bdbt\b|therapy session|counsel(?:ing|ed)"
+), ("therapy", "cbt", "dbt", "counsel"))
+CRISIS_RULE = (re.compile(r"psychotherapy for crisis|crisis (?:intervention|psychotherapy|session)"), ("crisis",))
+FAMILY_WITH_PATIENT_RULE = (re.compile(r"family (?:psycho)?therapy[^.\n]{0,40}with (?:the )?patient present"),
+                            ("family",))
+FAMILY_WITHOUT_PATIENT_RULE = (re.compile(r"family (?:psycho)?therapy[^.\n]{0,40}without (?:the )?patient"),
+                               ("family",))
+GROUP_RULE = (re.compile(r"group (?:psycho)?therapy"), ("group",))
+INTERACTIVE_RULE = (re.compile(r"interactive complexity"), ("interactive",))
+
+# A service mention in a sentence with one of these cues, or in a paragraph
+# under one of these headings, describes the past rather than this encounter
+HISTORY_CUE_RE = re.compile(
+    r"\b(?:prior|previous(?:ly)?|formerly|history of|hx of|in the past|used to|has tried|had tried|underwent"
+    r"|last (?:year|month|spring|summer|fall|winter)|(?:years?|months?) ago|another (?:provider|therapist|clinician)"
+    r"|(?:in|since|during) (?:19|20)\d{2})\b"
+)
+HISTORY_HEADING_RE = re.compile(
+    r"(?:past (?:medical |psychiatric )?history|psychiatric history|treatment history|prior treatment"
+    r"|family history|social history)\s*:?"
+)
+_SENTENCE_END_RE = re.compile(r"[.!?](?:\s|$)|\n")
+
+PSYCHOTHERAPY_TIME_ANCHORS = ("psychotherapy",)
+TOTAL_TIME_ANCHORS = ("time", "duration", "length")
+CLOCK_RANGE_ANCHORS = ("start",)
+
+
+# -----------------------------
+# DATA STRUCTURES
+# -----------------------------
+@dataclass
+class EncounterFacts:
+    total_minutes: int = None
+    psychotherapy_minutes: int = None
+    modality: str = "in_person"          # in_person | audio_video | audio_only
+    patient_status: str = None           # new | established
+    services: set = field(default_factory=set)
+    history_services: set = field(default_factory=set)  # mentioned only as history
+    therapy_mentioned: bool = False
+
+
+@dataclass
+class CptRuleResult:
+    cpt_codes: list = field(default_factory=list)
+    hcpcs_codes: list = field(default_factory=list)
+    facts: EncounterFacts = None
+    reasons: list = field(default_factory=list)
+
+    @property
+    def needs_model(self):
+        """True when the rules could not code the note confidently."""
+        return bool(self.reasons) or not self.cpt_codes
+
+    def as_dict(self):
+        """Same structure as the CPT prompt output."""
+        return {"cpt_codes": self.cpt_codes, "hcpcs_codes": self.hcpcs_codes}
+
+
+# -----------------------------
+# STEP 1: EXTRACT FACTS
+# -----------------------------
+def _first_int(groups):
+    for g in groups:
+        if g is not None:
+            return g
+    return None
+
+
+def _to_minutes(match):
+    minutes, hours = match.groups()
+    if minutes is not None:
+        return int(minutes)
+    return round(float(hours) * 60)
+
+
+def _clock_minutes(match):
+    h1, m1, ap1, h2, m2, ap2 = match.groups()
+
+    def to_24h(h, ap):
+        h = int(h) % 12 if ap else int(h)
+        return h + 12 if ap and ap.startswith("p") else h
+
+    start = to_24h(h1, ap1) * 60 + int(m1)
+    end = to_24h(h2, ap2 or ap1) * 60 + int(m2)
+    return (end - start) % (24 * 60)
+
+
+def _search(pattern, text, anchors, before=60, after=120):
+    """First match of `pattern` inside windows around the anchor words."""
+    best = None
+    for anchor in anchors:
+        i = text.find(anchor)
+        while i != -1:
+            if best is not None and i - before > best.start():
+                break
+            # Windows of nearby hits overlap: search them as one window, once
+            end = i + len(anchor) + after
+            j = text.find(anchor, i + len(anchor))
+            while j != -1 and j - before <= end:
+                end = j + len(anchor) + after
+                j = text.find(anchor, j + len(anchor))
+            m = pattern.search(text, max(0, i - before), end)
+            if m and (best is None or m.start() < best.start()):
+                best = m
+            i = j
+    return best
+
+
+def _search_all(pattern, text, anchors, before=60, after=120):
+    """Every match of `pattern` inside the anchor windows, in order."""
+    found = {}
+    for anchor in anchors:
+        i = text.find(anchor)
+        while i != -1:
+            for m in pattern.finditer(text, max(0, i - before), i + len(anchor) + after):
+                found.setdefault(m.start(), m)
+            i = text.find(anchor, i + len(anchor))
+    return [found[start] for start in sorted(found)]
+
+
+def _is_history(text, match):
+    """The match sits in a sentence about the past or in a history paragraph."""
+    start = max(text.rfind(".", 0, match.start()), text.rfind("\n", 0, match.start())) + 1
+    end = _SENTENCE_END_RE.search(text, match.end())
+    if HISTORY_CUE_RE.search(text, start, end.start() if end else len(text)):
+        return True
+    paragraph = text.rfind("\n\n", 0, match.start())
+    heading = text[paragraph + 1 if paragraph != -1 else 0:match.start()].lstrip()
+    return HISTORY_HEADING_RE.match(heading) is not None
+
+
+def _current(pattern, text, anchors):
+    """First match of `pattern` that is about this encounter, or None."""
+    for m in _search_all(pattern, text, anchors):
+        if not _is_history(text, m):
+            return m
+    return None
+
+
+def _mentions(rule, text):
+    pattern, anchors = rule
+    return _search(pattern, text, anchors) is not None
+
+
+def _service(facts, name, rule, text):
+    """Add `name` to the services when the note documents it for this encounter."""
+    pattern, anchors = rule
+    if _current(pattern, text, anchors) is not None:
+        facts.services.add(name)
+        return True
+    if _search(pattern, text, anchors) is not None:
+        facts.history_services.add(name)
+    return False
+
+
+def extract_facts(note):
+    """Pull session minutes, modality and service type out of a note."""
+    facts = EncounterFacts()
+    text = (note or "").lower()
+
+    m = _current(PSYCHOTHERAPY_TIME_RE, text, PSYCHOTHERAPY_TIME_ANCHORS)
+    if m:
+        facts.psychotherapy_minutes = int(_first_int(m.groups()))
+
+    m = _search(TOTAL_TIME_RE, text, TOTAL_TIME_ANCHORS)
+    if m:
+        facts.total_minutes = _to_minutes(m)
+    else:
+        m = _search(CLOCK_RANGE_RE, text, CLOCK_RANGE_ANCHORS)
+        if m:
+            facts.total_minutes = _clock_minutes(m)
+
+    if _mentions(AUDIO_VIDEO_RULE, text):
+        facts.modality = "audio_video"
+    elif _mentions(AUDIO_ONLY_RULE, text):
+        facts.modality = "audio_only"
+
+    if _mentions(NEW_PATIENT_RULE, text):
+        facts.patient_status = "new"
+    elif _mentions(ESTABLISHED_RULE, text):
+        facts.patient_status = "established"
+
+    _service(facts, "crisis", CRISIS_RULE, text)
+    if not _service(facts, "family_with_patient", FAMILY_WITH_PATIENT_RULE, text):
+        _service(facts, "family_without_patient", FAMILY_WITHOUT_PATIENT_RULE, text)
+    _service(facts, "group", GROUP_RULE, text)
+    if facts.patient_status != "established":
+        _service(facts, "diagnostic_eval", DIAGNOSTIC_EVAL_RULE, text)
+    _service(facts, "em", EVALUATION_MANAGEMENT_RULE, text)
+    if facts.psychotherapy_minutes:
+        facts.services.add("psychotherapy")
+    else:
+        _service(facts, "psychotherapy", PSYCHOTHERAPY_RULE, text)
+    _service(facts, "interactive_complexity", INTERACTIVE_RULE, text)
+    facts.history_services -= facts.services
+    facts.therapy_mentioned = _mentions(THERAPY_MENTION_RULE, text)
+    return facts
+
+
+# -----------------------------
+# STEP 2: APPLY CODING RULES
+# -----------------------------
+def _by_minutes(table, minutes):
+    for low, high, code, desc in table:
+        if minutes >= low and (high is None or minutes <= high):
+            return code, desc
+    return None
+
+
+def _entry(code, desc, modifiers=()):
+    modifiers = [m for m in modifiers if m]
+    return {
+        "code": code,
+        "description": desc,
+        "modifier": ", ".join(modifiers),
+        "description_modifier": "; ".join(MODIFIERS[m] for m in modifiers),
+    }
+
+
+def apply_rules(facts):
+    """Turn extracted facts into CPT/HCPCS candidates (or reasons to ask the model)."""
+    result = CptRuleResult(facts=facts)
+    tele = {"audio_video": "95", "audio_only": "93"}.get(facts.modality)
+    services = facts.services
+
+    primary = services & {"diagnostic_eval", "crisis", "family_with_patient",
+                          "family_without_patient", "group"}
+    if len(primary) > 1:
+        result.reasons.append(f"Conflicting service types: {sorted(primary)}")
+        return result
+
+    if "diagnostic_eval" in services:
+        code, desc = DIAGNOSTIC_EVAL_MEDICAL if "em" in services else DIAGNOSTIC_EVAL
+        result.cpt_codes.append(_entry(code, desc, [tele]))
+
+    elif "crisis" in services:
+        minutes = facts.psychotherapy_minutes or facts.total_minutes
+        if minutes is None or minutes < 30:
+            result.reasons.append("Crisis psychotherapy without 30+ documented minutes")
+            return result
+        result.cpt_codes.append(_entry(*CRISIS_FIRST, [tele]))
+        extra_units = max(0, (minutes - 75) // 30 + 1) if minutes >= 75 else 0
+        for _ in range(extra_units):
+            result.cpt_codes.append(_entry(*CRISIS_ADDON, [tele]))
+
+    elif services & {"family_with_patient", "family_without_patient"}:
+        minutes = facts.psychotherapy_minutes or facts.total_minutes
+        if minutes is None or minutes < 26:
+            result.reasons.append("Family psychotherapy without 26+ documented minutes")
+            return result
+        pair = FAMILY_WITH_PATIENT if "family_with_patient" in services else FAMILY_WITHOUT_PATIENT
+        result.cpt_codes.append(_entry(*pair, [tele]))
+
+    elif "group" in services:
+        result.cpt_codes.append(_entry(*GROUP_PSYCHOTHERAPY, [tele]))
+
+    elif "em" in services and "psychotherapy" in services:
+        if facts.psychotherapy_minutes is None:
+            result.reasons.append("E/M with psychotherapy but no separate psychotherapy time")
+            return result
+        addon = _by_minutes(PSYCHOTHERAPY_ADDON_CODES, facts.psychotherapy_minutes)
+        if addon is None:
+            result.reasons.append("Psychotherapy under 16 minutes")
+            return result
+        if facts.total_minutes is None or facts.patient_status is None:
+            # E/M level then depends on medical decision making
+            result.reasons.append("E/M level needs MDM review (no separable E/M time)")
+            return result
+        em = _by_minutes(
+            EM_NEW_CODES if facts.patient_status == "new" else EM_ESTABLISHED_CODES,
+            facts.total_minutes - facts.psychotherapy_minutes,
+        )
+        if em is None:
+            result.reasons.append("E/M time below the lowest level")
+            return result
+        result.cpt_codes.append(_entry(*em, ["25", tele]))
+        result.cpt_codes.append(_entry(*addon, [tele]))
+
+    elif "psychotherapy" in services:
+        minutes = facts.psychotherapy_minutes or facts.total_minutes
+        code = _by_minutes(PSYCHOTHERAPY_CODES, minutes) if minutes is not None else None
+        if code is None:
+            result.reasons.append("Psychotherapy without 16+ documented minutes")
+            return result
+        result.cpt_codes.append(_entry(*code, [tele]))
+
+    elif "em" in services:
+        if facts.therapy_mentioned:
+            result.reasons.append("Therapy mentioned without psychotherapy time; may be E/M + add-on")
+            return result
+        if facts.total_minutes is None or facts.patient_status is None:
+            result.reasons.append("E/M level needs MDM review (no total time or patient status)")
+            return result
+        table = EM_NEW_CODES if facts.patient_status == "new" else EM_ESTABLISHED_CODES
+        em = _by_minutes(table, facts.total_minutes)
+        if em is None:
+            result.reasons.append("E/M time below the lowest level")
+            return result
+        result.cpt_codes.append(_entry(*em, [tele]))
+        threshold = PROLONGED_THRESHOLDS.get(em[0])
+        if threshold and facts.total_minutes >= threshold:
+            units = (facts.total_minutes - threshold) // 15 + 1
+            result.hcpcs_codes.extend(
+                {"code": PROLONGED_HCPCS[0], "description": PROLONGED_HCPCS[1]} for _ in range(units)
+            )
+    elif facts.history_services:
+        result.reasons.append(f"Services mentioned only as history: {sorted(facts.history_services)}")
+        return result
+    else:
+        result.reasons.append("No recognizable service type")
+        return result
+
+    if "interactive_complexity" in services and result.cpt_codes:
+        result.cpt_codes.append(_entry(*INTERACTIVE_COMPLEXITY))
+    return result
+
+
+def precode_cpt(note):
+    """
+    Run the rules engine on a (redacted) note.
+
+    Returns a CptRuleResult; use `.as_dict()` when `.needs_model` is False,
+    otherwise send the note to PROPMT_FOR_cpt_CODES.
+    """
+    return apply_rules(extract_facts(note))
+
+
+# -----------------------------
+# Run interactively
+# -----------------------------
+if __name__ == "__main__":
+    import json
+    import sys
+    import timeit
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "REDACTED_result.txt"
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        note = f.read()
+
+    res = precode_cpt(note)
+    print(json.dumps(res.as_dict(), indent=2))
+    print("needs_model:", res.needs_model, res.reasons)
+    runs = 200
+    per_call = timeit.timeit(lambda: precode_cpt(note), number=runs) / runs
+    print(f"{per_call * 1e6:.0f} µs per note ({len(note)} chars)")
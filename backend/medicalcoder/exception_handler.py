@@ -1,14 +1,68 @@
 from typing import Any, Dict
 from rest_framework.views import exception_handler as drf_exception_handler
 from rest_framework.exceptions import (
-    ValidationError, NotAuthenticated, AuthenticationFailed, PermissionDenied
+    ValidationError, NotAuthenticated, AuthenticationFailed, PermissionDenied, Throttled
 )
 from rest_framework import status
 from .api_response import fail
+from .admission import PipelineBusy
+from .hashing_pool import HashingBusy
+from .progress import JobIdTaken
+from .upstream_limits import UpstreamBusy
 
 def custom_exception_handler(exc: Exception, context: Dict[str, Any]):
     response = drf_exception_handler(exc, context)
 
+    if isinstance(exc, HashingBusy):
+        response = fail(
+            message="Server busy, please retry in a moment",
+            code="SERVER_BUSY",
+            http_status=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc)
+        )
+        response["Retry-After"] = str(exc.retry_after)
+        return response
+
+    if isinstance(exc, PipelineBusy):
+        response = fail(
+            message="Too many documents in progress, please retry later",
+            code="PIPELINE_BUSY",
+            http_status=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc)
+        )
+        response["Retry-After"] = str(exc.retry_after)
+        return response
+
+    if isinstance(exc, UpstreamBusy):
+        response = fail(
+            message="OCR/model services are busy, please retry later",
+            code="UPSTREAM_BUSY",
+            http_status=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc)
+        )
+        response["Retry-After"] = str(exc.retry_after)
+        return response
+
+    if isinstance(exc, JobIdTaken):
+        return fail(
+            message="Job id already in use, send a new one",
+            code="JOB_ID_IN_USE",
+            http_status=status.HTTP_409_CONFLICT,
+            detail=str(exc)
+        )
+
+    if isinstance(exc, Throttled):
+        retry_after = response.get("Retry-After")
+        response = fail(
+            message="Upload rate limit reached, please retry later",
+            code="RATE_LIMITED",
+            http_status=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc.detail)
+        )
+        if retry_after:
+            response["Retry-After"] = retry_after
+        return response
+
     if response is None:
         return fail(
             message="Internal server error",
@@ -0,0 +1,315 @@
+"""
+exports.py — Flat code exports for billing (CSV / JSONL / Parquet)
+
+One row per document-code: ICD-10 specified codes, CPT codes (with their
+modifier) and HCPCS codes, each with the owning document's id, owner, file
+and creation time. Documents are read with .iterator(chunk_size) and rows are
+written in batches, so memory stays bounded whatever the date range.
+
+    GET  medical-documents/export/?file_format=csv&start=2025-01-01&end=2025-01-31
+         streams small ranges directly (<= EXPORT_SYNC_MAX_DOCUMENTS documents)
+    POST medical-documents/exports/   runs an ExportJob in the background and
+         writes the file under EXPORT_ROOT (the only option for Parquet, which
+         needs `pyarrow`)
+
+EXPORT_WORKERS = 0 leaves jobs pending for `manage.py run_export_jobs`, which
+also requeues running jobs whose lease (EXPORT_JOB_LEASE_SECONDS) expired
+because their process died, like coding_jobs.requeue_expired. A job is
+tried up to EXPORT_JOB_MAX_ATTEMPTS times.
+
+CSV cells starting with = + - @ (or a tab / carriage return) are prefixed
+with a single quote so spreadsheets do not evaluate them as formulas.
+"""
+
+import csv
+import importlib.util
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .artifacts import decompress
+from .renderers import encode_json
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "document_id", "user_id", "file_path", "document_created_at",
+    "code_type", "code", "description", "modifier", "modifier_description",
+)
+CODE_TYPES = ("icd10", "cpt", "hcpcs")
+FORMATS = {
+    # format: (content type, file extension, streamable)
+    "csv": ("text/csv", "csv", True),
+    "jsonl": ("application/x-ndjson", "jsonl", True),
+    "parquet": ("application/vnd.apache.parquet", "parquet", False),
+}
+DOCUMENT_FIELDS = (
+    "id", "user_id", "file_path", "created_at", "payload_external",
+    "icd_specified_codes", "cpt_codes", "hcpcs_codes",
+)
+
+
+# -----------------------------
+# STEP 1: SELECT DOCUMENTS
+# -----------------------------
+def export_queryset(user, filters):
+    """Documents matching validated export `filters` (see ExportRequestSerializer)."""
+    from .models import MedicalDocument
+
+    queryset = MedicalDocument.objects.all()
+    if not (filters.get("all_users") and user.is_staff):
+        queryset = queryset.for_user(user)
+    if filters.get("status"):
+        queryset = queryset.filter(status=filters["status"])
+    # Whole days in the current timezone, as ranges so the created_at indexes apply
+    tz = timezone.get_current_timezone()
+    if filters.get("start"):
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(filters["start"], time.min), tz))
+    if filters.get("end"):
+        end = filters["end"] + timedelta(days=1)
+        queryset = queryset.filter(created_at__lt=timezone.make_aware(datetime.combine(end, time.min), tz))
+    return queryset.order_by("created_at", "id")
+
+
+# -----------------------------
+# STEP 2: FLATTEN CODES
+# -----------------------------
+def _items(value, key=None):
+    if key and isinstance(value, dict):
+        value = value.get(key)
+    return [item for item in value or [] if isinstance(item, dict) and item.get("code")]
+
+
+def document_code_rows(document, codes, code_types=CODE_TYPES):
+    """Export rows (tuples in COLUMNS order) for one document's code fields."""
+    base = (document["id"], document["user_id"], document["file_path"], document["created_at"].isoformat())
+    if "icd10" in code_types:
+        for item in _items(codes.get("icd_specified_codes"), "icd10_codes"):
+            yield (*base, "icd10", item["code"], item.get("description", ""), "", "")
+    if "cpt" in code_types:
+        # CPT items carry their modifier; the `modifiers` field is derived from them
+        for item in _items(codes.get("cpt_codes"), "cpt"):
+            yield (*base, "cpt", item["code"], item.get("description", ""),
+                   item.get("modifier") or "", item.get("description_modifier") or "")
+    if "hcpcs" in code_types:
+        for item in _items(codes.get("hcpcs_codes")):
+            yield (*base, "hcpcs", item["code"], item.get("description", ""), "", "")
+
+
+def _external_codes(document_ids):
+    from .models import DocumentArtifact
+
+    rows = DocumentArtifact.objects.filter(
+        document_id__in=document_ids, kind=DocumentArtifact.KIND_CODES
+    ).values_list("document_id", "codec", "data")
+    return {document_id: decompress(codec, data) for document_id, codec, data in rows}
+
+
+def iter_export_rows(queryset, code_types=CODE_TYPES, chunk_size=None):
+    """Rows for every document in `queryset`, one chunk of documents in memory at a time."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    documents = queryset.values(*DOCUMENT_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(documents, chunk_size))
+        if not chunk:
+            return
+        # Compressed payloads: one artifact query per chunk, not per document
+        external = _external_codes([d["id"] for d in chunk if d["payload_external"]])
+        for document in chunk:
+            codes = external.get(document["id"], {}) if document["payload_external"] else document
+            yield from document_code_rows(document, codes, code_types)
+
+
+# -----------------------------
+# STEP 3: WRITERS
+# -----------------------------
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_safe(row):
+    """`row` with text cells that a spreadsheet would run as a formula prefixed by "'"."""
+    return [f"'{value}" if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) else value
+            for value in row]
+
+
+def iter_export_chunks(fmt, rows, batch_size=None):
+    """Encoded CSV / JSONL output as a sequence of byte chunks."""
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        for batch in _batches(rows, batch_size):
+            writer.writerows(csv_safe(row) for row in batch)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    elif fmt == "jsonl":
+        for batch in _batches(rows, batch_size):
+            yield b"".join(encode_json(dict(zip(COLUMNS, row))) + b"\n" for row in batch)
+    else:
+        raise ValueError(f"{fmt} exports cannot be streamed")
+
+
+def parquet_available():
+    # Optional dependency, only imported when a Parquet file is written (it is slow to load)
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _write_parquet(rows, path, batch_size):
+    try:
+        import pyarrow
+        import pyarrow.parquet as pyarrow_parquet
+    except ImportError:
+        raise RuntimeError("Parquet exports need `pyarrow`; install it or use csv/jsonl.") from None
+    schema = pyarrow.schema([
+        ("document_id", pyarrow.int64()),
+        ("user_id", pyarrow.int64()),
+        *((name, pyarrow.string()) for name in COLUMNS[2:]),
+    ])
+    with pyarrow_parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in _batches(rows, batch_size):
+            # One row group per batch
+            columns = [pyarrow.array(column, type=field.type) for column, field in zip(zip(*batch), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+
+
+def write_export(fmt, rows, path, batch_size=None):
+    """Write an export file; returns the number of rows written."""
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    counted = _Counter(rows)
+    if fmt == "parquet":
+        _write_parquet(counted, path, batch_size)
+    else:
+        with open(path, "wb") as f:
+            for chunk in iter_export_chunks(fmt, counted, batch_size):
+                f.write(chunk)
+    return counted.count
+
+
+class _Counter:
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+# -----------------------------
+# STEP 4: BACKGROUND JOBS
+# -----------------------------
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS, thread_name_prefix="export")
+    return _executor
+
+
+def export_path(job):
+    return os.path.join(settings.EXPORT_ROOT, f"{job.pk}.{FORMATS[job.format][1]}")
+
+
+def submit_export_job(job):
+    """Run `job` on the export pool once the creating transaction commits."""
+    if settings.EXPORT_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_export_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def run_export_job(job_id):
+    """
+    Claim a pending ExportJob and write its file. Returns the job, or None if
+    it was already claimed (or its lease expired and another run took it over).
+    """
+    from .models import ExportJob
+
+    started = timezone.now()
+    claimed = ExportJob.objects.filter(pk=job_id, status=ExportJob.STATUS_PENDING).update(
+        status=ExportJob.STATUS_RUNNING, started_at=started, attempts=F("attempts") + 1
+    )
+    if not claimed:
+        return None
+    from .serializers import ExportRequestSerializer
+
+    job = ExportJob.objects.select_related("user").get(pk=job_id)
+    path = export_path(job)
+    # Written under a per-run name: a run that lost its lease never writes over the new run's file
+    tmp = f"{path}.{started.timestamp():.0f}.tmp"
+    fields = {}
+    try:
+        os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+        request = ExportRequestSerializer(data={**job.filters, "file_format": job.format})
+        request.is_valid(raise_exception=True)
+        filters = request.validated_data
+        queryset = export_queryset(job.user, filters)
+        fields["document_count"] = queryset.count()
+        fields["row_count"] = write_export(job.format, iter_export_rows(queryset, filters["code_types"]), tmp)
+        fields["file_path"] = path
+        fields["status"] = ExportJob.STATUS_COMPLETED
+    except Exception as e:
+        logger.exception("Export job %s failed (attempt %d)", job_id, job.attempts)
+        fields["status"] = ExportJob.STATUS_FAILED
+        fields["error"] = str(e)
+    fields["finished_at"] = timezone.now()
+
+    # Only if this run still holds the job
+    mine = ExportJob.objects.filter(pk=job_id, status=ExportJob.STATUS_RUNNING, started_at=started)
+    with transaction.atomic():
+        updated = mine.update(**fields)
+        if updated and fields["status"] == ExportJob.STATUS_COMPLETED:
+            os.replace(tmp, path)
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    if not updated:
+        logger.warning("Export job %s was requeued while running; dropping this run's output", job_id)
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def requeue_expired_exports(lease_seconds=None):
+    """Requeue running exports older than the lease (their process died). Returns how many."""
+    from .models import ExportJob
+
+    lease_seconds = lease_seconds or settings.EXPORT_JOB_LEASE_SECONDS
+    expired = ExportJob.objects.filter(
+        status=ExportJob.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=lease_seconds),
+    )
+    expired.filter(attempts__gte=settings.EXPORT_JOB_MAX_ATTEMPTS).update(
+        status=ExportJob.STATUS_FAILED, error="Export lease expired on the last attempt.", finished_at=timezone.now()
+    )
+    return expired.update(status=ExportJob.STATUS_PENDING, started_at=None)
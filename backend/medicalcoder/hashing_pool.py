@@ -0,0 +1,67 @@
+"""
+hashing_pool.py — Dedicated, bounded pool for password hashing
+
+Password hashes are deliberately slow. Run directly on request threads, a
+login burst (shift start) hashes on every thread at once and starves the
+CPU that uploads need. All hashing goes through `run_hashing`, which
+executes it on a small dedicated thread pool (bcrypt, argon2-cffi and
+hashlib's PBKDF2 release the GIL), so at most HASHING_WORKERS hashes run at
+a time.
+
+The calling request thread still blocks while its hash waits and runs: the
+pool bounds hashing CPU, it does not free request workers. What it bounds
+is the wait: new work is refused with HashingBusy once HASHING_MAX_PENDING
+jobs are queued, and a caller gives up after HASHING_TIMEOUT_SECONDS, so a
+burst fails fast with 429 + Retry-After instead of piling up.
+
+No Django imports: database.py (passlib) uses the same pool.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", "2"))  # 0 = hash inline
+HASHING_MAX_PENDING = int(os.getenv("HASHING_MAX_PENDING", "32"))
+HASHING_TIMEOUT_SECONDS = float(os.getenv("HASHING_TIMEOUT_SECONDS", "10"))
+HASHING_RETRY_AFTER_SECONDS = 1
+
+
+class HashingBusy(RuntimeError):
+    """The hashing pool is saturated; the client should retry shortly."""
+
+    retry_after = HASHING_RETRY_AFTER_SECONDS
+
+
+_lock = threading.Lock()
+_executor = None
+_slots = threading.BoundedSemaphore(max(HASHING_MAX_PENDING, 1))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=HASHING_WORKERS, thread_name_prefix="hashing")
+    return _executor
+
+
+def run_hashing(fn, *args, **kwargs):
+    """Run `fn(*args, **kwargs)` on the hashing pool and wait for the result."""
+    if HASHING_WORKERS <= 0:
+        return fn(*args, **kwargs)
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy("Too many concurrent password operations, retry shortly.")
+    try:
+        future = _get_executor().submit(fn, *args, **kwargs)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASHING_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        # The hash keeps its slot until it finishes; this request stops waiting
+        raise HashingBusy("Password operation timed out, retry shortly.") from None
@@ -1,8 +1,25 @@
 import requests
 import paramiko
+import contextvars
 import os
+import shutil
 import sys
-from pathlib import Path
+import tempfile
+import threading
+import uuid
+
+try:
+    from .checkpoints import active_store, checkpoint_scope, checkpointed, document_key
+    from .ocr_cache import ocr_with_page_cache
+    from .progress import report
+    from .redaction_batch import REDACTION_BATCH_SIZE, demultiplex, get_batcher, get_cache, text_key
+    from .upstream_limits import UPSTREAM_LIMITS, UpstreamBusy, upstream_slot
+except ImportError:  # run as a script from medicalcoder/
+    from checkpoints import active_store, checkpoint_scope, checkpointed, document_key
+    from ocr_cache import ocr_with_page_cache
+    from progress import report
+    from redaction_batch import REDACTION_BATCH_SIZE, demultiplex, get_batcher, get_cache, text_key
+    from upstream_limits import UPSTREAM_LIMITS, UpstreamBusy, upstream_slot
 
 # -----------------------------
 # CONFIGURATION
@@ -22,31 +39,72 @@ HIPAA_URL = "http://110.93.225.217:8081/redact-text-batched"
  
 
 #LOCAL_INPUT_FILE = r"( Coded ) EMCT_9200_Berry_20250724_2_Robinson, Christopher_O.pdf"
-LOCAL_TXT_RESULT = "result.txt"
 REMOTE_TEST_DIR = "ham_hippa_test"
 
 REMOTE_OUTPUT_DIR = "ham_hippa_output"
 
+# Stages return None on failure; each is retried (resuming from checkpoints)
+STAGE_ATTEMPTS = int(os.getenv("HIPAA_STAGE_ATTEMPTS", "2"))
+
+# -----------------------------
+# HTTP CONNECTION POOL
+# -----------------------------
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """Process-wide session: keep-alive connections to the OCR and redaction APIs."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                pool_size = max(UPSTREAM_LIMITS.get("ocr", 1), UPSTREAM_LIMITS.get("redaction", 1))
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _reset_session():
+    # A forked child (gunicorn --preload, run_coding_workers) must not reuse the parent's sockets
+    global _session, _session_lock
+    _session, _session_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_session)
+
+
 # -----------------------------
 # STEP 1: RUN OCR EXTRACTION
 # -----------------------------
-def run_ocr(file_path):
+# Page cache stats of the last fetch_ocr_text() in this context, for run_ocr's progress event
+_ocr_cache_stats = contextvars.ContextVar("ocr_cache_stats", default=None)
+
+
+def post_ocr(pdf):
+    """OCR one PDF (bytes) and return its text."""
+    with upstream_slot("ocr"):
+        files = [('files', ('test.pdf', pdf, 'application/pdf'))]
+        response = http_session().post(OCR_URL, headers=OCR_HEADERS, files=files, timeout=1000)
+
+    response.raise_for_status()
+    data = response.json()
+    ocr_text = data.get("ocr_result", "")
+    if not ocr_text:
+        raise ValueError("OCR result is empty.")
+    return ocr_text
+
+
+def fetch_ocr_text(file_path):
     try:
         print("[1] Running OCR on:", file_path)
-        with open(file_path, "rb") as f:
-            files = [('files', ('test.pdf', f, 'application/pdf'))]
-            response = requests.post(OCR_URL, headers=OCR_HEADERS, files=files, timeout=1000)
-        
-        response.raise_for_status()
-        data = response.json()
-        ocr_text = data.get("ocr_result", "")
-        if not ocr_text:
-            raise ValueError("OCR result is empty.")
-        
-        with open(LOCAL_TXT_RESULT, "w", encoding="utf-8") as out:
-            out.write(ocr_text)
-        print(f"[✓] OCR completed. Saved to {LOCAL_TXT_RESULT}")
-        return LOCAL_TXT_RESULT
+        # Pages OCRed before (same content hash) come from ocr_cache.py
+        ocr_text, stats = ocr_with_page_cache(file_path, post_ocr)
+        _ocr_cache_stats.set(stats)
+        return ocr_text
     
     except requests.exceptions.RequestException as e:
         print(f"[✗] OCR request failed: {e}")
@@ -56,6 +114,19 @@ def run_ocr(file_path):
         # sys.exit(1)
 
 
+def run_ocr(file_path):
+    """OCR text of `file_path` (the "ocr" checkpoint), or None."""
+    ocr_text_result = _stage("ocr", fetch_ocr_text, file_path, report_resume=False)
+    if not ocr_text_result:
+        return None
+    print(f"[✓] OCR completed ({len(ocr_text_result)} characters)")
+    stats = _ocr_cache_stats.get()
+    _ocr_cache_stats.set(None)
+    cache_stats = {k: stats[k] for k in ("cached_pages", "seconds_saved")} if stats else {}
+    report("ocr", pages=ocr_text_result.count("<page "), characters=len(ocr_text_result), **cache_stats)
+    return ocr_text_result
+
+
 # -----------------------------
 # STEP 2: UPLOAD TO SFTP
 # -----------------------------
@@ -78,6 +149,7 @@ def upload_to_sftp(local_path, remote_dir):
 
         sftp.put(local_path, remote_full_path)
         print(f"[✓] File uploaded successfully: {remote_full_path}")
+        report("upload")
 
         sftp.close()
         transport.close()
@@ -92,23 +164,40 @@ def upload_to_sftp(local_path, remote_dir):
 # -----------------------------
 # STEP 3: CALL HIPAA REDACTION API
 # -----------------------------
+def post_redaction(paths, output_dir):
+    """
+    One redaction API call for `paths`; returns one result dict per path.
+    A single path is sent as {"path": ...}, the form the API is known to
+    take. Several (REDACTION_BATCH_SIZE > 1 only) are sent as
+    {"paths": [...]}, a format not yet confirmed with the API.
+    """
+    payload = {"output_path": f"{SFTP_ROOT}/{output_dir}"}
+    if len(paths) == 1:
+        payload["path"] = paths[0]
+    else:
+        payload["paths"] = list(paths)
+    response = http_session().post(HIPAA_URL, json=payload, timeout=2000)
+    response.raise_for_status()
+    data = response.json()
+    return [data] if len(paths) == 1 else demultiplex(paths, data)
+
+
 def run_hipaa_redaction(input_remote_path, output_dir):
     try:
         print(f"[3] Running HIPAA redaction for: {input_remote_path}")
 
-        payload = {
-            "path": input_remote_path,
-            "output_path": f"{SFTP_ROOT}/{output_dir}"
-        }
-
-        response = requests.post(HIPAA_URL, json=payload, timeout=2000)
-        response.raise_for_status()
-        data = response.json()
+        if REDACTION_BATCH_SIZE > 1:
+            # Sent together with other documents' redactions (redaction_batch.py)
+            data = get_batcher(post_redaction).submit(input_remote_path, output_dir).result()
+        else:
+            with upstream_slot("redaction"):
+                data = post_redaction([input_remote_path], output_dir)[0]
 
         if data.get("status") != "success":
             raise ValueError(f"Redaction failed: {data}")
 
         print(f"[✓] HIPAA redaction completed. Output file: {data.get('redacted_file')}")
+        report("redaction")
         # print(f"PII Count: {data.get('pii_count')}")
         return data
 
@@ -134,45 +223,146 @@ def download_from_sftp(remote_file_path, local_dest):
         os.makedirs(os.path.dirname(local_dest), exist_ok=True)
         sftp.get(remote_file_path, local_dest)
         print(f"[✓] File downloaded successfully: {local_dest}")
+        report("download")
 
         sftp.close()
         transport.close()
 
+        return local_dest
+
     except Exception as e:
         print(f"[✗] SFTP download failed: {e}")
         # sys.exit(1)
 
 
-# -----------------------------
-# MAIN WORKFLOW
-# -----------------------------
-def hipaa_main(LOCAL_INPUT_FILE, REMOTE_TEST_DIR=REMOTE_TEST_DIR, REMOTE_OUTPUT_DIR=REMOTE_OUTPUT_DIR):
+def read_redacted(remote_file_path):
+    """Download the redacted text and return its content (the "download" checkpoint)."""
+    work_dir = tempfile.mkdtemp(prefix="hipaa-")  # private to the service user (0700)
     try:
-        
-        ocr_result_file = run_ocr(LOCAL_INPUT_FILE)
+        local_dest = os.path.join(work_dir, f"redacted-{os.path.basename(remote_file_path)}")
+        if download_from_sftp(remote_file_path, local_dest) is None:
+            return None
+        with open(local_dest, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def redact_remote(ocr_text, document, remote_in_dir, remote_out_dir):
+    """
+    Upload and redact one document's OCR text; returns the remote path of the
+    redacted file (the "redaction" checkpoint) or None. The uploaded file is
+    named after the document plus a per-run suffix, so concurrent runs never
+    share a file on either side.
+    """
+    name = f"{document[:16]}-{uuid.uuid4().hex[:12]}.txt"
+    work_dir = tempfile.mkdtemp(prefix="hipaa-")  # private to the service user (0700)
+    try:
+        local_txt_path = os.path.join(work_dir, name)
+        with open(local_txt_path, "w", encoding="utf-8") as out:
+            out.write(ocr_text)
 
-        
-        remote_txt_path = upload_to_sftp(ocr_result_file, REMOTE_TEST_DIR)
+        remote_txt_path = _retry("upload", upload_to_sftp, local_txt_path, remote_in_dir)
+        if not remote_txt_path:
+            return None
 
-    
-        hipaa_response = run_hipaa_redaction(remote_txt_path, REMOTE_OUTPUT_DIR)
+        hipaa_response = _retry("redaction", run_hipaa_redaction, remote_txt_path, remote_out_dir)
+        if not hipaa_response:
+            return None
 
-        
         redacted_remote_file = hipaa_response.get("redacted_file")
-        if redacted_remote_file:
-            local_output_path = os.path.join(Path.cwd(), os.path.basename(redacted_remote_file))
-            download_from_sftp(redacted_remote_file, local_output_path)
-        else:
+        if not redacted_remote_file:
             print("[✗] No redacted file path returned in API response.")
+        return redacted_remote_file or None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-        print("\n[✔] Workflow completed successfully!")
 
-        with open("REDACTED_result.txt", "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
+# -----------------------------
+# CHECKPOINTED STAGES
+# -----------------------------
+def _retry(name, fn, *args):
+    """Call `fn` up to STAGE_ATTEMPTS times until it returns something other than None."""
+    for n in range(1, STAGE_ATTEMPTS + 1):
+        result = fn(*args)
+        if result is not None:
+            return result
+        if n < STAGE_ATTEMPTS:
+            print(f"[↻] Retrying stage {name} ({n + 1}/{STAGE_ATTEMPTS})")
+    return None
+
+
+def _stage(name, fn, *args, report_resume=True):
+    """Run one stage with up to STAGE_ATTEMPTS tries, reusing its checkpoint if present."""
+    on_resume = (lambda _: report(name, resumed=True)) if report_resume else None
+    return checkpointed(name, lambda: _retry(name, fn, *args), on_resume=on_resume)
+
+
+# -----------------------------
+# MAIN WORKFLOW
+# -----------------------------
+def hipaa_main(LOCAL_INPUT_FILE, REMOTE_TEST_DIR=REMOTE_TEST_DIR, REMOTE_OUTPUT_DIR=REMOTE_OUTPUT_DIR):
+    # Callers (the upload views) usually open a checkpoint scope for the whole
+    # pipeline; run standalone, the redaction stages get their own
+    if active_store() is None:
+        with checkpoint_scope(document_key(LOCAL_INPUT_FILE)) as store:
+            content = _redaction_workflow(LOCAL_INPUT_FILE, REMOTE_TEST_DIR, REMOTE_OUTPUT_DIR)
+            if content is not None and store is not None:
+                store.clear()
+            return content
+    return _redaction_workflow(LOCAL_INPUT_FILE, REMOTE_TEST_DIR, REMOTE_OUTPUT_DIR)
+
+
+def _redaction_workflow(LOCAL_INPUT_FILE, REMOTE_TEST_DIR, REMOTE_OUTPUT_DIR):
+    try:
+        
+        ocr_text = run_ocr(LOCAL_INPUT_FILE)
+        if not ocr_text:
+            return None
+
+        # Text that was redacted before skips upload, redaction and download
+        cache = get_cache()
+        if cache is not None:
+            cache_key = text_key(ocr_text)
+            content = cache.get(cache_key)
+            if content is not None:
+                print("[✓] Redacted text found in cache")
+                report("redaction", cached=True)
+                return content
+
+        # Upload + redaction is checkpointed as the redacted file's remote
+        # name ("redaction"), so a failed download does not redact again
+        store = active_store()
+        document = store.key if store is not None else document_key(LOCAL_INPUT_FILE)
+        resumed = []
+
+        def on_resume(_):
+            resumed.append(True)
+            report("redaction", resumed=True)
+
+        redacted_remote_file = checkpointed(
+            "redaction", redact_remote, ocr_text, document, REMOTE_TEST_DIR, REMOTE_OUTPUT_DIR, on_resume=on_resume
+        )
+        if redacted_remote_file is None:
+            return None
+        content = _stage("download", read_redacted, redacted_remote_file)
+        if content is None:
+            # A stored output that still cannot be downloaded may be gone from
+            # the server: the next attempt redacts again
+            if resumed and store is not None:
+                store.discard("redaction")
+            return None
+        if cache is not None:
+            try:
+                cache.put(cache_key, content)
+            except OSError as e:
+                print(f"[!] Could not cache redacted text: {e}")
 
+        print("\n[✔] Workflow completed successfully!")
         return content
 
+    except UpstreamBusy:
+        raise  # no OCR/redaction capacity: the caller answers 429, not a failed document
     except Exception as e:
         print(f"[✗] Unexpected error: {e}")
         # sys.exit(1)
-
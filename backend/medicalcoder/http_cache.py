@@ -0,0 +1,89 @@
+"""
+http_cache.py — Conditional GETs and a serialized-payload cache for documents
+
+Documents are immutable once processed, and the dashboard polls the list and
+detail endpoints. Responses carry validators:
+
+    list    ETag from the user's document count and newest updated_at
+    detail  ETag + Last-Modified from the document's updated_at
+
+so a poll with If-None-Match / If-Modified-Since gets a 304 before anything
+is serialized. Both come from the database (one aggregate query for the
+list), so every write path and every process agree on them; writes that
+bypass save() (QuerySet.update) must set updated_at themselves. With
+DOCUMENT_RESPONSE_CACHE_TTL > 0 the serialized payloads are also cached,
+keyed by their ETag: a change produces a new ETag (stale entries just
+expire), and deleting a document drops its entry right away.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def list_version(user_id):
+    """Version of `user_id`'s document list: changes with any create, update or delete."""
+    from .models import MedicalDocument
+
+    state = MedicalDocument.objects.filter(user_id=user_id).aggregate(count=Count("pk"), latest=Max("updated_at"))
+    latest = int(state["latest"].timestamp() * 1_000_000) if state["latest"] else 0
+    return f"{state['count']}-{latest}"
+
+
+def list_etag(user_id, query_string=""):
+    version = list_version(user_id)
+    digest = hashlib.md5(f"{user_id}:{version}:{query_string}".encode(), usedforsecurity=False).hexdigest()
+    return f'"list-{digest}"'
+
+
+def detail_etag(pk, updated_at):
+    return f'"doc-{pk}-{int(updated_at.timestamp() * 1_000_000)}"'
+
+
+def not_modified(request, etag, last_modified=None):
+    """304 response when the client's validators still match, else None."""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        add_validators(response, etag, last_modified)
+    return response
+
+
+def add_validators(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    response["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+# -----------------------------
+# SERIALIZED PAYLOAD CACHE
+# -----------------------------
+def _payload_key(etag):
+    return f"doc-payload:{etag}"
+
+
+def cached_payload(etag, build):
+    """Return build() for `etag`, cached for DOCUMENT_RESPONSE_CACHE_TTL seconds."""
+    ttl = getattr(settings, "DOCUMENT_RESPONSE_CACHE_TTL", 0)
+    if not ttl:
+        return build()
+    key = _payload_key(etag)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, ttl)
+    return data
+
+
+def document_deleted(sender, instance, **kwargs):
+    """post_delete receiver for MedicalDocument (see apps.py)."""
+    if instance.updated_at is not None:
+        cache.delete(_payload_key(detail_etag(instance.pk, instance.updated_at)))
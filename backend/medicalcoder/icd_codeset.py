@@ -0,0 +1,220 @@
+"""
+icd_codeset.py — Complete ICD-10-CM code set as one memory-mapped index file
+
+The bundled icd_hierarchy_*_codes.txt files cover 15 psychiatric/neuro
+categories. For everything else, `manage.py build_icd_codeset` ingests the
+CMS "code descriptions in tabular order" file (icd10cm_order_<year>.txt, or
+the release zip) into ICD_CODESET_PATH:
+
+    header   magic, format version, code-set year, record count, offsets
+    records  fixed-width, sorted by dot-less code (= hierarchy order):
+             code (7 bytes, NUL padded), depth, flags, description offset/length
+    strings  UTF-8 long descriptions
+
+The loader mmaps the file, so every worker process shares one copy in the
+page cache and opening it costs nothing up front; lookups binary-search the
+records. A yearly code-set update is a rebuild of this one file.
+
+No Django imports: icd_hierarchy and icd_index fall back to it, and scripts import those.
+"""
+
+import mmap
+import os
+import re
+import struct
+import threading
+import zipfile
+from pathlib import Path
+
+from .icd_hierarchy import HIERARCHY_DIR, IcdCode
+from .icd_index import code_key, format_code
+
+ICD_CODESET_PATH = Path(os.getenv("ICD_CODESET_PATH", HIERARCHY_DIR / "icd10cm_codeset.idx"))
+
+MAGIC = b"ICDCSET\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHHIII")     # magic, format, year, count, strings offset, strings size
+RECORD = struct.Struct("<7sBBIH")      # code key, depth, flags, description offset, length
+KEY_SIZE = 7
+FLAG_BILLABLE = 1
+
+# Fixed columns: order number, code, billable flag, short (60 chars), long description
+# 00001 A00     0 Cholera                                                      Cholera
+ORDER_CODE_RE = re.compile(r"^[A-Z]\d[0-9A-Z]{1,5}$")
+ORDER_MEMBER_RE = re.compile(r"order[-_]?\d{4}\.txt$", re.I)
+
+
+# -----------------------------
+# STEP 1: PARSE THE CMS ORDER FILE
+# -----------------------------
+def parse_order_lines(lines, chapters=None):
+    """Yield (key, billable, description) from order-file lines, optionally only some chapters (letters)."""
+    for line in lines:
+        key = line[6:13].strip()
+        if not ORDER_CODE_RE.match(key) or line[14:15] not in ("0", "1"):
+            continue
+        if chapters and key[0] not in chapters:
+            continue
+        yield key, line[14] == "1", line[77:].strip() or line[16:76].strip()
+
+
+def read_order_source(path):
+    """Lines of an order file, or of the order file inside a CMS release zip."""
+    path = Path(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [name for name in archive.namelist() if ORDER_MEMBER_RE.search(name)]
+            if not members:
+                raise ValueError(f"No icd10cm order file in {path}")
+            return archive.read(members[0]).decode("latin-1").splitlines()
+    return path.read_text(encoding="latin-1").splitlines()
+
+
+def year_from_name(path):
+    m = re.search(r"(20\d{2})", Path(path).name)
+    return int(m.group(1)) if m else 0
+
+
+# -----------------------------
+# STEP 2: WRITE THE INDEX
+# -----------------------------
+def write_codeset(codes, path, year):
+    """
+    Write (key, billable, description) tuples to `path` atomically.
+    Returns the number of codes written.
+    """
+    codes = sorted({key: (billable, desc) for key, billable, desc in codes}.items())
+    present = {key for key, _ in codes}
+    strings, records, offset = [], [], 0
+    for key, (billable, desc) in codes:
+        if len(key) > KEY_SIZE:
+            raise ValueError(f"ICD code too long: {key}")
+        # Depth = number of existing ancestors (placeholder "X" levels do not count)
+        depth = sum(1 for end in range(3, len(key)) if key[:end] in present)
+        blob = desc.encode("utf-8")[:0xFFFF]
+        records.append(RECORD.pack(key.encode("ascii"), depth, FLAG_BILLABLE if billable else 0, offset, len(blob)))
+        strings.append(blob)
+        offset += len(blob)
+
+    strings_offset = HEADER.size + RECORD.size * len(records)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, year, len(records), strings_offset, offset)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.writelines(records)
+        f.writelines(strings)
+    os.replace(tmp, path)  # readers keep their old mapping until they reopen
+    return len(records)
+
+
+# -----------------------------
+# STEP 3: MEMORY-MAPPED LOADER
+# -----------------------------
+class IcdCodeSet:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, self.year, self.count, self._strings, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not an ICD code set index (format {FORMAT_VERSION})")
+        self.path = str(path)
+        self._ranges = {}  # category -> (first, end) record index, filled on first use
+
+    def __len__(self):
+        return self.count
+
+    def _record_key(self, i):
+        start = HEADER.size + i * RECORD.size
+        return self._mm[start:start + KEY_SIZE]
+
+    def _bisect(self, target, lo=0, hi=None):
+        """First record index in [lo, hi) whose key is >= `target` (bytes, NUL padded)."""
+        hi = self.count if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record_key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, prefix):
+        """Record index range of one category (`prefix`: 3 bytes)."""
+        bounds = self._ranges.get(prefix)
+        if bounds is None:
+            start = self._bisect(prefix.ljust(KEY_SIZE, b"\0"))
+            bounds = self._ranges[prefix] = (start, self._bisect(prefix + b"\xff", start))
+        return bounds
+
+    def _find(self, key):
+        if not key or len(key) > KEY_SIZE or not key.isascii():
+            return None
+        target = key.encode("ascii").ljust(KEY_SIZE, b"\0")
+        # Bisect within the category: ~6 probes instead of ~17 over the whole file
+        start, end = self._range(target[:3])
+        i = self._bisect(target, start, end)
+        return i if i < end and self._record_key(i) == target else None
+
+    def _record(self, i):
+        key, depth, flags, offset, length = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+        start = self._strings + offset
+        return key.rstrip(b"\0").decode("ascii"), depth, flags, self._mm[start:start + length].decode("utf-8")
+
+    def _entry(self, key, depth, description, parent):
+        code = format_code(key)
+        return IcdCode(code=code, description=description, full_description=description,
+                       parent=parent, category=key[:3], depth=depth)
+
+    def lookup(self, code):
+        """IcdCode for `code`, or None."""
+        key = code_key(code)
+        i = self._find(key)
+        if i is None:
+            return None
+        key, depth, _, description = self._record(i)
+        parent = next((format_code(key[:end]) for end in range(len(key) - 1, 2, -1) if self._find(key[:end]) is not None), "")
+        return self._entry(key, depth, description, parent)
+
+    def is_valid(self, code):
+        return self._find(code_key(code)) is not None
+
+    def is_billable(self, code):
+        i = self._find(code_key(code))
+        return i is not None and bool(self._record(i)[2] & FLAG_BILLABLE)
+
+    def has_category(self, category):
+        return self._find(code_key(category)[:3]) is not None
+
+    def category_entries(self, category):
+        """Every code under `category`, in hierarchy order (like icd_hierarchy.load_category)."""
+        start, end = self._range(code_key(category)[:3].encode("ascii", "ignore"))
+        entries, stack = [], []  # stack of codes by depth
+        for i in range(start, end):
+            key, depth, _, description = self._record(i)
+            del stack[depth:]
+            entries.append(self._entry(key, depth, description, stack[-1] if stack else ""))
+            stack.append(format_code(key))
+        return entries
+
+    def close(self):
+        self._mm.close()
+
+
+_lock = threading.Lock()
+_codesets = {}
+
+
+def get_codeset(path=None):
+    """
+    Shared IcdCodeSet for `path` (default ICD_CODESET_PATH), or None if it
+    has not been built. Opened once per process: restart to pick up a rebuild.
+    """
+    path = str(path or ICD_CODESET_PATH)
+    if path not in _codesets:
+        with _lock:
+            if path not in _codesets:
+                _codesets[path] = IcdCodeSet(path) if os.path.exists(path) else None
+    return _codesets[path]
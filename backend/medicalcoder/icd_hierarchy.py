@@ -0,0 +1,117 @@
+"""
+icd_hierarchy.py — Loader for the local ICD-10 hierarchy files
+
+json_pipeline.save_icd_to_text() writes one `icd_hierarchy_<CODE>_codes.txt`
+file per parent code, indented four spaces per level:
+
+    F19: Other psychoactive substance related disorders
+        F19.1: Other psychoactive substance abuse
+            F19.10: …… uncomplicated
+
+"……" stands for the parent's description, so descriptions are expanded
+when loaded ("Other psychoactive substance abuse, uncomplicated").
+
+Categories without a bundled file are read from the complete code set
+index built by `manage.py build_icd_codeset` (see icd_codeset.py).
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+# Files live next to manage.py (json_pipeline writes them to the working dir)
+HIERARCHY_DIR = Path(os.getenv("ICD_HIERARCHY_DIR", Path(__file__).resolve().parent.parent))
+HIERARCHY_GLOB = "icd_hierarchy_*_codes.txt"
+
+ELLIPSIS_RE = re.compile(r"^\s*(?:……|…|\.\.\.)\s*")
+LINE_RE = re.compile(r"^(?P<indent> *)(?P<code>[A-Z]\d[0-9A-Z](?:\.[0-9A-Z]{1,4})?)\s*:\s*(?P<desc>.*)$")
+
+
+@dataclass(frozen=True)
+class IcdCode:
+    code: str
+    description: str          # as written in the file
+    full_description: str     # "……" expanded with the parent's description
+    parent: str               # immediate parent code ("" for the category itself)
+    category: str             # three-character category, e.g. F19
+    depth: int
+
+
+def _expand(description, parent_full):
+    if not ELLIPSIS_RE.match(description):
+        return description
+    rest = ELLIPSIS_RE.sub("", description)
+    if not parent_full:
+        return rest
+    joiner = " " if re.match(r"(?:with|without|in|due|of|and)\b", rest) else ", "
+    return f"{parent_full}{joiner}{rest}"
+
+
+def parse_hierarchy_text(text):
+    """Parse indented hierarchy text into a list of IcdCode (document order)."""
+    entries, stack = [], []  # stack of (depth, IcdCode)
+    for raw in (text or "").splitlines():
+        m = LINE_RE.match(raw.rstrip())
+        if not m:
+            continue
+        depth = len(m.group("indent")) // 4
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        parent = stack[-1][1] if stack else None
+        code = m.group("code")
+        desc = m.group("desc").strip()
+        entry = IcdCode(
+            code=code,
+            description=desc,
+            full_description=_expand(desc, parent.full_description if parent else ""),
+            parent=parent.code if parent else "",
+            category=code[:3],
+            depth=depth,
+        )
+        entries.append(entry)
+        stack.append((depth, entry))
+    return entries
+
+
+def hierarchy_text(entries):
+    """Inverse of parse_hierarchy_text (same layout as save_icd_to_text)."""
+    return "\n".join(f"{'    ' * e.depth}{e.code}: {e.description}" for e in entries)
+
+
+@lru_cache(maxsize=8)
+def load_all(directory=None):
+    """
+    Load every hierarchy file in `directory`, keyed by category.
+
+    The category is taken from the file content rather than the file name,
+    since a few files were saved under the wrong name.
+    """
+    directory = Path(directory or HIERARCHY_DIR)
+    categories = {}
+    for path in sorted(directory.glob(HIERARCHY_GLOB)):
+        entries = parse_hierarchy_text(path.read_text(encoding="utf-8", errors="ignore"))
+        if entries:
+            categories.setdefault(entries[0].category, entries)
+    return categories
+
+
+def load_category(category, directory=None):
+    """
+    Entries for one parent code (e.g. "F41"): the bundled file, else the
+    ICD code set index; [] when neither has it.
+    """
+    from .icd_codeset import get_codeset
+
+    category = category.upper().strip()
+    entries = load_all(directory).get(category)
+    if entries:
+        return entries
+    codeset = get_codeset()
+    return codeset.category_entries(category) if codeset is not None else []
+
+
+def known_codes(directory=None):
+    """Every code in the local hierarchy files."""
+    return {e.code for entries in load_all(directory).values() for e in entries}
@@ -0,0 +1,137 @@
+"""
+icd_index.py — Validation index over the local ICD-10 hierarchy
+
+Built once from icd_hierarchy.load_all(). Codes are keyed without the dot
+("F41.1" -> "F411"), so "F41.1", "f411" and "F41 .1" all hit the same entry:
+
+    lookup / is_valid   dict probe, O(len(code))
+    nearest             longest valid prefix ("F41.19" -> "F41.1"), O(len(code))
+    is_within           parent/child containment is a key prefix test
+    children            bisect range over the sorted key array
+
+output_parser uses it to keep model codes inside the hierarchy and to
+repair near misses without another model round trip. Categories without a
+local hierarchy file are answered from the memory-mapped ICD code set
+(icd_codeset.py, binary search) when it has been built; otherwise they are
+not covered and their codes are left alone.
+"""
+
+import bisect
+from functools import lru_cache
+
+from .icd_hierarchy import load_all
+
+def code_key(code):
+    """Dot-less upper-case key: " f41.1" -> "F411"."""
+    # str.replace beats translate/re.sub ~3x on 3-8 character codes
+    return "".join(str(code or "").split()).replace(".", "").upper()
+
+
+def format_code(key):
+    """Inverse of code_key: "F411" -> "F41.1"."""
+    return key if len(key) <= 3 else f"{key[:3]}.{key[3:]}"
+
+
+def normalize_code(code):
+    return format_code(code_key(code))
+
+
+class IcdIndex:
+    def __init__(self, categories, codeset=None):
+        """
+        `categories`: {category: [IcdCode]} as returned by load_all().
+        `codeset`: optional IcdCodeSet for categories without a local file.
+        """
+        self.codeset = codeset
+        self._entries = {}
+        for entries in categories.values():
+            for entry in entries:
+                self._entries.setdefault(code_key(entry.code), entry)
+        # Canonical spellings ("F41.1"), checked first: most model codes already are
+        self._by_code = {entry.code: entry for entry in self._entries.values()}
+        self._categories = frozenset(categories)
+        self._keys = sorted(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _fallback(self, key):
+        """The code set answers for categories without a local file."""
+        return self.codeset is not None and key[:3] not in self._categories
+
+    def covers(self, code):
+        """True when `code`'s category has a local hierarchy file or is in the code set."""
+        key = code_key(code)
+        return key[:3] in self._categories or (self.codeset is not None and self.codeset.has_category(key))
+
+    def lookup(self, code):
+        """IcdCode for `code`, or None."""
+        entry = self._by_code.get(code)
+        if entry is not None:
+            return entry
+        key = code_key(code)
+        entry = self._entries.get(key)
+        if entry is None and self._fallback(key):
+            return self.codeset.lookup(key)
+        return entry
+
+    def is_valid(self, code):
+        if code in self._by_code:
+            return True
+        key = code_key(code)
+        if key in self._entries:
+            return True
+        return self._fallback(key) and self.codeset.is_valid(key)
+
+    def nearest(self, code):
+        """Deepest valid code that `code` starts with ("F41.19" -> F41.1), or None."""
+        key = code_key(code)
+        if self._fallback(key):
+            for end in range(len(key), 2, -1):
+                entry = self.codeset.lookup(key[:end])
+                if entry is not None:
+                    return entry
+            return None
+        for end in range(len(key), 2, -1):
+            entry = self._entries.get(key[:end])
+            if entry is not None:
+                return entry
+        return None
+
+    def children(self, code):
+        """Immediate children of `code` in the hierarchy."""
+        parent = self.lookup(code)
+        if parent is None:
+            return []
+        if self._fallback(code_key(parent.code)):
+            return [e for e in self.codeset.category_entries(parent.category) if e.parent == parent.code]
+        key = code_key(parent.code)
+        start = bisect.bisect_right(self._keys, key)
+        end = bisect.bisect_left(self._keys, key + "\x7f", start)
+        return [self._entries[k] for k in self._keys[start:end] if self._entries[k].parent == parent.code]
+
+    def is_leaf(self, code):
+        """Valid and with no more specific code under it (billable)."""
+        key = code_key(code)
+        if self._fallback(key):
+            return self.codeset.is_billable(key)
+        if key not in self._entries:
+            return False
+        i = bisect.bisect_right(self._keys, key)
+        return i == len(self._keys) or not self._keys[i].startswith(key)
+
+    @staticmethod
+    def is_within(code, parent):
+        """`code` is `parent` or one of its descendants (ICD containment is by prefix)."""
+        return code_key(code).startswith(code_key(parent))
+
+
+@lru_cache(maxsize=8)
+def get_index(directory=None):
+    """
+    Index over the hierarchy files in `directory` (default ICD_HIERARCHY_DIR)
+    plus the ICD code set index when built, once per process.
+    """
+    from .icd_codeset import get_codeset
+
+    return IcdIndex(load_all(directory), get_codeset())
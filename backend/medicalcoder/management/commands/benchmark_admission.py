@@ -0,0 +1,202 @@
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from medicalcoder.admission import AdmissionController, PipelineBusy
+
+
+class SimulatedUpstream:
+    """An upstream with `capacity` parallel slots: beyond it, calls slow down proportionally."""
+
+    def __init__(self, capacity, base_seconds, timeout_seconds):
+        self.capacity = capacity
+        self.base_seconds = base_seconds
+        self.timeout_seconds = timeout_seconds
+        self.inflight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def call(self):
+        with self._lock:
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+            load = self.inflight
+        try:
+            latency = self.base_seconds * max(1.0, load / self.capacity)
+            time.sleep(min(latency, self.timeout_seconds))
+            return latency <= self.timeout_seconds
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+
+def _lanes(capacity, backfill_cap, separate):
+    if not separate:
+        # One shared FIFO queue: backfill and interactive wait in the same line
+        shared = {"weight": 1, "max_concurrent": capacity, "max_queued": 1000,
+                  "max_per_user": capacity, "max_queued_per_user": 1000}
+        return {"interactive": shared}, {"interactive": "interactive", "backfill": "interactive"}
+    return {
+        "interactive": {"weight": 8, "max_concurrent": capacity, "max_queued": 100},
+        "backfill": {"weight": 1, "max_concurrent": backfill_cap, "max_queued": 1000,
+                     "max_per_user": backfill_cap, "max_queued_per_user": 1000},
+    }, {"interactive": "interactive", "backfill": "backfill"}
+
+
+def _pct(samples, q):
+    samples = sorted(samples)
+    return round(samples[max(int(len(samples) * q) - 1, 0)], 1) if samples else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate pipeline load against an upstream with fixed capacity: a burst "
+        "from one heavy user with and without admission control, then interactive "
+        "uploads while a backfill runs, with one shared queue vs priority lanes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--capacity", type=int, default=4, help="Upstream parallel capacity.")
+        parser.add_argument("--heavy-uploads", type=int, default=40)
+        parser.add_argument("--light-users", type=int, default=6)
+        parser.add_argument("--base-ms", type=int, default=200, help="Upstream latency when not overloaded.")
+        parser.add_argument("--timeout-ms", type=int, default=1000, help="Upstream timeout.")
+        parser.add_argument("--interactive", type=int, default=30, help="Interactive uploads in the lane test.")
+        parser.add_argument("--backfill-workers", type=int, default=16, help="Concurrent backfill submitters.")
+
+    def handle(self, *args, **options):
+        self._burst(options)
+        self._priority_lanes(options)
+
+    # -----------------------------
+    # BURST FROM ONE USER
+    # -----------------------------
+    def _burst(self, options):
+        # Heavy user 0 submits everything at once; light users submit one each, slightly later
+        arrivals = [(0, 0.0)] * options["heavy_uploads"] + [
+            (user_id, 0.05) for user_id in range(1, options["light_users"] + 1)
+        ]
+        self.stdout.write(
+            f"upstream capacity {options['capacity']}, {options['heavy_uploads']} uploads from one user, "
+            f"{options['light_users']} single uploads from others"
+        )
+        lanes = {"interactive": {"weight": 1, "max_concurrent": options["capacity"], "max_queued": 16}}
+        for label, controller in (
+            ("no admission control", None),
+            ("admission control", AdmissionController(
+                max_concurrent=options["capacity"], max_per_user=1, max_queued_per_user=2,
+                queue_timeout=30, lanes=lanes,
+            )),
+        ):
+            self._report(label, self._run_burst(arrivals, controller, options))
+
+    def _run_burst(self, arrivals, controller, options):
+        upstream = SimulatedUpstream(options["capacity"], options["base_ms"] / 1000, options["timeout_ms"] / 1000)
+        outcomes, light_latency = Counter(), []
+        start = time.perf_counter()
+
+        def upload(arrival):
+            user_id, delay = arrival
+            time.sleep(delay)
+            t0 = time.perf_counter()
+            try:
+                if controller is not None:
+                    controller.acquire(user_id)
+                try:
+                    outcomes["ok" if upstream.call() else "upstream_timeout"] += 1
+                finally:
+                    if controller is not None:
+                        controller.release(user_id, elapsed=time.perf_counter() - t0)
+            except PipelineBusy:
+                outcomes["rejected_429"] += 1
+                return
+            if user_id != 0:
+                light_latency.append((time.perf_counter() - t0) * 1000)
+
+        with ThreadPoolExecutor(max_workers=len(arrivals)) as executor:
+            list(executor.map(upload, arrivals))
+        return {
+            **{k: outcomes[k] for k in ("ok", "upstream_timeout", "rejected_429")},
+            "upstream_peak_inflight": upstream.peak,
+            "light_user_p50_ms": round(statistics.median(light_latency), 1) if light_latency else None,
+            "wall_s": round(time.perf_counter() - start, 2),
+        }
+
+    # -----------------------------
+    # INTERACTIVE UPLOADS DURING A BACKFILL
+    # -----------------------------
+    def _priority_lanes(self, options):
+        capacity = options["capacity"]
+        self.stdout.write(
+            f"\n{options['interactive']} interactive uploads (one every {options['base_ms'] // 2} ms, "
+            f"different users) while {options['backfill_workers']} backfill submitters keep the pipeline busy"
+        )
+        for label, backfill, separate, backfill_cap in (
+            ("no backfill", False, True, capacity),
+            ("backfill, one shared FIFO queue", True, False, capacity),
+            (f"backfill, priority lanes (backfill cap {capacity - 1})", True, True, max(capacity - 1, 1)),
+            (f"backfill, priority lanes (backfill cap {capacity // 2})", True, True, max(capacity // 2, 1)),
+        ):
+            lanes, lane_of = _lanes(capacity, backfill_cap, separate)
+            controller = AdmissionController(
+                max_concurrent=capacity, max_per_user=1, max_queued_per_user=2, queue_timeout=60, lanes=lanes,
+            )
+            self._report(label, self._run_lanes(controller, lane_of, backfill, options))
+
+    def _run_lanes(self, controller, lane_of, backfill, options):
+        upstream = SimulatedUpstream(options["capacity"], options["base_ms"] / 1000, 60)
+        interactive_latency, backfill_done = [], Counter()
+        stop = threading.Event()
+
+        def run(user_id, lane):
+            if len(controller.lanes) == 1:
+                user_id = 0  # shared queue: strict arrival order
+            t0 = time.perf_counter()
+            controller.acquire(user_id, lane_of[lane])
+            try:
+                upstream.call()
+            finally:
+                controller.release(user_id, lane_of[lane], time.perf_counter() - t0)
+            return (time.perf_counter() - t0) * 1000
+
+        def backfill_loop():
+            while not stop.is_set():
+                try:
+                    run(0, "backfill")
+                    backfill_done["documents"] += 1
+                except PipelineBusy:
+                    time.sleep(0.05)
+
+        workers = [threading.Thread(target=backfill_loop, daemon=True) for _ in range(options["backfill_workers"])]
+        if backfill:
+            for worker in workers:
+                worker.start()
+            time.sleep(options["base_ms"] / 1000)  # let the backlog build up
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["interactive"]) as executor:
+            futures = []
+            for i in range(options["interactive"]):
+                futures.append(executor.submit(run, i + 1, "interactive"))
+                time.sleep(options["base_ms"] / 2000)
+            interactive_latency = [f.result() for f in futures]
+        elapsed = time.perf_counter() - start
+        stop.set()
+        if backfill:
+            for worker in workers:
+                worker.join()
+        return {
+            "interactive_p50_ms": _pct(interactive_latency, 0.5),
+            "interactive_p95_ms": _pct(interactive_latency, 0.95),
+            "backfill_docs_per_s": round(backfill_done["documents"] / elapsed, 1),
+            "upstream_peak_inflight": upstream.peak,
+        }
+
+    def _report(self, label, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        for name, value in results.items():
+            self.stdout.write(f"  {name}: {value}")
@@ -0,0 +1,152 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from medicalcoder.models import MedicalDocument
+
+USER_PREFIX = "bench-docs-"
+CODES = {"icd_codes": ["F41", "F32"]}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed benchmark documents and report list/detail latency with and without "
+        "the MedicalDocument indexes. Seeds and drops an index on the configured "
+        "database, so it refuses to run unless that database looks like a scratch "
+        "one (name containing 'test' or 'bench', or in-memory SQLite) or --force is "
+        "given. Seeded rows are removed afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--runs", type=int, default=50)
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded rows.")
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Run against a database that does not look like a scratch one (inserts rows, drops an index).",
+        )
+
+    def handle(self, *args, **options):
+        name = str(connection.settings_dict["NAME"] or "")
+        scratch = any(word in name.lower() for word in ("test", "bench")) or name in ("", ":memory:")
+        if not scratch and not options["force"]:
+            raise CommandError(
+                f"Refusing to seed {options['documents']} documents and drop an index on database {name!r}. "
+                "Point DATABASE_URL at a throwaway database (e.g. sqlite:////tmp/bench.db) or pass --force."
+            )
+        users = self._seed(options["documents"], options["users"], options["batch_size"])
+        try:
+            probe = users[len(users) // 2]
+            doc_ids = list(
+                MedicalDocument.objects.filter(user=probe).values_list("id", flat=True)[: options["runs"]]
+            )
+
+            self.stdout.write(f"{MedicalDocument.objects.count()} documents, {len(users)} benchmark users")
+            with_index = self._measure(probe, doc_ids, options["runs"])
+            self._report("with indexes", with_index)
+
+            # Temporarily drop the list index; it is rebuilt even if measuring fails
+            index = next(i for i in MedicalDocument._meta.indexes if i.name == "meddoc_user_created_idx")
+            with connection.schema_editor() as editor:
+                editor.remove_index(MedicalDocument, index)
+            connection.close()  # drop cached statements/plans
+            try:
+                without_index = self._measure(probe, doc_ids, options["runs"])
+            finally:
+                with connection.schema_editor() as editor:
+                    editor.add_index(MedicalDocument, index)
+            self._report("without (user, -created_at)", without_index)
+        finally:
+            if not options["keep"]:
+                self._cleanup()
+
+    # -----------------------------
+    # SEEDING
+    # -----------------------------
+    def _seed(self, documents, user_count, batch_size):
+        User = get_user_model()
+        existing = list(User.objects.filter(username__startswith=USER_PREFIX).order_by("id"))
+        if existing:
+            self.stdout.write(f"Reusing {len(existing)} seeded benchmark users")
+            return existing
+
+        User.objects.bulk_create(
+            User(username=f"{USER_PREFIX}{i}", email=f"{USER_PREFIX}{i}@example.com", password="!")
+            for i in range(user_count)
+        )
+        users = list(User.objects.filter(username__startswith=USER_PREFIX).order_by("id"))
+
+        t0 = time.perf_counter()
+        for start in range(0, documents, batch_size):
+            rows = [
+                MedicalDocument(
+                    user=users[i % len(users)],
+                    file_path=f"/uploads/note-{i}.pdf",
+                    content_hash=f"{i:064x}",
+                    icd_parent_codes=CODES,
+                )
+                for i in range(start, min(start + batch_size, documents))
+            ]
+            MedicalDocument.objects.bulk_create(rows, batch_size=batch_size)
+            self.stdout.write(f"\rSeeded {start + len(rows)}/{documents}", ending="")
+        self.stdout.write(f"\nSeeding took {time.perf_counter() - t0:.1f}s")
+        return users
+
+    def _cleanup(self):
+        User = get_user_model()
+        user_ids = list(User.objects.filter(username__startswith=USER_PREFIX).values_list("id", flat=True))
+        # Plain DELETE: QuerySet.delete() would load every row to send signals
+        table = connection.ops.quote_name(MedicalDocument._meta.db_table)
+        with connection.cursor() as cursor:
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE user_id IN ({', '.join(['%s'] * len(chunk))})", chunk
+                )
+        User.objects.filter(id__in=user_ids).delete()
+
+    # -----------------------------
+    # MEASUREMENT
+    # -----------------------------
+    def _timed(self, fn, runs):
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+        samples.sort()
+        return {
+            "p50_ms": round(statistics.median(samples), 3),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        }
+
+    def _measure(self, user, doc_ids, runs):
+        listing = MedicalDocument.objects.for_user(user).order_by("-created_at")
+        ids = iter(doc_ids * (runs // max(len(doc_ids), 1) + 1))
+        return {
+            "list (all of one user)": self._timed(lambda: list(listing.all()), runs),
+            "list (first 50)": self._timed(lambda: list(listing.all()[:50]), runs),
+            "detail (user, pk)": self._timed(
+                lambda: MedicalDocument.objects.filter(user=user).get(pk=next(ids)), runs
+            ),
+            "plan": self._plan(listing[:50]),
+        }
+
+    def _plan(self, queryset):
+        try:
+            return queryset.explain()
+        except Exception as exc:  # not every backend supports EXPLAIN
+            return f"n/a ({exc})"
+
+    def _report(self, label, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        for name, value in results.items():
+            if name == "plan":
+                self.stdout.write(f"  plan: {' | '.join(value.splitlines())}")
+            else:
+                self.stdout.write(f"  {name}: p50 {value['p50_ms']} ms, p95 {value['p95_ms']} ms")
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from medicalcoder.artifacts import create_document
+from medicalcoder.exports import export_queryset, iter_export_rows, parquet_available, write_export
+from medicalcoder.models import MedicalDocument
+from medicalcoder.serializers import ExportRequestSerializer
+
+from .benchmark_payload_storage import sample_payload
+
+USER_PREFIX = "bench-export-"
+
+
+class Command(BaseCommand):
+    help = "Rows/s, file size and peak Python memory of code exports per format."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=20_000)
+        parser.add_argument("--external-every", type=int, default=4,
+                            help="Store every Nth document's codes as a compressed artifact.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.create(username=f"{USER_PREFIX}{time.time_ns()}", password="!")
+        try:
+            docs = []
+            for i in range(options["documents"]):
+                codes, _ = sample_payload(i)
+                if options["external_every"] and i % options["external_every"] == 0:
+                    create_document(user, f"/uploads/note-{i}.pdf", codes, storage="artifact")
+                else:
+                    docs.append(MedicalDocument(user=user, file_path=f"/uploads/note-{i}.pdf", **codes))
+            MedicalDocument.objects.bulk_create(docs, batch_size=2000)
+
+            params = ExportRequestSerializer(data={})
+            params.is_valid(raise_exception=True)
+            queryset = export_queryset(user, params.validated_data)
+            formats = ["csv", "jsonl"] + (["parquet"] if parquet_available() else [])
+            self.stdout.write(f"{options['documents']} documents, formats: {', '.join(formats)}")
+            with tempfile.TemporaryDirectory() as tmp:
+                for fmt in formats:
+                    path = os.path.join(tmp, f"export.{fmt}")
+                    tracemalloc.start()
+                    t0 = time.perf_counter()
+                    rows = write_export(fmt, iter_export_rows(queryset.all()), path)
+                    elapsed = time.perf_counter() - t0
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    self.stdout.write(self.style.MIGRATE_HEADING(fmt))
+                    self.stdout.write(f"  {rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s)")
+                    self.stdout.write(f"  file {os.path.getsize(path) / 2**20:.1f} MB, peak memory {peak / 2**20:.1f} MB")
+        finally:
+            MedicalDocument.objects.filter(user=user).delete()
+            user.delete()
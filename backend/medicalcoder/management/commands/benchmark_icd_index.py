@@ -0,0 +1,63 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicalcoder.icd_index import format_code, get_index
+from medicalcoder.output_parser import parse_specified_codes
+
+
+class Command(BaseCommand):
+    help = (
+        "Time ICD index validation and nearest-code repair over a synthetic mix of "
+        "model codes (valid, near misses, unknown, uncovered categories), and show "
+        "how parse_specified_codes treats them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--codes", type=int, default=100_000)
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        index = get_index()
+        if not len(index):
+            raise CommandError("No local ICD hierarchy files found (ICD_HIERARCHY_DIR).")
+        valid = [entry.code for entry in index._entries.values()]
+        rng = random.Random(options["seed"])
+
+        def sample():
+            code = rng.choice(valid)
+            kind = rng.random()
+            if kind < 0.6:
+                return code                                  # valid
+            if kind < 0.75:
+                return code.replace(".", "").lower()         # formatting
+            if kind < 0.9:
+                return format_code(code.replace(".", "") + rng.choice("0123456789"))  # too specific
+            if kind < 0.95:
+                return code[:3] + ".Z9"                      # not in the hierarchy
+            return "Z99.81"                                  # category without a local file
+
+        codes = [sample() for _ in range(options["codes"])]
+        self.stdout.write(f"{len(index)} indexed codes, {len(codes)} sample codes")
+
+        for label, fn in (
+            ("is_valid", index.is_valid),
+            ("nearest", index.nearest),
+            ("is_within", lambda code: index.is_within(code, code[:3])),
+        ):
+            started = time.perf_counter()
+            for code in codes:
+                fn(code)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stdout.write(f"  {label}: {len(codes) / elapsed_ms:,.0f} codes/ms")
+
+        batch = codes[:500]
+        raw = json.dumps({"icd10_codes": [{"code": code, "description": ""} for code in batch]})
+        started = time.perf_counter()
+        result = parse_specified_codes(raw)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        repaired = sum(1 for item in result["icd10_codes"] if "repaired_from" in item)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"parse_specified_codes, {len(batch)} codes: {elapsed_ms:.1f} ms"))
+        self.stdout.write(f"  kept {len(result['icd10_codes'])} unique codes, {repaired} repaired to a valid ancestor")
@@ -0,0 +1,82 @@
+import json
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from medicalcoder.models import MedicalDocument
+from medicalcoder.views import MedicalDocumentListCreateView
+
+from .benchmark_payload_storage import sample_payload
+
+USER_PREFIX = "bench-stream-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Peak Python memory and time of the document list endpoint, buffered "
+        "(ok()) vs streamed (?stream=1), for growing document counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, nargs="+", default=[1000, 10_000, 50_000])
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.create(username=f"{USER_PREFIX}{time.time_ns()}", password="!")
+        view = MedicalDocumentListCreateView.as_view()
+        factory = APIRequestFactory()
+        seeded = 0
+        try:
+            with override_settings(DOCUMENT_RESPONSE_CACHE_TTL=0):
+                for target in sorted(options["documents"]):
+                    seeded = self._seed(user, seeded, target)
+                    if target == min(options["documents"]) and (
+                        json.loads(self._body(view, factory, user, "")) !=
+                        json.loads(self._body(view, factory, user, "?stream=1"))
+                    ):
+                        raise CommandError("Streamed response differs from the buffered one.")
+                    buffered = self._measure(view, factory, user, "")
+                    streamed = self._measure(view, factory, user, "?stream=1")
+                    self.stdout.write(self.style.MIGRATE_HEADING(f"{target} documents"))
+                    for label, result in (("buffered", buffered), ("streamed", streamed)):
+                        self.stdout.write(
+                            f"  {label}: {result['ms']} ms, peak {result['peak_mb']} MB, {result['mb']} MB body"
+                        )
+        finally:
+            MedicalDocument.objects.filter(user=user).delete()
+            user.delete()
+
+    def _seed(self, user, start, target):
+        docs = []
+        for i in range(start, target):
+            codes, _ = sample_payload(i)
+            docs.append(MedicalDocument(user=user, file_path=f"/uploads/note-{i}.pdf", **codes))
+        MedicalDocument.objects.bulk_create(docs, batch_size=2000)
+        return target
+
+    def _get(self, view, factory, user, query):
+        request = factory.get(f"/api/medical-documents/{query}")
+        force_authenticate(request, user=user)
+        return view(request)
+
+    def _body(self, view, factory, user, query):
+        response = self._get(view, factory, user, query)
+        return b"".join(response.streaming_content) if response.streaming else response.render().content
+
+    def _measure(self, view, factory, user, query):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        response = self._get(view, factory, user, query)
+        if response.streaming:
+            # Like a client reading chunk by chunk: nothing is kept
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.render().content)
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {"ms": round(elapsed * 1000, 1), "peak_mb": round(peak / 2**20, 1), "mb": round(size / 2**20, 1)}
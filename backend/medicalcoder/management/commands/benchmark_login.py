@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rest_framework.test import APIRequestFactory
+
+from medicalcoder import hashing_pool
+from medicalcoder.output_parser import parse_ai_result
+from medicalcoder.views import CustomLoginView
+
+USER_PREFIX = "bench-login-"
+PASSWORD = "bench-Password-123"
+PROBE_RESULT = {
+    "icd_parent_codes": '["F41", "F32"]',
+    "icd_codes": '```json\n{"icd10_codes": [{"code": "F41.1", "description": "GAD"}]}\n```',
+    "cpt_codes": '{"cpt_codes": [{"code": "99214", "modifier": "25, 95"}], "hcpcs_codes": []}',
+}
+
+
+def _pct(samples, q):
+    samples = sorted(samples)
+    return round(samples[max(int(len(samples) * q) - 1, 0)], 1) if samples else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Login throughput with password hashing inline vs on the dedicated hashing "
+        "pool, while a probe thread measures how long document-side work is delayed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=8)
+        parser.add_argument("--logins", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=16, help="Simulated request workers.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        usernames = [f"{USER_PREFIX}{i}" for i in range(options["users"])]
+        User.objects.filter(username__in=usernames).delete()
+        for name in usernames:
+            user = User(username=name, email=f"{name}@example.com")
+            user.set_password(PASSWORD)
+            user.save()
+
+        self.stdout.write(f"hasher: {settings.PASSWORD_HASHERS[0].rsplit('.', 1)[-1]}, "
+                          f"{options['logins']} logins, {options['concurrency']} request workers")
+        configured = hashing_pool.HASHING_WORKERS
+        try:
+            for label, workers in (("inline", 0), (f"pool ({configured} workers)", configured)):
+                hashing_pool.HASHING_WORKERS = workers
+                self._report(label, self._run(usernames, options["logins"], options["concurrency"]))
+        finally:
+            hashing_pool.HASHING_WORKERS = configured
+            User.objects.filter(username__in=usernames).delete()
+
+    def _run(self, usernames, logins, concurrency):
+        view = CustomLoginView.as_view()
+        factory = APIRequestFactory()
+        latencies, statuses, probe = [], [], []
+        done = threading.Event()
+
+        def login(i):
+            try:
+                request = factory.post(
+                    "/api/auth/login/",
+                    {"username": usernames[i % len(usernames)], "password": PASSWORD},
+                    format="json",
+                )
+                t0 = time.perf_counter()
+                response = view(request)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        def probe_loop():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                for _ in range(20):
+                    parse_ai_result(PROBE_RESULT)
+                probe.append((time.perf_counter() - t0) * 1000)
+                time.sleep(0.01)
+
+        # Probe baseline with no login traffic
+        t0 = time.perf_counter()
+        for _ in range(20):
+            parse_ai_result(PROBE_RESULT)
+        idle_probe = (time.perf_counter() - t0) * 1000
+
+        prober = threading.Thread(target=probe_loop, daemon=True)
+        prober.start()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(login, range(logins)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        prober.join()
+
+        ok = sum(1 for s in statuses if s == 200)
+        return {
+            "logins_per_sec": round(ok / elapsed, 1),
+            "ok": ok,
+            "busy_429": sum(1 for s in statuses if s == 429),
+            "login_p50_ms": _pct(latencies, 0.5),
+            "login_p95_ms": _pct(latencies, 0.95),
+            "probe_idle_ms": round(idle_probe, 1),
+            "probe_p95_ms": _pct(probe, 0.95),
+        }
+
+    def _report(self, label, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        for name, value in results.items():
+            self.stdout.write(f"  {name}: {value}")
@@ -0,0 +1,103 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Sum, TextField
+from django.db.models.functions import Cast, Length
+
+from medicalcoder.artifacts import CODE_FIELDS, create_document
+from medicalcoder.models import DocumentArtifact, MedicalDocument
+
+USER_PREFIX = "bench-payload-"
+
+
+def sample_payload(i):
+    """Code fields, evidence and model output shaped like a real pipeline result."""
+    icd = [
+        {"code": f"F41.{i % 10}", "description": "Generalized anxiety disorder with panic features"},
+        {"code": "F32.1", "description": "Major depressive disorder, single episode, moderate"},
+        {"code": "G47.00", "description": "Insomnia, unspecified"},
+        {"code": "R53.83", "description": "Other fatigue"},
+    ]
+    cpt = [
+        {"code": "99214", "description": "Office or other outpatient visit, established patient, moderate MDM",
+         "modifier": "25, 95", "description_modifier": "Significant, separately identifiable E/M; telehealth"},
+        {"code": "90833", "description": "Psychotherapy, 30 minutes with patient when performed with an E/M service",
+         "modifier": "95", "description_modifier": "Synchronous telemedicine service"},
+    ]
+    codes = {
+        "icd_parent_codes": {"icd_codes": ["F41", "F32", "G47", "R53"]},
+        "icd_specified_codes": {"icd10_codes": icd},
+        "cpt_codes": {"cpt": cpt},
+        "modifiers": {"Modifiers": [{"code": c["modifier"], "description": c["description_modifier"]} for c in cpt]},
+        "hcpcs_codes": [],
+    }
+    evidence = [
+        {"code": item["code"], "quote": f"Patient reports {item['description'].lower()} over the past {n + 2} weeks; "
+                                        "symptoms discussed at length during the session and plan reviewed."}
+        for n, item in enumerate(icd * 3)
+    ]
+    model_output = {
+        "icd_parent_codes": str(codes["icd_parent_codes"]["icd_codes"]),
+        "icd_codes": "```json\n" + str(codes["icd_specified_codes"]) + "\n```",
+        "cpt_codes": "```json\n" + str({"cpt_codes": cpt, "hcpcs_codes": []}) + "\n```",
+    }
+    return codes, {DocumentArtifact.KIND_EVIDENCE: evidence, DocumentArtifact.KIND_MODEL_OUTPUT: model_output}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare row size and list-scan time for inline vs compressed artifact "
+        "storage of document payloads. Seeded rows are removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=5000)
+        parser.add_argument("--runs", type=int, default=10)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = {
+            storage: User.objects.create(username=f"{USER_PREFIX}{storage}-{time.time_ns()}", password="!")
+            for storage in ("inline", "artifact")
+        }
+        try:
+            for storage, user in users.items():
+                t0 = time.perf_counter()
+                for i in range(options["documents"]):
+                    codes, artifacts = sample_payload(i)
+                    create_document(user, f"/uploads/note-{i}.pdf", codes, artifacts=artifacts, storage=storage)
+                self.stdout.write(f"{storage}: seeded {options['documents']} in {time.perf_counter() - t0:.1f}s")
+
+            for storage, user in users.items():
+                self._report(storage, user, options["runs"])
+        finally:
+            MedicalDocument.objects.filter(user__in=users.values()).delete()
+            User.objects.filter(pk__in=[u.pk for u in users.values()]).delete()
+
+    def _row_bytes(self, user):
+        columns = (*CODE_FIELDS, "code_summary")
+        sizes = MedicalDocument.objects.filter(user=user).aggregate(
+            **{c: Sum(Length(Cast(c, TextField()))) for c in columns}
+        )
+        return sum(v or 0 for v in sizes.values())
+
+    def _scan_ms(self, queryset, runs):
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            list(queryset.all())
+            samples.append((time.perf_counter() - t0) * 1000)
+        return round(statistics.median(samples), 2)
+
+    def _report(self, storage, user, runs):
+        listing = MedicalDocument.objects.for_user(user).order_by("-created_at")
+        artifacts = DocumentArtifact.objects.filter(document__user=user).aggregate(
+            raw=Sum("raw_size"), stored=Sum(Length("data"))
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING(storage))
+        self.stdout.write(f"  JSON bytes on document rows: {self._row_bytes(user)}")
+        self.stdout.write(f"  artifact bytes: {artifacts['raw'] or 0} raw -> {artifacts['stored'] or 0} compressed")
+        self.stdout.write(f"  list scan (model rows): {self._scan_ms(listing, runs)} ms")
+        self.stdout.write(f"  list scan (summaries): {self._scan_ms(listing.summaries(), runs)} ms")
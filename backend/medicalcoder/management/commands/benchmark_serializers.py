@@ -0,0 +1,75 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from medicalcoder.models import MedicalDocument
+from medicalcoder.renderers import RAW_JSON_SUPPORTED, FastJSONRenderer, orjson
+from medicalcoder.serializers import MedicalDocumentSerializer, document_rows
+
+from .benchmark_payload_storage import sample_payload
+
+USER_PREFIX = "bench-serialize-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Time serializing + rendering a document list with MedicalDocumentSerializer "
+        "and JSONRenderer vs document_rows() and FastJSONRenderer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=10_000)
+        parser.add_argument("--runs", type=int, default=5)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.create(username=f"{USER_PREFIX}{time.time_ns()}", password="!")
+        try:
+            docs = []
+            for i in range(options["documents"]):
+                codes, _ = sample_payload(i)
+                docs.append(MedicalDocument(user=user, file_path=f"/uploads/note-{i}.pdf", **codes))
+            MedicalDocument.objects.bulk_create(docs, batch_size=2000)
+            queryset = MedicalDocument.objects.for_user(user).order_by("-created_at")
+
+            before = self._time(lambda: MedicalDocumentSerializer(
+                queryset.all(), many=True, context={"expand_payload": False}
+            ).data, JSONRenderer(), options["runs"])
+            after = self._time(lambda: document_rows(queryset.all()), FastJSONRenderer(), options["runs"])
+
+            if json.loads(before.pop("body")) != json.loads(after.pop("body")):
+                raise CommandError("Fast path output differs from MedicalDocumentSerializer.")
+
+            self.stdout.write(
+                f"{options['documents']} documents, orjson: {orjson is not None}, "
+                f"raw JSON pass-through: {RAW_JSON_SUPPORTED}"
+            )
+            for label, result in (("ModelSerializer + JSONRenderer", before), ("document_rows + FastJSONRenderer", after)):
+                self.stdout.write(self.style.MIGRATE_HEADING(label))
+                for name, value in result.items():
+                    self.stdout.write(f"  {name}: {value}")
+            self.stdout.write(f"speedup: {before['total_ms'] / after['total_ms']:.1f}x")
+        finally:
+            MedicalDocument.objects.filter(user=user).delete()
+            user.delete()
+
+    def _time(self, build, renderer, runs):
+        serialize, render, body = [], [], None
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            data = build()
+            t1 = time.perf_counter()
+            body = renderer.render({"success": True, "data": data})
+            t2 = time.perf_counter()
+            serialize.append((t1 - t0) * 1000)
+            render.append((t2 - t1) * 1000)
+        return {
+            "query_and_serialize_ms": round(statistics.median(serialize), 1),
+            "render_ms": round(statistics.median(render), 1),
+            "total_ms": round(statistics.median(serialize) + statistics.median(render), 1),
+            "body": body,
+        }
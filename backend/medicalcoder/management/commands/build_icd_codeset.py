@@ -0,0 +1,57 @@
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicalcoder.icd_codeset import (
+    ICD_CODESET_PATH, IcdCodeSet, parse_order_lines, read_order_source, write_codeset, year_from_name,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the memory-mapped ICD-10-CM code set index from the CMS tabular order "
+        "file (icd10cm_order_<year>.txt, or the release zip that contains it). "
+        "Rerun with the new release for the yearly code-set update."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", required=True, help="icd10cm_order_<year>.txt or the CMS release zip.")
+        parser.add_argument("--chapters", default="", help='Chapter letters to keep, e.g. "F,G,R" (default: all).')
+        parser.add_argument("--year", type=int, default=None, help="Code-set year (default: from the file name).")
+        parser.add_argument("--output", default=str(ICD_CODESET_PATH))
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        if not os.path.exists(source):
+            raise CommandError(f"{source} does not exist.")
+        chapters = {c.strip().upper() for c in options["chapters"].split(",") if c.strip()}
+        year = options["year"] if options["year"] is not None else year_from_name(source)
+
+        started = time.perf_counter()
+        try:
+            codes = list(parse_order_lines(read_order_source(source), chapters))
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not codes:
+            raise CommandError(f"No ICD-10-CM codes found in {source}.")
+        count = write_codeset(codes, options["output"], year)
+        elapsed = time.perf_counter() - started
+
+        size_mb = os.path.getsize(options["output"]) / 1e6
+        self.stdout.write(self.style.MIGRATE_HEADING(f"ICD-10-CM {year or '(unknown year)'} code set"))
+        self.stdout.write(f"  {count} codes in {len({key[:3] for key, _, _ in codes})} categories, "
+                          f"{size_mb:.1f} MB, built in {elapsed:.1f} s")
+
+        codeset = IcdCodeSet(options["output"])
+        try:
+            sample = random.Random(7).choices([key for key, _, _ in codes], k=20_000)
+            started = time.perf_counter()
+            for key in sample:
+                codeset.lookup(key)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        finally:
+            codeset.close()
+        self.stdout.write(f"  lookup: {len(sample) / elapsed_ms:,.0f} codes/ms")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']} (restart workers to load it)"))
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Pipeline-only dependencies: importing the URLconf must not load them (see pipeline.py)
+HEAVY_MODULES = (
+    "paramiko", "openai", "bs4", "numpy", "scipy", "pyarrow", "tiktoken",
+    "medicalcoder.code_generation", "medicalcoder.hippa_pipeline", "medicalcoder.code_retrieval",
+)
+
+
+def parse_importtime(stderr):
+    """`python -X importtime` output as [(module, self_us, cumulative_us, depth)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what a web worker boot imports (django.setup() + the URLconf) with "
+        "`python -X importtime` in a fresh interpreter. Fails when the total exceeds "
+        "--budget-ms or a pipeline-only dependency is imported at startup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--budget-ms", type=float, default=1000.0)
+        parser.add_argument("--runs", type=int, default=3, help="Best of N runs (the first pays for cold caches).")
+        parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list.")
+
+    def handle(self, *args, **options):
+        code = f"import django; django.setup(); import {settings.ROOT_URLCONF}"
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)}
+        best = None
+        for _ in range(max(options["runs"], 1)):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                raise CommandError(f"Importing {settings.ROOT_URLCONF} failed:\n{result.stderr[-2000:]}")
+            rows = parse_importtime(result.stderr)
+            total_ms = sum(row[1] for row in rows) / 1000
+            if best is None or total_ms < best[0]:
+                best = (total_ms, rows)
+
+        total_ms, rows = best
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Slowest top-level imports ({settings.ROOT_URLCONF})"))
+        top_level = sorted((row for row in rows if row[3] == 0), key=lambda row: row[2], reverse=True)
+        for name, _, cumulative_us, _ in top_level[:options["top"]]:
+            self.stdout.write(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+        errors = []
+        loaded = {row[0] for row in rows}
+        heavy = [name for name in HEAVY_MODULES if name in loaded]
+        if heavy:
+            errors.append(f"pipeline-only modules imported at startup: {', '.join(heavy)}")
+        if total_ms > options["budget_ms"]:
+            errors.append(f"import time {total_ms:.0f} ms is over the {options['budget_ms']:.0f} ms budget")
+        style = self.style.ERROR if errors else self.style.SUCCESS
+        self.stdout.write(style(f"Total import time: {total_ms:.0f} ms (budget {options['budget_ms']:.0f} ms)"))
+        if errors:
+            raise CommandError("; ".join(errors))
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from medicalcoder.models import MedicalDocument
+from medicalcoder.querycount import capture_queries
+from medicalcoder.views import MedicalDocumentListCreateView
+
+CODES = {"icd_codes": ["F41"]}
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that document listings run a constant number of queries: seeds "
+        "documents inside a transaction (rolled back) and compares query counts "
+        "for a small and a large listing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        large = options["documents"]
+        small = min(10, large)
+        results = {}
+
+        with transaction.atomic():
+            User = get_user_model()
+            user = User.objects.create_superuser("querycount-check", "qc@example.com", "unused-password")
+
+            for n in (small, large):
+                MedicalDocument.objects.filter(user=user).delete()
+                MedicalDocument.objects.bulk_create(
+                    MedicalDocument(user=user, file_path=f"/tmp/doc-{i}.pdf", icd_parent_codes=CODES)
+                    for i in range(n)
+                )
+                results[n] = self._measure(user)
+
+            transaction.set_rollback(True)
+
+        failed = False
+        for name in results[small]:
+            a, b = results[small][name], results[large][name]
+            ok = a == b
+            failed |= not ok
+            style = self.style.SUCCESS if ok else self.style.ERROR
+            self.stdout.write(style(f"{name}: {a} queries for {small} docs, {b} for {large} docs"))
+        if failed:
+            raise CommandError("Query count grows with the number of documents (N+1).")
+
+    def _measure(self, user):
+        counts = {}
+        view = MedicalDocumentListCreateView.as_view()
+        factory = APIRequestFactory()
+
+        for name, query in (("api list", ""), ("api list with codes", "?expand=codes")):
+            request = factory.get(f"/api/medical-documents/{query}")
+            force_authenticate(request, user=user)
+            with capture_queries() as ctx:
+                response = view(request)
+                response.render()
+            counts[name] = len(ctx)
+
+        with capture_queries() as ctx:
+            [str(doc) for doc in MedicalDocument.objects.for_user(user).with_owner()]
+        counts["str() with owner"] = len(ctx)
+
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        with capture_queries() as ctx:
+            client.get("/admin/medicalcoder/medicaldocument/")
+        counts["admin changelist"] = len(ctx)
+        return counts
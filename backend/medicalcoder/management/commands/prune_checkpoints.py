@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from medicalcoder.checkpoints import CHECKPOINT_DIR, CHECKPOINT_TTL_SECONDS, prune
+from medicalcoder.ocr_cache import OcrPageCache
+from medicalcoder.redaction_batch import RedactionCache
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete pipeline checkpoints older than CHECKPOINT_TTL_SECONDS. Checkpoints "
+        "of saved documents are removed right away; this catches abandoned runs. "
+        "Also removes redaction cache entries older than REDACTION_CACHE_TTL_SECONDS "
+        "and OCR page cache entries older than OCR_CACHE_TTL_SECONDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age-seconds", type=int, default=CHECKPOINT_TTL_SECONDS,
+            help="Remove checkpoints untouched for this long.",
+        )
+
+    def handle(self, *args, **options):
+        removed = prune(options["max_age_seconds"])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} checkpoint directories from {CHECKPOINT_DIR}"))
+        cache = RedactionCache()
+        removed = cache.prune()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} redaction cache entries from {cache.directory}"))
+        ocr_cache = OcrPageCache()
+        removed = ocr_cache.prune()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} OCR page cache entries from {ocr_cache.directory}"))
@@ -0,0 +1,187 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from medicalcoder.coding_jobs import requeue_expired
+
+logger = logging.getLogger(__name__)
+
+SWEEP_SECONDS = 60
+
+
+class Worker:
+    """
+    One worker process: `threads` threads run jobs, the main thread claims them.
+
+    At most threads + prefetch jobs are claimed and not finished at a time
+    (bounded lookahead), so a slow process does not sit on jobs other
+    processes could run. On SIGTERM/SIGINT no new job is started, running
+    ones finish and prefetched ones are released back to the queue.
+    """
+
+    def __init__(self, threads, prefetch, max_jobs, poll_seconds, drain):
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.threads = threads
+        self.limit = threads + prefetch
+        self.max_jobs = max_jobs
+        self.poll_seconds = poll_seconds
+        self.drain = drain
+        self.jobs = queue.Queue()
+        self.stop = threading.Event()
+        self.cond = threading.Condition()
+        self.outstanding = 0  # claimed, not finished
+        self.unstarted = []
+
+    def run(self):
+        from medicalcoder.coding_jobs import claim_jobs, release_jobs
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self.stop.set())
+        threads = [threading.Thread(target=self._work, name=f"coding-{i}") for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        claimed = 0
+        try:
+            # Recycle (exit, and let the parent start a fresh process) after max_jobs
+            while not self.stop.is_set() and claimed < self.max_jobs:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.outstanding < self.limit, self.poll_seconds)
+                    room = self.limit - self.outstanding
+                    idle = self.outstanding == 0
+                if self.stop.is_set() or room <= 0:
+                    continue
+                batch = claim_jobs(self.name, min(room, self.max_jobs - claimed))
+                if not batch:
+                    if self.drain and idle:
+                        break
+                    self.stop.wait(self.poll_seconds)
+                    continue
+                claimed += len(batch)
+                with self.cond:
+                    self.outstanding += len(batch)
+                for job in batch:
+                    self.jobs.put(job)
+        finally:
+            for _ in threads:
+                self.jobs.put(None)
+            for thread in threads:
+                thread.join()
+            if self.unstarted:
+                release_jobs(self.name, self.unstarted)
+            connections.close_all()
+        logger.info("Worker %s exiting after %d jobs", self.name, claimed)
+
+    def _work(self):
+        from medicalcoder.coding_jobs import run_in_thread
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                if self.stop.is_set():
+                    self.unstarted.append(job.pk)
+                    continue
+                status = run_in_thread(job, self.name)
+                logger.info("Worker %s: job %s %s", self.name, job.pk, status or "lost its lease")
+            finally:
+                with self.cond:
+                    self.outstanding -= 1
+                    self.cond.notify()
+
+
+def _worker_main(options):
+    django.setup()  # no-op after fork; needed with the spawn start method
+    Worker(**options).run()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued pipeline jobs (CodingJob) in worker processes, outside the web "
+        "workers: --processes N processes with --threads M job threads each. Workers "
+        "exit after --max-jobs-per-worker jobs and are replaced, to cap memory growth. "
+        "SIGTERM/Ctrl-C stops claiming, lets running jobs finish for up to "
+        "--shutdown-timeout seconds and returns prefetched jobs to the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--threads", type=int, default=2, help="Concurrent jobs per process.")
+        parser.add_argument("--prefetch", type=int, default=1,
+                            help="Jobs a process may claim beyond its running ones.")
+        parser.add_argument("--max-jobs-per-worker", type=int, default=200)
+        parser.add_argument("--poll-seconds", type=float, default=1.0)
+        parser.add_argument("--shutdown-timeout", type=float, default=60.0)
+        parser.add_argument("--drain", action="store_true", help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        # Imported here: with the spawn start method children import this module before django.setup()
+        from medicalcoder.models import CodingJob
+
+        worker_options = {
+            "threads": max(options["threads"], 1),
+            "prefetch": max(options["prefetch"], 0),
+            "max_jobs": max(options["max_jobs_per_worker"], 1),
+            "poll_seconds": options["poll_seconds"],
+            "drain": options["drain"],
+        }
+        stopping = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stopping.set())
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{options['processes']} processes x {worker_options['threads']} threads "
+            f"(prefetch {worker_options['prefetch']}, recycle after {worker_options['max_jobs']} jobs)"
+        ))
+        processes = {}
+        next_sweep = 0
+        while not stopping.is_set():
+            if time.monotonic() >= next_sweep:
+                requeued = requeue_expired()
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f"Requeued {requeued} jobs with an expired lease"))
+                next_sweep = time.monotonic() + SWEEP_SECONDS
+            for slot in range(options["processes"]):
+                process = processes.get(slot)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None and process.exitcode:
+                    self.stdout.write(self.style.ERROR(f"Worker {process.pid} exited with {process.exitcode}"))
+                if options["drain"] and not CodingJob.objects.filter(status=CodingJob.STATUS_PENDING).exists():
+                    processes.pop(slot, None)
+                    continue
+                # Children must not share the parent's database connections
+                connections.close_all()
+                processes[slot] = multiprocessing.Process(
+                    target=_worker_main, args=(worker_options,), name=f"coding-worker-{slot}"
+                )
+                processes[slot].start()
+            if options["drain"] and not processes:
+                break
+            stopping.wait(options["poll_seconds"])
+
+        self._shutdown(processes.values(), options["shutdown_timeout"])
+
+    def _shutdown(self, processes, timeout):
+        alive = [p for p in processes if p.is_alive()]
+        if alive:
+            self.stdout.write(f"Stopping {len(alive)} workers (waiting up to {timeout:.0f}s for running jobs)")
+        for process in alive:
+            process.terminate()  # SIGTERM: graceful stop in Worker.run
+        deadline = time.monotonic() + timeout
+        for process in alive:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                # Its jobs stay claimed until CODING_JOB_LEASE_SECONDS, then are requeued
+                self.stdout.write(self.style.ERROR(f"Killing worker {process.pid}"))
+                process.kill()
+                process.join()
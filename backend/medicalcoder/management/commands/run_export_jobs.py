@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from medicalcoder.exports import requeue_expired_exports, run_export_job
+from medicalcoder.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Run pending export jobs, oldest first. Use with EXPORT_WORKERS=0 to keep "
+        "exports out of the web processes, or to pick up jobs left by a restart. "
+        "Running jobs whose lease (EXPORT_JOB_LEASE_SECONDS) expired are requeued first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new jobs.")
+        parser.add_argument("--poll-seconds", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_expired_exports()
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Requeued {requeued} export jobs with an expired lease"))
+            pending = list(
+                ExportJob.objects.filter(status=ExportJob.STATUS_PENDING)
+                .order_by("created_at").values_list("id", flat=True)
+            )
+            for job_id in pending:
+                job = run_export_job(job_id)
+                if job is not None:
+                    style = self.style.SUCCESS if job.status == ExportJob.STATUS_COMPLETED else self.style.ERROR
+                    self.stdout.write(style(f"{job.pk}: {job.status}, {job.row_count} rows {job.error}".rstrip()))
+            if not options["loop"]:
+                return
+            time.sleep(options["poll_seconds"])
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicalcoder', '0002_medicaldocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaldocument',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='medicaldocument',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='completed', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='medicaldocument',
+            index=models.Index(fields=['user', '-created_at'], name='meddoc_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicaldocument',
+            index=models.Index(fields=['content_hash'], name='meddoc_content_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicaldocument',
+            index=models.Index(fields=['status', 'created_at'], name='meddoc_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copies of medicalcoder.artifacts as of this migration, so later
+# changes to that module do not change what this migration does
+CODE_FIELDS = ("icd_parent_codes", "icd_specified_codes", "cpt_codes", "modifiers", "hcpcs_codes")
+SUMMARY_TOP_N = 3
+
+
+def _codes(items):
+    return [item.get("code") for item in items or [] if isinstance(item, dict) and item.get("code")]
+
+
+def code_summary(fields):
+    icd = _codes((fields.get("icd_specified_codes") or {}).get("icd10_codes"))
+    cpt = _codes((fields.get("cpt_codes") or {}).get("cpt"))
+    hcpcs = _codes(fields.get("hcpcs_codes"))
+    return {
+        "icd_count": len(icd),
+        "cpt_count": len(cpt),
+        "hcpcs_count": len(hcpcs),
+        "top_icd": icd[:SUMMARY_TOP_N],
+        "top_cpt": cpt[:SUMMARY_TOP_N],
+    }
+
+
+def backfill_code_summary(apps, schema_editor):
+    MedicalDocument = apps.get_model("medicalcoder", "MedicalDocument")
+    batch = []
+    for doc in MedicalDocument.objects.only("id", *CODE_FIELDS).iterator(chunk_size=2000):
+        doc.code_summary = code_summary({f: getattr(doc, f) for f in CODE_FIELDS})
+        batch.append(doc)
+        if len(batch) >= 2000:
+            MedicalDocument.objects.bulk_update(batch, ["code_summary"])
+            batch = []
+    if batch:
+        MedicalDocument.objects.bulk_update(batch, ["code_summary"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicalcoder', '0003_medicaldocument_indexes_hash_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaldocument',
+            name='code_summary',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='medicaldocument',
+            name='payload_external',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DocumentArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('codec', models.CharField(max_length=8)),
+                ('raw_size', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='artifacts', to='medicalcoder.medicaldocument')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('document', 'kind'), name='docartifact_document_kind_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_code_summary, migrations.RunPython.noop),
+    ]
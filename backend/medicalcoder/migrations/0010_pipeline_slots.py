@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicalcoder', '0009_exportjob_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lane', models.CharField(max_length=16)),
+                ('worker', models.CharField(max_length=128)),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='pipelineslot_expires_idx')],
+            },
+        ),
+    ]
@@ -1,9 +1,14 @@
+from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
 from django.db import models
+import hashlib
+import uuid
 import os
 
+from .hashing_pool import run_hashing
+
 class User(AbstractUser):
     """
     Custom user model. You can later enforce email uniqueness or add fields.
@@ -12,10 +17,65 @@ class User(AbstractUser):
     # example future fields:
     # organization = models.CharField(max_length=128, blank=True)
 
+    # Embedded in issued JWTs; bumping it revokes existing tokens and the
+    # cached user record (see authentication.py)
+    token_version = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.username
+
+    # Hashing runs on the dedicated pool (hashing_pool.py); database writes
+    # stay on the request thread.
+    def set_password(self, raw_password):
+        self.password = run_hashing(make_password, raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        outdated = []
+        valid = run_hashing(check_password, raw_password, self.password, outdated.append)
+        if valid and outdated:
+            # Hasher or cost changed: transparently re-hash with the current settings
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+        return valid
     
 
+def file_sha256(path):
+    """Hex SHA-256 of a file's bytes (MedicalDocument.content_hash)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class MedicalDocumentQuerySet(models.QuerySet):
+    SUMMARY_FIELDS = (
+        "id", "file_path", "user_id", "user__username", "status", "code_summary", "created_at", "updated_at",
+    )
+
+    def for_user(self, user):
+        return self.filter(user=user)
+
+    def with_owner(self):
+        """Join the owner so `doc.user` / `str(doc)` cost no extra query per row."""
+        return self.select_related("user")
+
+    def summaries(self):
+        """Read-only dict rows for listings (no model instances, no JSON code columns)."""
+        return self.values(*self.SUMMARY_FIELDS)
+
+    def duplicate_of(self, user, content_hash):
+        """`user`'s latest completed document for the same file bytes, or None."""
+        if not content_hash:
+            return None
+        return (
+            self.filter(user=user, content_hash=content_hash, status=MedicalDocument.STATUS_COMPLETED)
+            .order_by("-created_at").first()
+        )
+
+
 class MedicalDocument(models.Model):
     """
     Stores each medical document processed by the AI Medical Coder pipeline.
@@ -28,8 +88,23 @@ class MedicalDocument(models.Model):
         related_name="medical_documents"
     )
 
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_PROCESSING, "Processing"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
     file_path = models.CharField(max_length=512)
 
+    # SHA-256 of the uploaded file; finds re-uploads of the same document
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_COMPLETED)
+
     # JSON fields for various code outputs
     icd_parent_codes = models.JSONField(default=dict)
     icd_specified_codes = models.JSONField(default=dict)
@@ -37,12 +112,205 @@ class MedicalDocument(models.Model):
     modifiers = models.JSONField(default=dict)
     hcpcs_codes = models.JSONField(null=True, blank=True, default=dict)
 
+    # Slim per-document summary (counts + top codes) read by list views; when
+    # payload_external is set the code fields above are empty and the full
+    # payload lives compressed in DocumentArtifact (see artifacts.py)
+    code_summary = models.JSONField(default=dict, blank=True)
+    payload_external = models.BooleanField(default=False)
+
+    # Model usage of the pipeline run (token_usage.py): per-stage calls,
+    # tokens and latency, their totals, and the budget mode it ended in
+    token_usage = models.JSONField(default=dict, blank=True)
+    total_tokens = models.PositiveIntegerField(default=0)
+    pipeline_ms = models.PositiveIntegerField(default=0)
+    degraded_mode = models.CharField(max_length=16, blank=True, default="")
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = MedicalDocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # List view: filter(user=...).order_by("-created_at")
+            models.Index(fields=["user", "-created_at"], name="meddoc_user_created_idx"),
+            # Pipeline: duplicate detection and work queues by status
+            models.Index(fields=["content_hash"], name="meddoc_content_hash_idx"),
+            models.Index(fields=["status", "created_at"], name="meddoc_status_created_idx"),
+            # Admin: most expensive documents first
+            models.Index(fields=["-total_tokens"], name="meddoc_total_tokens_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user.username} — {os.path.basename(self.file_path)}"
     
 
 
+class DocumentArtifact(models.Model):
+    """
+    Compressed JSON payload belonging to a MedicalDocument: the code fields
+    (when stored externally), evidence snippets or raw model outputs.
+    Loaded only on detail access.
+    """
+    KIND_CODES = "codes"
+    KIND_EVIDENCE = "evidence"
+    KIND_MODEL_OUTPUT = "model_output"
+    KIND_PARSE_ERRORS = "parse_errors"
+
+    document = models.ForeignKey(MedicalDocument, on_delete=models.CASCADE, related_name="artifacts")
+    kind = models.CharField(max_length=32)
+    codec = models.CharField(max_length=8)
+    raw_size = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["document", "kind"], name="docartifact_document_kind_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.document_id} — {self.kind} ({self.codec}, {len(self.data)}/{self.raw_size} bytes)"
+
+
+class ExportJob(models.Model):
+    """
+    Background code export (see exports.py). The file is written under
+    EXPORT_ROOT and downloaded by the owner once the job completes.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="export_jobs")
+    format = models.CharField(max_length=16)
+    # Validated ExportRequestSerializer fields (dates as ISO strings)
+    filters = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    document_count = models.PositiveIntegerField(default=0)
+    row_count = models.PositiveIntegerField(default=0)
+    file_path = models.CharField(max_length=512, blank=True, default="")
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="exportjob_user_created_idx"),
+            models.Index(fields=["status", "created_at"], name="exportjob_status_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} — {self.format} export ({self.status})"
+
+
+class CodingJob(models.Model):
+    """
+    Queued pipeline run (see coding_jobs.py). The upload is stored under
+    CODING_JOB_ROOT until a `run_coding_workers` process claims the job and
+    saves the resulting MedicalDocument.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_CLAIMED = "claimed"  # prefetched by a worker, not started yet
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_CLAIMED, "Claimed"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="coding_jobs")
+    # Stored upload (removed when the job finishes) and the name the user sent
+    file_path = models.CharField(max_length=512)
+    original_name = models.CharField(max_length=512)
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    lane = models.CharField(max_length=16, default="interactive")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=128, blank=True, default="")
+    document = models.ForeignKey(
+        MedicalDocument, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="codingjob_user_created_idx"),
+            # Workers: next pending jobs; lease sweep over claimed/running
+            models.Index(fields=["status", "created_at"], name="codingjob_status_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} — {self.original_name} ({self.status})"
+
 
+class PipelineSlot(models.Model):
+    """
+    One pipeline run admitted by admission.py, visible to every process
+    sharing the database. A row past its lease belongs to a process that
+    died mid-run and no longer counts.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    lane = models.CharField(max_length=16)
+    worker = models.CharField(max_length=128)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["expires_at"], name="pipelineslot_expires_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} — {self.lane} ({self.worker})"
+
+
+class UsageRollup(models.Model):
+    """
+    Model usage per user, day (UTC) and pipeline stage, added to after every
+    run (token_usage.py). `documents` counts runs that reached the stage.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="usage_rollups")
+    day = models.DateField()
+    stage = models.CharField(max_length=32)
+    documents = models.PositiveIntegerField(default=0)
+    calls = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    latency_ms = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day", "stage"], name="usagerollup_user_day_stage_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="usagerollup_day_idx"),
+        ]
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def __str__(self):
+        return f"{self.user_id} — {self.day} {self.stage}"
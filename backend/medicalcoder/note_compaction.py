@@ -0,0 +1,369 @@
+"""
+note_compaction.py — Token-budget-aware compaction of redacted notes
+
+The redacted note is pasted into every prompt in prompts.py. Most of it is
+page furniture (page markers, repeated demographic headers, telehealth consent,
+signature blocks) or sections that one prompt does not need. This module:
+
+1. Strips page markers/footers and de-duplicates repeated header lines and
+   repeated paragraphs.
+2. Segments the note into clinical sections (chief complaint, assessment,
+   plan, time statements, ...).
+3. Builds a per-prompt context that fits a configurable token budget, taking
+   the sections each prompt cares about first.
+4. Reports the token reduction per document.
+
+When the document or user token budget is running out (token_usage.py),
+the default per-prompt budgets shrink by TOKEN_BUDGET_COMPACT_FACTOR.
+"""
+
+import logging
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+try:
+    from .token_usage import compaction_factor
+except ImportError:  # run as a script from medicalcoder/
+    from token_usage import compaction_factor
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# CONFIGURATION
+# -----------------------------
+# Budgets are in tokens and can be overridden per deployment.
+PROMPT_BUDGETS = {
+    "parent": int(os.getenv("NOTE_BUDGET_PARENT", "2500")),
+    "specified": int(os.getenv("NOTE_BUDGET_SPECIFIED", "1500")),
+    "cpt": int(os.getenv("NOTE_BUDGET_CPT", "1200")),
+}
+
+# Sections each prompt needs, most important first.
+PROMPT_SECTIONS = {
+    "parent": ("assessment", "chief_complaint", "hpi", "plan", "mental_status",
+               "history", "medications", "other"),
+    "specified": ("assessment", "chief_complaint", "hpi", "mental_status",
+                  "history", "plan"),
+    "cpt": ("time", "visit", "chief_complaint", "assessment", "plan",
+            "medications", "hpi"),
+}
+
+# Only paragraphs at least this long are de-duplicated (keeps repeated "Plan:" headings).
+DEDUPE_MIN_CHARS = 40
+
+# (section, heading pattern). Order matters: first match wins.
+SECTION_HEADINGS = [
+    ("chief_complaint", r"chief complaint"),
+    ("assessment", r"(?:clinical )?assessment|a\s*&\s*p\b|diagnos[ie]s|impression"),
+    ("plan", r"plan\b|patient instructions|follow-up"),
+    ("hpi", r"history of present illness|hpi\b|symptoms\b|duration\b|quality\b|modifying factors"),
+    ("medications", r"medications and supplements|medication comments|behavioral medication history"
+                    r"|medication management|current medications?"),
+    ("mental_status", r"mental status exam|mental status examination|general appearance|thought processes"
+                      r"|risk assessment|rating scales|aims comment"),
+    ("history", r"past (?:medical|psychiatric) history|family history|social history|family details"
+                r"|substance (?:use|abuse history)|prenatal development|history\b"),
+    ("exam", r"vitals|musculoskeletal exam|gait"),
+    ("visit", r"visit date|psychiatric (?:return|new|initial|follow[- ]up) visit|admission status"
+              r"|communication method|referral source"),
+]
+_HEADING_RES = [(name, re.compile(rf"^\s*(?:{pattern})", re.I)) for name, pattern in SECTION_HEADINGS]
+
+PAGE_MARKER_RE = re.compile(r"</?page\b[^>]*>", re.I)
+PAGE_FOOTER_RE = re.compile(r"^\s*page \d+ of \d+\s*$", re.I | re.M)
+PLACEHOLDER_ONLY_RE = re.compile(r"^[\s,]*(?:<[a-z_]+>[\s,]*)+$", re.I)
+TIME_STATEMENT_RE = re.compile(
+    r"\b(?:time|face[- ]to[- ]face|session|psychotherapy|spent|counsel\w*|start|end)\b"
+    r"[^\n]{0,80}?\b\d{1,3}\s*(?:min(?:ute)?s?|hours?|hrs?)\b",
+    re.I,
+)
+TELEHEALTH_CONSENT_RE = re.compile(r"telehealth|audiovisual|audio[- ]only|video platform", re.I)
+
+# Paragraphs that never carry coding information.
+BOILERPLATE_RES = [
+    re.compile(p, re.I) for p in (
+        r"^no home phone on file$",
+        r"^phone:.*fax:",
+        r"^signed by:",
+        r"^patient agrees to utilize their available support system",
+        r"^please reach out if you have any questions",
+        r"^contact the office if any major changes",
+        r"^patient understands they may call at any time",
+        r"^all questions answered$",
+    )
+]
+
+# -----------------------------
+# TOKEN COUNTING
+# -----------------------------
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding(os.getenv("NOTE_TOKEN_ENCODING", "o200k_base"))
+except Exception:  # tiktoken is optional; fall back to the ~4 chars/token rule
+    _ENCODING = None
+
+
+def count_tokens(text):
+    """Count prompt tokens (tiktoken when installed, otherwise an estimate)."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+# -----------------------------
+# DATA STRUCTURES
+# -----------------------------
+@dataclass
+class Paragraph:
+    index: int
+    section: str
+    text: str
+    tokens: int
+
+
+@dataclass
+class CompactionReport:
+    prompt: str
+    budget: int
+    original_tokens: int
+    compacted_tokens: int
+    sections: list = field(default_factory=list)
+    dropped_paragraphs: int = 0
+
+    @property
+    def saved_tokens(self):
+        return self.original_tokens - self.compacted_tokens
+
+    @property
+    def reduction(self):
+        """Fraction of tokens removed (0.0 – 1.0)."""
+        if not self.original_tokens:
+            return 0.0
+        return self.saved_tokens / self.original_tokens
+
+    def as_dict(self):
+        return {
+            "prompt": self.prompt,
+            "budget": self.budget,
+            "original_tokens": self.original_tokens,
+            "compacted_tokens": self.compacted_tokens,
+            "saved_tokens": self.saved_tokens,
+            "reduction": round(self.reduction, 4),
+            "sections": self.sections,
+            "dropped_paragraphs": self.dropped_paragraphs,
+        }
+
+
+# -----------------------------
+# STEP 1: CLEAN PAGE FURNITURE
+# -----------------------------
+def _split_pages(note):
+    pages = re.split(r"<page\b[^>]*>", note, flags=re.I)
+    return [PAGE_MARKER_RE.sub("", p) for p in pages if p.strip()]
+
+
+def _repeated_header_lines(pages):
+    """Lines that appear on most pages (demographic headers repeated per page)."""
+    if len(pages) < 2:
+        return set()
+    seen = Counter()
+    for page in pages:
+        seen.update({ln.strip() for ln in page.splitlines() if ln.strip()})
+    threshold = max(2, len(pages) // 2)
+    return {ln for ln, n in seen.items() if n >= threshold}
+
+
+def _is_boilerplate(paragraph):
+    flat = " ".join(paragraph.split()).lstrip("-•* ")
+    if PLACEHOLDER_ONLY_RE.match(flat):
+        return True
+    return any(p.match(flat) for p in BOILERPLATE_RES)
+
+
+def clean_note(note):
+    """Remove page markers/footers, boilerplate lines and repeated header lines."""
+    pages = _split_pages(note or "")
+    repeated = _repeated_header_lines(pages)
+
+    kept_lines, emitted = [], set()
+    for page in pages:
+        page = PAGE_FOOTER_RE.sub("", page)
+        for line in page.splitlines():
+            stripped = line.strip()
+            if stripped and _is_boilerplate(stripped):
+                continue
+            if stripped in repeated:
+                # Keep the first copy of a repeated header line only
+                if stripped in emitted:
+                    continue
+                emitted.add(stripped)
+            kept_lines.append(line.rstrip())
+        kept_lines.append("")
+
+    text = "\n".join(kept_lines)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+# -----------------------------
+# STEP 2: SEGMENT INTO SECTIONS
+# -----------------------------
+def _heading_section(paragraph):
+    first_line = paragraph.lstrip().split("\n", 1)[0]
+    for name, pattern in _HEADING_RES:
+        if pattern.match(first_line):
+            return name
+    return None
+
+
+def _compact_consent(paragraph):
+    """Keep only the sentence that states the delivery modality."""
+    flat = " ".join(paragraph.split())
+    first_sentence = re.split(r"(?<=[.!?])\s+", flat, maxsplit=1)[0]
+    return first_sentence
+
+
+def segment_note(note):
+    """
+    Split a note into paragraphs tagged with a section name.
+
+    Returns (paragraphs, dropped_count). Time statements are additionally
+    emitted as their own "time" paragraphs so CPT prompts always see them.
+    """
+    text = clean_note(note)
+    blocks = [b.strip() for b in re.split(r"\n\s*\n", text) if b.strip()]
+
+    paragraphs, seen_blocks = [], set()
+    dropped = 0
+    current = "visit"
+    for block in blocks:
+        key = " ".join(block.split()).lower()
+        if _is_boilerplate(block) or (len(key) >= DEDUPE_MIN_CHARS and key in seen_blocks):
+            dropped += 1
+            continue
+        seen_blocks.add(key)
+
+        if TELEHEALTH_CONSENT_RE.search(block) and len(block) > 400:
+            block = _compact_consent(block)
+            section = "visit"
+        else:
+            section = _heading_section(block)
+            if section is None:
+                section = current
+            else:
+                # A short problem title right before "Assessment:" belongs to it
+                prev = paragraphs[-1] if paragraphs else None
+                if (prev and section == "assessment" and "\n" not in prev.text
+                        and ":" not in prev.text and len(prev.text) <= 60):
+                    prev.section = "assessment"
+                current = section
+
+        paragraphs.append(Paragraph(len(paragraphs), section, block, count_tokens(block)))
+
+        for match in TIME_STATEMENT_RE.finditer(block):
+            line_start = block.rfind("\n", 0, match.start()) + 1
+            line_end = block.find("\n", match.end())
+            line = block[line_start:line_end if line_end != -1 else None].strip()
+            paragraphs.append(Paragraph(len(paragraphs), "time", line, count_tokens(line)))
+
+    return paragraphs, dropped
+
+
+# -----------------------------
+# STEP 3: BUILD PER-PROMPT CONTEXT
+# -----------------------------
+def build_prompt_context(note, prompt, budget=None):
+    """
+    Build the note text for one prompt ("parent", "specified" or "cpt").
+
+    Sections are taken in the prompt's priority order until the token budget
+    is used up; the selected paragraphs are then emitted in document order.
+    The default budget shrinks when the token budget is running out
+    (token_usage.compaction_factor()).
+    Returns (context_text, CompactionReport).
+    """
+    if prompt not in PROMPT_SECTIONS:
+        raise ValueError(f"Unknown prompt: {prompt}. Expected one of {sorted(PROMPT_SECTIONS)}")
+    budget = int(PROMPT_BUDGETS[prompt] * compaction_factor()) if budget is None else budget
+
+    paragraphs, dropped = segment_note(note)
+    by_section = {}
+    for p in paragraphs:
+        by_section.setdefault(p.section, []).append(p)
+
+    selected, used, sections = [], 0, []
+    emitted_text = set()
+    for section in PROMPT_SECTIONS[prompt]:
+        for p in by_section.get(section, []):
+            if p.text in emitted_text:
+                continue  # time lines are usually already inside a selected paragraph
+            cost = p.tokens + 1  # paragraph separator
+            if used + cost > budget:
+                if section != "time":
+                    dropped += 1  # a time line is a copy of a line in another paragraph
+                continue
+            selected.append(p)
+            emitted_text.add(p.text)
+            used += cost
+            if section not in sections:
+                sections.append(section)
+
+    if not any(section in by_section for section in PROMPT_SECTIONS[prompt]):
+        # No section this prompt looks for (e.g. a note without headings): take it in document order
+        for p in paragraphs:
+            if p.section == "time":
+                continue
+            cost = p.tokens + 1
+            if used + cost > budget:
+                dropped += 1
+                continue
+            selected.append(p)
+            used += cost
+        sections = sorted({p.section for p in selected})
+
+    selected.sort(key=lambda p: p.index)
+    # Drop standalone time lines already contained in a selected paragraph
+    bodies = [p.text for p in selected if p.section != "time"]
+    context = "\n\n".join(
+        p.text for p in selected
+        if p.section != "time" or not any(p.text in b for b in bodies)
+    )
+
+    report = CompactionReport(
+        prompt=prompt,
+        budget=budget,
+        original_tokens=count_tokens(note),
+        compacted_tokens=count_tokens(context),
+        sections=sections,
+        dropped_paragraphs=dropped,
+    )
+    logger.info(
+        "Compacted note for %s prompt: %d → %d tokens (%.0f%% saved)",
+        prompt, report.original_tokens, report.compacted_tokens, report.reduction * 100,
+    )
+    return context, report
+
+
+def compaction_report(note, budgets=None):
+    """Token reduction for all three prompts of one document."""
+    budgets = budgets or {}
+    return {
+        prompt: build_prompt_context(note, prompt, budgets.get(prompt))[1].as_dict()
+        for prompt in PROMPT_SECTIONS
+    }
+
+
+# -----------------------------
+# Run interactively
+# -----------------------------
+if __name__ == "__main__":
+    import json
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "REDACTED_result.txt"
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        print(json.dumps(compaction_report(f.read()), indent=2))
@@ -0,0 +1,330 @@
+"""
+ocr_cache.py — OCR text cache keyed by PDF page hashes
+
+Clinics resend records with a page added or re-signed, and run_ocr used to
+OCR every page again. ocr_with_page_cache() splits the PDF (PyPDF2), hashes
+each page's raw content (content streams, fonts, images, page box; not its
+position in the file), and OCRs only the pages missing from the cache, in
+one request with a PDF made of just those pages. The text is stitched back
+in page order with the OCR service's page markers, renumbered:
+
+    <page n="1" file="1"/>  cached          <page n="1" file="1"/>
+    <page n="2" file="1"/>  cached    ->    ... page 1..3 text ...
+    <page n="3" file="1"/>  OCRed           (same layout as a full OCR)
+
+Entries live in OCR_CACHE_DIR/<hash[:2]>/<hash>.json with the page's OCR
+seconds, so each document reports its hit rate and the OCR time saved
+(progress event "ocr", and the log with running totals for the process).
+The store is capped at OCR_CACHE_MAX_MB: once over, the least recently used
+entries (by mtime, touched on every hit) are evicted down to 90%. Entries
+also expire OCR_CACHE_TTL_SECONDS after they were written, however often they
+are hit; `manage.py prune_checkpoints` removes expired ones.
+
+OCR text is PHI: the directory is private to the service user. Documents
+that cannot be split (not a PDF, encrypted, PyPDF2 missing) or whose OCR
+output does not come back with one marker per page are OCRed whole.
+
+No Django imports: hippa_pipeline.py also runs as a plain script.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# CONFIGURATION
+# -----------------------------
+OCR_CACHE_DIR = os.getenv(
+    "OCR_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".ocr_cache")
+)
+OCR_CACHE_MAX_BYTES = int(float(os.getenv("OCR_CACHE_MAX_MB", "512")) * 1024 * 1024)
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+EVICT_TO = 0.9  # fraction of the cap left after an eviction pass
+
+PAGE_MARKER = '<page n="{n}" file="1"/>'
+PAGE_MARKER_RE = re.compile(r'<page\b[^>]*?\bn="(\d+)"[^>]*>')
+
+# Page dictionary keys that point back into the document rather than at content
+_SKIP_KEYS = frozenset(("/Parent", "/P", "/StructParents", "/B"))
+
+
+# -----------------------------
+# STEP 1: SPLIT AND HASH PAGES
+# -----------------------------
+def _feed(digest, obj, seen):
+    """Hash a PDF object graph: stream bytes as stored, dictionaries by sorted key."""
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref in seen:
+            digest.update(b"R")  # shared font/image already hashed for this page
+            return
+        seen.add(ref)
+        obj = obj.get_object()
+    if isinstance(obj, StreamObject):
+        data = getattr(obj, "_data", None)
+        digest.update(b"S")
+        digest.update(data if data is not None else obj.get_data())
+    if isinstance(obj, DictionaryObject):
+        digest.update(b"{")
+        for key in sorted(obj):
+            if key not in _SKIP_KEYS:
+                digest.update(str(key).encode())
+                _feed(digest, obj[key], seen)
+        digest.update(b"}")
+    elif isinstance(obj, ArrayObject):
+        digest.update(b"[")
+        for item in obj:
+            _feed(digest, item, seen)
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode())
+
+
+def page_hash(page):
+    """SHA-256 of one page's content, independent of where the page sits in the file."""
+    digest = hashlib.sha256()
+    _feed(digest, page, set())
+    return digest.hexdigest()
+
+
+def read_pages(file_path):
+    """PyPDF2 pages of `file_path`, or None when it cannot be split."""
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        return None
+    try:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            return None
+        return list(reader.pages)
+    except Exception as e:
+        logger.info("Not splitting %s into pages: %s", file_path, e)
+        return None
+
+
+def write_pages(pages):
+    """A PDF (bytes) holding `pages`, in order."""
+    from PyPDF2 import PdfWriter
+
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def split_ocr_text(text, pages):
+    """OCR output -> one text per page (without markers), or None if the markers do not match."""
+    markers = list(PAGE_MARKER_RE.finditer(text or ""))
+    if len(markers) != pages or [int(m.group(1)) for m in markers] != list(range(1, pages + 1)):
+        return None
+    parts = [text[m.end():markers[i + 1].start() if i + 1 < pages else len(text)] for i, m in enumerate(markers)]
+    parts[0] = text[:markers[0].start()] + parts[0]  # text before the first marker stays on page 1
+    return parts
+
+
+def stitch(parts):
+    return "".join(PAGE_MARKER.format(n=n) + part for n, part in enumerate(parts, 1))
+
+
+# -----------------------------
+# STEP 2: PAGE STORE
+# -----------------------------
+class OcrPageCache:
+    """OCR text per page hash on local disk, evicted LRU by total size."""
+
+    def __init__(self, directory=None, max_bytes=None, ttl=None):
+        self.directory = directory or OCR_CACHE_DIR
+        self.max_bytes = OCR_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = OCR_CACHE_TTL_SECONDS if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk, scanned on first put
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """(text, ocr_seconds) for a page hash, or None (also once expired)."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if self._expired(entry, time.time() - self.ttl):
+                os.remove(path)
+                return None
+            os.utime(path)  # recently used: evicted last
+        except (OSError, ValueError):
+            return None
+        return entry["text"], entry.get("seconds", 0.0)
+
+    def put(self, key, text, seconds):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        data = json.dumps({"text": text, "seconds": round(seconds, 3), "created": int(time.time())}).encode("utf-8")
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size = self._scan()[1] if self._size is None else self._size + len(data)
+            if self._size > self.max_bytes:
+                self._size = self.evict(int(self.max_bytes * EVICT_TO))
+
+    @staticmethod
+    def _expired(entry, cutoff):
+        # Entries written before "created" was stored count as expired
+        return entry.get("created", 0) < cutoff
+
+    def _scan(self):
+        """([(mtime, size, path)], total bytes) for every entry."""
+        entries = []
+        if os.path.isdir(self.directory):
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries, sum(size for _, size, _ in entries)
+
+    def evict(self, target_bytes):
+        """Remove least recently used entries until at most `target_bytes` remain. Returns the size left."""
+        entries, total = self._scan()
+        for _, size, path in sorted(entries):
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def prune(self, max_age_seconds=None):
+        """Remove entries written more than `max_age_seconds` ago (default: the TTL). Returns the count."""
+        cutoff = time.time() - (self.ttl if max_age_seconds is None else max_age_seconds)
+        removed = 0
+        for mtime, _, path in self._scan()[0]:
+            try:
+                # Hits only move mtime forward: entries untouched since the cutoff need no read
+                if mtime >= cutoff:
+                    with open(path, "r", encoding="utf-8") as f:
+                        if not self._expired(json.load(f), cutoff):
+                            continue
+                os.remove(path)
+                removed += 1
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            self._size = None  # rescanned on the next put
+        return removed
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Running totals for this process (logged with every document)
+_totals = {"documents": 0, "pages": 0, "hits": 0, "seconds_saved": 0.0}
+
+
+def get_cache():
+    """The process-wide page cache, or None when OCR_CACHE_ENABLED is off."""
+    global _cache
+    if not OCR_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OcrPageCache()
+    return _cache
+
+
+# -----------------------------
+# STEP 3: OCR WITH THE CACHE
+# -----------------------------
+def ocr_with_page_cache(file_path, ocr_pdf, cache=None):
+    """
+    OCR text of `file_path`, OCRing only pages missing from the cache.
+
+    `ocr_pdf(pdf_bytes)` runs OCR on a PDF and returns its text
+    (raising or returning a falsy value on failure). Returns (text, stats),
+    stats = {"pages", "cached_pages", "hit_rate", "ocr_seconds", "seconds_saved"},
+    or (text, None) when the document was OCRed whole.
+    """
+    cache = cache or get_cache()
+    pages = read_pages(file_path) if cache is not None else None
+    if not pages:
+        with open(file_path, "rb") as f:
+            return ocr_pdf(f.read()), None
+
+    keys = [page_hash(page) for page in pages]
+    parts, saved = [None] * len(pages), 0.0
+    for i, key in enumerate(keys):
+        hit = cache.get(key)
+        if hit is not None:
+            parts[i], seconds = hit
+            saved += seconds
+
+    missing = [i for i, part in enumerate(parts) if part is None]
+    ocr_seconds = 0.0
+    if missing:
+        pdf = write_pages([pages[i] for i in missing]) if len(missing) < len(pages) else None
+        if pdf is None:
+            with open(file_path, "rb") as f:
+                pdf = f.read()
+        started = time.monotonic()
+        text = ocr_pdf(pdf)
+        ocr_seconds = time.monotonic() - started
+        if not text:
+            return text, None
+        new_parts = split_ocr_text(text, len(missing))
+        if new_parts is None:
+            if len(missing) == len(pages):
+                return text, None  # whole document, markers we cannot split: use as is
+            logger.warning("OCR of %d pages of %s came back without page markers; OCRing it whole", len(missing), file_path)
+            with open(file_path, "rb") as f:
+                return ocr_pdf(f.read()), None
+        per_page = ocr_seconds / len(missing)
+        for i, part in zip(missing, new_parts):
+            parts[i] = part
+            try:
+                cache.put(keys[i], part, per_page)
+            except OSError as e:
+                logger.warning("Could not cache OCR text of page %d: %s", i + 1, e)
+
+    hits = len(pages) - len(missing)
+    stats = {
+        "pages": len(pages),
+        "cached_pages": hits,
+        "hit_rate": round(hits / len(pages), 3),
+        "ocr_seconds": round(ocr_seconds, 2),
+        "seconds_saved": round(saved, 2),
+    }
+    with _cache_lock:
+        _totals["documents"] += 1
+        _totals["pages"] += len(pages)
+        _totals["hits"] += hits
+        _totals["seconds_saved"] += saved
+        totals = dict(_totals)
+    logger.info(
+        "OCR page cache: %d/%d pages cached (%.0f%%), ~%.1f s saved; process total %d/%d pages (%.0f%%), ~%.0f s saved",
+        hits, len(pages), stats["hit_rate"] * 100, saved,
+        totals["hits"], totals["pages"], totals["hits"] / totals["pages"] * 100, totals["seconds_saved"],
+    )
+    return stitch(parts), stats
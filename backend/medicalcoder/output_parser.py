@@ -0,0 +1,371 @@
+"""
+output_parser.py — Tolerant extraction + strict validation of model output
+
+One parser per prompt in prompts.py:
+
+    "parent"    → ["F41", "R53"]                       (Python-style list)
+    "specified" → {"icd10_codes": [{"code", "description"}]}
+    "cpt"       → {"cpt_codes": [...], "hcpcs_codes": [...]}
+
+Raw responses are cleaned up first (```json fences, prose before/after the
+payload, single-quoted Python literals), then checked against a schema that
+is compiled once into a validator function. ICD codes are checked against
+the local hierarchy index (icd_index.py): a code that does not exist is
+replaced by its nearest valid ancestor below the category, or dropped.
+Anything that cannot be repaired raises OutputParseError so only that stage
+is retried (see pipeline_stages).
+"""
+
+import ast
+import json
+import re
+
+from .icd_index import get_index, normalize_code
+
+ICD_CATEGORY_RE = re.compile(r"^[A-Z]\d[0-9A-Z]$")
+ICD_CODE_RE = re.compile(r"^[A-Z]\d[0-9A-Z](?:\.[0-9A-Z]{1,4})?$")
+CPT_CODE_RE = re.compile(r"^\d{4}[0-9FTU]$")
+HCPCS_CODE_RE = re.compile(r"^[A-V]\d{4}$")
+MODIFIER_RE = re.compile(r"^[0-9A-Z]{2}$")
+
+FENCE_RE = re.compile(r"```(?:json|python|py)?\s*(.*?)```", re.S | re.I)
+BARE_ICD_RE = re.compile(r"\b[A-Z]\d[0-9A-Z](?:\.[0-9A-Z]{1,4})?\b")
+
+
+class OutputParseError(ValueError):
+    """Model output could not be turned into the expected structure."""
+
+    def __init__(self, stage, message, raw=None):
+        super().__init__(f"[{stage}] {message}")
+        self.stage = stage
+        self.raw = raw
+
+
+# -----------------------------
+# STEP 1: TOLERANT EXTRACTION
+# -----------------------------
+def _balanced_spans(text):
+    """Yield top-level {...} / [...] substrings, skipping brackets inside strings."""
+    pairs = {"{": "}", "[": "]"}
+    i, n = 0, len(text)
+    while i < n:
+        if text[i] not in pairs:
+            i += 1
+            continue
+        stack, quote, j = [pairs[text[i]]], None, i + 1
+        while j < n and stack:
+            ch = text[j]
+            if quote:
+                if ch == "\\":
+                    j += 1
+                elif ch == quote:
+                    quote = None
+            elif ch in "\"'":
+                quote = ch
+            elif ch in pairs:
+                stack.append(pairs[ch])
+            elif ch == stack[-1]:
+                stack.pop()
+            j += 1
+        if not stack:
+            yield text[i:j]
+            i = j
+        else:
+            i += 1
+
+
+def _object_pairs(pairs):
+    """
+    Keep duplicate "description" keys: the CPT prompt's template lists
+    "description" twice, the second one meaning the modifier's description.
+    """
+    obj = {}
+    for key, value in pairs:
+        if key == "description" and key in obj and "description_modifier" not in obj:
+            key = "description_modifier"
+        obj[key] = value
+    return obj
+
+
+def _loads(candidate):
+    try:
+        return json.loads(candidate, object_pairs_hook=_object_pairs)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def extract_payload(raw):
+    """
+    Best-effort decode of a model response into Python data.
+
+    Accepts already-decoded dicts/lists, fenced blocks, JSON or Python
+    literals surrounded by prose. Returns None when nothing decodes.
+    """
+    if isinstance(raw, (dict, list)):
+        return raw
+    if raw is None:
+        return None
+    text = str(raw).strip()
+
+    candidates = [m.group(1).strip() for m in FENCE_RE.finditer(text)] + [text]
+    for candidate in candidates:
+        value = _loads(candidate)
+        if isinstance(value, (dict, list)):
+            return value
+        for span in _balanced_spans(candidate):
+            value = _loads(span)
+            if isinstance(value, (dict, list)):
+                return value
+    return None
+
+
+# -----------------------------
+# STEP 2: COMPILED SCHEMAS
+# -----------------------------
+def Str(pattern=None, upper=False, default=None, normalize=None):
+    """Schema node for a string (optionally normalised and pattern-checked)."""
+    return {"type": "str", "pattern": pattern, "upper": upper, "default": default, "normalize": normalize}
+
+
+def ListOf(item, drop_invalid=True):
+    return {"type": "list", "item": item, "drop_invalid": drop_invalid}
+
+
+def Obj(fields, aliases=None):
+    return {"type": "obj", "fields": fields, "aliases": aliases or {}}
+
+
+def compile_schema(schema, path="$"):
+    """Turn a schema tree into a validator: value -> normalised value (or ValueError)."""
+    kind = schema["type"]
+
+    if kind == "str":
+        pattern, upper, default = schema["pattern"], schema["upper"], schema["default"]
+        normalize = schema["normalize"]
+
+        def check_str(value):
+            if value is None:
+                if default is None:
+                    raise ValueError(f"{path}: missing")
+                return default
+            text = str(value).strip()
+            if upper:
+                text = text.upper()
+            if normalize is not None:
+                text = normalize(text)
+            if pattern is not None and not pattern.match(text):
+                raise ValueError(f"{path}: {text!r} does not match {pattern.pattern}")
+            return text
+        return check_str
+
+    if kind == "list":
+        check_item = compile_schema(schema["item"], f"{path}[]")
+        drop_invalid = schema["drop_invalid"]
+
+        def check_list(value):
+            if value is None:
+                return []
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            out = []
+            for item in value:
+                try:
+                    out.append(check_item(item))
+                except ValueError:
+                    if not drop_invalid:
+                        raise
+            return out
+        return check_list
+
+    if kind == "obj":
+        checks = {name: compile_schema(sub, f"{path}.{name}") for name, sub in schema["fields"].items()}
+        aliases = schema["aliases"]
+
+        def check_obj(value):
+            if not isinstance(value, dict):
+                raise ValueError(f"{path}: expected an object, got {type(value).__name__}")
+            for alias, name in aliases.items():
+                if name not in value and alias in value:
+                    value = {**value, name: value[alias]}
+            return {name: check(value.get(name)) for name, check in checks.items()}
+        return check_obj
+
+    raise ValueError(f"Unknown schema type: {kind}")
+
+
+SPECIFIED_SCHEMA = Obj(
+    {"icd10_codes": ListOf(Obj({
+        "code": Str(ICD_CODE_RE, normalize=normalize_code),  # "f411" -> "F41.1"
+        "description": Str(default=""),
+    }))},
+    aliases={"icd_codes": "icd10_codes", "codes": "icd10_codes"},
+)
+CPT_SCHEMA = Obj({
+    "cpt_codes": ListOf(Obj(
+        {
+            "code": Str(CPT_CODE_RE, upper=True),
+            "description": Str(default=""),
+            "modifier": Str(default=""),
+            "description_modifier": Str(default=""),
+        },
+        aliases={"modifier_description": "description_modifier", "modifiers": "modifier"},
+    )),
+    "hcpcs_codes": ListOf(Obj({
+        "code": Str(HCPCS_CODE_RE, upper=True),
+        "description": Str(default=""),
+    })),
+})
+
+_check_specified = compile_schema(SPECIFIED_SCHEMA)
+_check_cpt = compile_schema(CPT_SCHEMA)
+
+
+# -----------------------------
+# STEP 3: STAGE PARSERS
+# -----------------------------
+def parse_parent_codes(raw):
+    """Parent prompt → sorted-by-appearance list of unique 3-character categories."""
+    value = extract_payload(raw)
+    if isinstance(value, dict):
+        value = value.get("icd_codes") or value.get("codes") or next(iter(value.values()), [])
+    if value is None:
+        # Plain text such as "F41, R53" or "- F41.1"
+        value = BARE_ICD_RE.findall(str(raw or "").upper())
+        if not value and str(raw or "").strip():
+            raise OutputParseError("parent", "no list or ICD-10 codes in output", raw)
+    if not isinstance(value, (list, tuple)):
+        raise OutputParseError("parent", "expected a list of parent codes", raw)
+
+    codes = []
+    for item in value:
+        code = str(item.get("code", "") if isinstance(item, dict) else item).strip().upper()[:3]
+        if ICD_CATEGORY_RE.match(code) and code not in codes:
+            codes.append(code)
+    if value and not codes:
+        raise OutputParseError("parent", "no valid ICD-10 categories in output", raw)
+    return codes
+
+
+def parse_specified_codes(raw, parent_codes=None):
+    """
+    Specified prompt → {"icd10_codes": [...]}.
+
+    Codes whose category has a local hierarchy file must exist in it. A code
+    that does not is repaired to its deepest valid prefix ("F41.19" -> "F41.1",
+    recorded in "repaired_from") only when that prefix is billable (a leaf);
+    otherwise it is dropped, so a repair never turns an invalid code into a
+    header ("F31.79" is not repaired to F31.7). When `parent_codes` is given, codes outside those
+    parents are dropped too. Dropped codes are listed in "dropped" as
+    {"code", "reason"} ("invalid" or "outside_parents").
+    """
+    value = extract_payload(raw)
+    if isinstance(value, list):
+        value = {"icd10_codes": value}
+    if value is None:
+        raise OutputParseError("specified", "no JSON object in output", raw)
+    try:
+        result = _check_specified(value)
+    except ValueError as exc:
+        raise OutputParseError("specified", str(exc), raw) from exc
+
+    index = get_index()
+    kept, dropped, seen = [], [], set()
+    for item in result["icd10_codes"]:
+        code = item["code"]
+        if index.covers(code) and not index.is_valid(code):
+            entry = index.nearest(code)
+            if entry is None or not index.is_leaf(entry.code):
+                dropped.append({"code": code, "reason": "invalid"})
+                continue
+            item = {**item, "code": entry.code, "description": entry.full_description, "repaired_from": code}
+            code = entry.code
+        if code in seen:
+            continue
+        if parent_codes and not any(index.is_within(code, p) for p in parent_codes):
+            dropped.append({"code": code, "reason": "outside_parents"})
+            continue
+        seen.add(code)
+        kept.append(item)
+    result["icd10_codes"] = kept
+    if dropped:
+        result["dropped"] = dropped
+    return result
+
+
+def parse_cpt_codes(raw):
+    """CPT prompt → {"cpt_codes": [...], "hcpcs_codes": [...]}."""
+    value = extract_payload(raw)
+    if isinstance(value, list):
+        value = {"cpt_codes": value}
+    if value is None:
+        raise OutputParseError("cpt", "no JSON object in output", raw)
+    try:
+        result = _check_cpt(value)
+    except ValueError as exc:
+        raise OutputParseError("cpt", str(exc), raw) from exc
+    for item in result["cpt_codes"]:
+        mods = [m for m in re.split(r"[\s,;/-]+", item["modifier"].upper()) if MODIFIER_RE.match(m)]
+        item["modifier"] = ", ".join(mods)
+    return result
+
+
+STAGE_PARSERS = {
+    "parent": parse_parent_codes,
+    "specified": parse_specified_codes,
+    "cpt": parse_cpt_codes,
+}
+
+
+def parse_stage_output(stage, raw, **kwargs):
+    """Dispatch to the parser for `stage` ("parent", "specified" or "cpt")."""
+    try:
+        parser = STAGE_PARSERS[stage]
+    except KeyError:
+        raise ValueError(f"Unknown stage: {stage}") from None
+    return parser(raw, **kwargs)
+
+
+# -----------------------------
+# STEP 4: PIPELINE RESULT
+# -----------------------------
+def parse_ai_result(ai_result):
+    """
+    Normalise a process_icd_codes() result for storage/response.
+
+    Each section is parsed independently; a malformed section is replaced by
+    its empty value and reported in "parse_errors" instead of failing the
+    whole document. Stages the pipeline already gave up on ("stage_errors",
+    see code_generation.py) are reported there too.
+    """
+    errors = dict(ai_result.get("stage_errors") or {})
+
+    def section(stage, raw, empty, **kwargs):
+        try:
+            return parse_stage_output(stage, raw, **kwargs)
+        except OutputParseError as exc:
+            errors[stage] = str(exc)
+            return empty
+
+    raw_parent = ai_result.get("icd_parent_codes", {})
+    if isinstance(raw_parent, dict) and "icd_codes" in raw_parent:
+        raw_parent = raw_parent["icd_codes"]
+    parents = section("parent", raw_parent, []) if raw_parent else []
+    # Specified codes must fall under a parent category the model found
+    specified = section("specified", ai_result.get("icd_codes") or {}, {"icd10_codes": []}, parent_codes=parents)
+    cpt = section("cpt", ai_result.get("cpt_codes") or {}, {"cpt_codes": [], "hcpcs_codes": []})
+
+    modifiers = [
+        {"code": item["modifier"], "description": item["description_modifier"]}
+        for item in cpt["cpt_codes"] if item["modifier"]
+    ]
+    return {
+        "icd_parent_codes": {"icd_codes": parents},
+        "icd_codes": specified,
+        "cpt_codes": cpt,
+        "modifiers": modifiers,
+        "parse_errors": errors,
+    }
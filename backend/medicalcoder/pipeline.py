@@ -0,0 +1,78 @@
+"""
+pipeline.py — Lazy entry point to the coding pipeline
+
+code_generation.py pulls in requests, BeautifulSoup and paramiko (whose
+cryptography stack is slow to load) and creates the OpenAI client. Views and workers call
+the pipeline through this module, so importing them (every gunicorn worker
+boot, every manage.py command that runs system checks) no longer pays for
+those imports; the first pipeline run does.
+
+    PIPELINE_WARMUP = True   warm_up() from AppConfig.ready() in serving
+                             processes: imports, ICD index, HTTP pool,
+                             OpenAI client
+
+With gunicorn --preload, ready() runs in the master before fork, so workers
+share the imported modules and the ICD index; the HTTP session is recreated
+in each child (hippa_pipeline.http_session). `manage.py check_import_time`
+keeps the startup import cost under a budget.
+"""
+
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# manage.py commands that serve requests or run jobs (the rest skip the warm-up)
+SERVING_COMMANDS = ("runserver", "run_coding_workers")
+
+_lock = threading.Lock()
+_modules = {}
+
+
+def _module(name):
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                module = _modules[name] = importlib.import_module(f"{__package__}.{name}")
+    return module
+
+
+def process_icd_codes(file_path):
+    """code_generation.process_icd_codes, imported on first use."""
+    return _module("code_generation").process_icd_codes(file_path)
+
+
+def is_serving(argv=None):
+    """True for gunicorn/uwsgi workers and serving manage.py commands, False for migrate & co."""
+    argv = sys.argv if argv is None else argv
+    if not argv or os.path.basename(argv[0]) != "manage.py":
+        return True
+    return len(argv) > 1 and argv[1] in SERVING_COMMANDS
+
+
+def warm_up():
+    """Import the pipeline, load the ICD index, open the HTTP pool and create the model client. Returns {step: ms}."""
+    from .icd_index import get_index
+
+    timings = {}
+    for step, fn in (
+        ("imports", lambda: _module("code_generation")),
+        ("icd_index", get_index),
+        ("http_pool", lambda: _module("hippa_pipeline").http_session()),
+        ("model_client", lambda: _module("code_generation").client()),
+    ):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            # Warm-up is best-effort: the first request loads whatever failed here
+            logger.exception("Pipeline warm-up step %s failed", step)
+        timings[step] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Pipeline warm-up (ms): %s", timings)
+    return timings
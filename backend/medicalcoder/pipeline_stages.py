@@ -0,0 +1,80 @@
+"""
+pipeline_stages.py — Run one model stage with parsing, validation and retry
+
+Each of the three prompts is a separate stage. When a response cannot be
+parsed, only that stage's model call is repeated; the OCR/redaction output
+and the other stages' results are kept.
+
+    parents = run_stage("parent", lambda: ask_model(parent_prompt))
+    icd = run_stage("specified", lambda: ask_model(spec_prompt), parent_codes=parents)
+    cpt = run_stage("cpt", lambda: ask_model(cpt_prompt))
+
+code_generation.py runs every model call this way. A stage that still fails
+after its retries is stored empty and its error is saved with the document
+(DocumentArtifact "parse_errors") and returned.
+
+A validated result is checkpointed (checkpoints.py) under the stage name, or
+`checkpoint=` for stages run once per category, e.g.
+run_stage("specified", ..., checkpoint=f"specified:{category}"); a retried
+document reuses it instead of calling the model again.
+
+Every call's tokens and latency are recorded in the active token ledger
+(token_usage.py): `call` may return the API response (or a (text, usage)
+pair) so the reported usage is used; for a bare string, pass `prompt=` to
+have the tokens estimated. A refinement stage given a `fallback` returns
+fallback() instead of calling the model once the token budget calls for it:
+
+    icd = run_stage("specified", ..., prompt=spec_prompt, fallback=lambda: parents_as_codes)
+"""
+
+import logging
+import os
+import time
+
+from .checkpoints import checkpointed
+from .output_parser import OutputParseError, parse_stage_output
+from .progress import report
+from .token_usage import record_call, should_skip, split_response
+from .upstream_limits import upstream_slot
+
+logger = logging.getLogger(__name__)
+
+STAGE_RETRIES = int(os.getenv("STAGE_RETRIES", "2"))
+
+
+def run_stage(stage, call, retries=None, checkpoint=None, prompt=None, fallback=None, **parse_kwargs):
+    """
+    Call the model for one stage and return its validated output.
+
+    `call` is a zero-argument callable returning the raw model response.
+    It is re-invoked up to `retries` more times while the response fails to
+    parse; the last OutputParseError is raised when every attempt fails.
+    Transport errors raised by `call` are not retried here. Each call holds
+    a "model" upstream slot in the document's lane (upstream_limits.py).
+    The parsed result is published as a progress event so clients see it
+    immediately.
+    """
+    retries = STAGE_RETRIES if retries is None else retries
+    if fallback is not None and should_skip(stage):
+        result = fallback()
+        report(stage, result=result, skipped="token_budget", **parse_kwargs)
+        return result
+
+    def attempt():
+        last_error = None
+        for n in range(1, retries + 2):
+            with upstream_slot("model"):
+                started = time.monotonic()
+                raw = call()
+            raw, usage = split_response(raw)
+            record_call(stage, prompt, raw, time.monotonic() - started, usage)
+            try:
+                return parse_stage_output(stage, raw, **parse_kwargs)
+            except OutputParseError as exc:
+                last_error = exc
+                logger.warning("Stage %s attempt %d returned unparseable output: %s", stage, n, exc)
+        raise last_error
+
+    result = checkpointed(checkpoint or stage, attempt)
+    report(stage, result=result, **parse_kwargs)
+    return result
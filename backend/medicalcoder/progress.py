@@ -0,0 +1,135 @@
+"""
+progress.py — Per-stage progress events for in-flight documents
+
+The upload view opens a tracker for the request's job id; pipeline code
+reports stages with `report(stage, **data)` without needing a handle
+(the active tracker lives in a context variable, so process_icd_codes and
+hipaa_main keep their signatures). Events are appended to the Django cache
+and streamed to the client by MedicalDocumentProgressView as Server-Sent
+Events.
+
+Use a cache shared by all workers (CACHE_URL: Redis/Memcached/database
+cache) in production. With a per-process cache (the local-memory default)
+shared_cache() is false and the view only answers short JSON polls, since a
+stream held by one process would never see events published by another.
+Context variables are not copied into plain threads: code that fans out
+per-category calls to a thread pool should use contextvars.copy_context().
+
+A run ends with "completed" or "failed". A coding job that failed but will
+be retried publishes "retrying" instead, and its next attempt appends to the
+same event log.
+"""
+
+import contextvars
+import time
+import uuid
+from contextlib import contextmanager
+
+EVENT_TTL_SECONDS = 60 * 60
+TERMINAL_STAGES = ("completed", "failed")
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+_current = contextvars.ContextVar("pipeline_progress", default=None)
+
+
+def _cache():
+    # Imported lazily so hippa_pipeline can import this module as a plain script
+    from django.core.cache import cache
+    return cache
+
+
+def shared_cache():
+    """True when the default cache is visible to every worker process."""
+    from django.conf import settings
+    return settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHE_BACKENDS
+
+
+def _key(job_id, suffix):
+    return f"pipeline-progress:{job_id}:{suffix}"
+
+
+def new_job_id(value=None):
+    """Validate a client-supplied job id (UUID) or create a new one."""
+    if value:
+        try:
+            return str(uuid.UUID(str(value)))
+        except ValueError:
+            pass
+    return str(uuid.uuid4())
+
+
+class JobIdTaken(RuntimeError):
+    """The job id already belongs to another user's run (the API answers 409)."""
+
+
+class ProgressTracker:
+    """Append-only event log for one pipeline run."""
+
+    def __init__(self, job_id, user_id=None):
+        self.job_id = job_id
+        self.user_id = user_id
+
+    def start(self):
+        """Claim the job id for this user; a retry by the same user appends to its log."""
+        cache = _cache()
+        owner = self.user_id or 0
+        if not cache.add(_key(self.job_id, "owner"), owner, EVENT_TTL_SECONDS):
+            if cache.get(_key(self.job_id, "owner")) != owner:
+                raise JobIdTaken(f"Job id {self.job_id} is in use.")
+        cache.add(_key(self.job_id, "seq"), 0, EVENT_TTL_SECONDS)
+        self.publish("received")
+
+    def publish(self, stage, **data):
+        cache = _cache()
+        seq = cache.incr(_key(self.job_id, "seq"))
+        event = {"seq": seq, "stage": stage, "ts": time.time(), "data": data}
+        cache.set(_key(self.job_id, seq), event, EVENT_TTL_SECONDS)
+        return event
+
+
+@contextmanager
+def track(job_id, user_id=None):
+    """Make `job_id` the active tracker for code running inside the block."""
+    tracker = ProgressTracker(job_id, user_id)
+    tracker.start()
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    except Exception as exc:
+        tracker.publish("failed", message=str(exc))
+        raise
+    finally:
+        _current.reset(token)
+
+
+def report(stage, **data):
+    """Publish a stage event to the active tracker (no-op outside `track`)."""
+    tracker = _current.get()
+    if tracker is None:
+        return None
+    try:
+        return tracker.publish(stage, **data)
+    except Exception:
+        # Progress is best-effort; never fail a pipeline run because of it
+        return None
+
+
+# -----------------------------
+# READ SIDE
+# -----------------------------
+def job_owner(job_id):
+    """User id that started the job, 0 for anonymous, None if unknown."""
+    return _cache().get(_key(job_id, "owner"))
+
+
+def read_events(job_id, after=0):
+    """Events with seq > `after`, in order."""
+    cache = _cache()
+    last = cache.get(_key(job_id, "seq")) or 0
+    if last <= after:
+        return []
+    found = cache.get_many([_key(job_id, n) for n in range(after + 1, last + 1)])
+    return [found[k] for k in sorted(found, key=lambda k: found[k]["seq"])]
@@ -0,0 +1,31 @@
+"""
+querycount.py — Query-count assertions for N+1 checks
+
+    with assert_max_queries(3):
+        list(MedicalDocument.objects.with_owner())
+
+Works with DEBUG off (CaptureQueriesContext forces a debug cursor for the
+block only).
+"""
+
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def capture_queries(using=DEFAULT_DB_ALIAS):
+    """Yield a CaptureQueriesContext; `len(ctx)` is the number of queries run."""
+    with CaptureQueriesContext(connections[using]) as ctx:
+        yield ctx
+
+
+@contextmanager
+def assert_max_queries(limit, using=DEFAULT_DB_ALIAS):
+    """Raise AssertionError (listing the SQL) when the block runs more than `limit` queries."""
+    with capture_queries(using) as ctx:
+        yield ctx
+    if len(ctx) > limit:
+        statements = "\n".join(f"  {q['sql']}" for q in ctx.captured_queries)
+        raise AssertionError(f"{len(ctx)} queries executed, expected at most {limit}:\n{statements}")
@@ -0,0 +1,246 @@
+"""
+redaction_batch.py — Redaction cache, and opt-in batching of redaction requests
+
+What is active by default is the cache (RedactionCache below). Batching is
+off: REDACTION_BATCH_SIZE defaults to 1, and every document is then sent on
+its own in the single-file form the pipeline has always used,
+{"path": ..., "output_path": ...}.
+
+The endpoint is named /redact-text-batched, but its multi-file request and
+response format has not been confirmed against the API.
+hippa_pipeline.post_redaction() assumes {"paths": [...], "output_path": ...}
+in and {"results": [...]} out, with results matched by "path" or else by
+position (demultiplex). Check that against the service before setting
+REDACTION_BATCH_SIZE above 1.
+
+When enabled, RedactionBatcher collects the redactions requested by
+concurrent pipeline runs in one process (run_coding_workers threads,
+threaded web workers). It waits up to REDACTION_BATCH_WINDOW_MS or
+REDACTION_BATCH_SIZE items, sends them as one request and hands each caller
+its own result:
+
+    future = get_batcher(send).submit(remote_path, output_dir)
+    data = future.result()      # this file's {"status", "redacted_file", ...}
+
+Results are matched to callers by input path. Every document must upload to
+its own remote file (hippa_pipeline.redact_remote names them after the
+document and run), and a path submitted twice is never sent in the same
+batch. A batch of one is sent in the single-file form. Each batch holds a
+"redaction" upstream slot in the best lane among its items.
+
+RedactionCache maps the SHA-256 of the OCR text (as returned by run_ocr,
+never re-read from a shared file) to the redacted text, so a
+document whose text was already redacted (re-uploads, the same note in
+several files) skips upload, redaction and download. Entries expire after
+REDACTION_CACHE_TTL_SECONDS; `manage.py prune_checkpoints` removes them.
+
+No Django imports: hippa_pipeline.py also runs as a plain script.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from .upstream_limits import LANES, UPSTREAM_LIMITS, current_lane, upstream_slot
+except ImportError:  # run as a script from medicalcoder/
+    from upstream_limits import LANES, UPSTREAM_LIMITS, current_lane, upstream_slot
+
+# -----------------------------
+# CONFIGURATION
+# -----------------------------
+REDACTION_BATCH_SIZE = int(os.getenv("REDACTION_BATCH_SIZE", "1"))  # >1 needs the batch format confirmed
+REDACTION_BATCH_WINDOW_MS = float(os.getenv("REDACTION_BATCH_WINDOW_MS", "200"))
+
+REDACTION_CACHE_DIR = os.getenv(
+    "REDACTION_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".redaction_cache"),
+)
+REDACTION_CACHE_TTL_SECONDS = int(os.getenv("REDACTION_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+REDACTION_CACHE_ENABLED = os.getenv("REDACTION_CACHE_ENABLED", "1") == "1"
+
+
+# -----------------------------
+# BATCHER
+# -----------------------------
+class RedactionBatcher:
+    """
+    Collects (path, output_dir) items and sends them in batches.
+
+    `send(paths, output_dir)` makes one API call and returns one result per
+    path, in order; it raises when the whole call fails. Items for different
+    output directories go in separate calls.
+    """
+
+    def __init__(self, send, max_items=None, window_ms=None, workers=None):
+        self.send = send
+        self.max_items = max(REDACTION_BATCH_SIZE if max_items is None else max_items, 1)
+        self.window = (REDACTION_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self._pending = []  # (path, output_dir, lane, Future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or UPSTREAM_LIMITS.get("redaction", 1), thread_name_prefix="redaction-batch"
+        )
+        self.calls = 0  # API calls made (one per batch)
+
+    def submit(self, path, output_dir):
+        future = Future()
+        with self._cond:
+            self._pending.append((path, output_dir, current_lane.get(), future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name="redaction-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # The first item opens the window; a full batch closes it early
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_items], self._pending[self.max_items:]
+            for output_dir, items in self._split(batch):
+                self._pool.submit(self._flush, output_dir, items)
+
+    @staticmethod
+    def _split(batch):
+        """One call per output directory, and never the same path twice in a call."""
+        calls = []  # [(output_dir, items, paths)]
+        for item in batch:
+            path, output_dir = item[0], item[1]
+            for call_dir, items, paths in calls:
+                if call_dir == output_dir and path not in paths:
+                    items.append(item)
+                    paths.add(path)
+                    break
+            else:
+                calls.append((output_dir, [item], {path}))
+        return [(output_dir, items) for output_dir, items, _ in calls]
+
+    def _flush(self, output_dir, items):
+        lane = min((item[2] for item in items), key=lambda name: LANES.index(name) if name in LANES else len(LANES))
+        try:
+            with upstream_slot("redaction", lane):
+                with self._cond:
+                    self.calls += 1
+                results = self.send([item[0] for item in items], output_dir)
+            if len(results) != len(items):
+                raise ValueError(f"Redaction batch returned {len(results)} results for {len(items)} files")
+        except Exception as exc:
+            for item in items:
+                item[3].set_exception(exc)
+            return
+        for item, result in zip(items, results):
+            item[3].set_result(result)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(send):
+    """Process-wide batcher around `send` (created on first use)."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = RedactionBatcher(send)
+    return _batcher
+
+
+def _reset_batcher():
+    # The collector thread does not survive a fork; children start their own
+    global _batcher, _batcher_lock
+    _batcher, _batcher_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_batcher)
+
+
+def demultiplex(paths, data):
+    """
+    Per-file results of a batched response, in `paths` order (assumed
+    {"results": [...]}; unconfirmed, see the module docstring).
+
+    Results are matched on their "path" when the API echoes it, otherwise by
+    position. A file missing from the response gets a failed result.
+    """
+    results = data.get("results") or []
+    by_path = {r.get("path"): r for r in results if isinstance(r, dict) and r.get("path")}
+    if by_path:
+        return [by_path.get(path, {"status": "error", "path": path, "message": "missing from batch"}) for path in paths]
+    return [results[i] if i < len(results) else {"status": "error", "path": path, "message": "missing from batch"}
+            for i, path in enumerate(paths)]
+
+
+# -----------------------------
+# CACHE
+# -----------------------------
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+CACHE_VERSION = 1
+
+
+class RedactionCache:
+    """Redacted text by OCR text hash: REDACTION_CACHE_DIR/<key[:2]>/<key>.v1.txt"""
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = directory or REDACTION_CACHE_DIR
+        self.ttl = REDACTION_CACHE_TTL_SECONDS if ttl is None else ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.v{CACHE_VERSION}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, content):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def prune(self, max_age_seconds=None):
+        """Remove entries older than `max_age_seconds` (default: the TTL). Returns the count."""
+        cutoff = time.time() - (self.ttl if max_age_seconds is None else max_age_seconds)
+        removed = 0
+        if not os.path.isdir(self.directory):
+            return 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def get_cache():
+    """The redaction cache, or None when REDACTION_CACHE_ENABLED is off."""
+    return RedactionCache() if REDACTION_CACHE_ENABLED else None
@@ -0,0 +1,83 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # optional dependency, DRF's encoder is the fallback
+    orjson = None
+
+# orjson >= 3.9 can embed pre-encoded JSON text without parsing it
+RAW_JSON_SUPPORTED = orjson is not None and hasattr(orjson, "Fragment")
+
+
+class RawJSON:
+    """Already-encoded JSON text (e.g. a JSON column read as text) to embed as-is."""
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __reduce__(self):
+        return (RawJSON, (self.text,))
+
+
+class FastJSONEncoder(encoders.JSONEncoder):
+    """DRF's encoder plus RawJSON support (decoded, so the output is the same)."""
+
+    def default(self, obj):
+        if isinstance(obj, RawJSON):
+            return json.loads(obj.text)
+        return super().default(obj)
+
+
+_fallback_encoder = FastJSONEncoder()
+
+
+def _orjson_default(value):
+    if isinstance(value, RawJSON) and RAW_JSON_SUPPORTED:
+        return orjson.Fragment(value.text)
+    # datetimes, Decimals, lazy strings, ... formatted exactly like DRF
+    return _fallback_encoder.default(value)
+
+
+def encode_json(value):
+    """Compact JSON bytes, the same output FastJSONRenderer produces."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_orjson_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    text = json.dumps(value, cls=FastJSONEncoder, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    # Same escaping as DRF's JSONRenderer
+    return text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode("utf-8")
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson when it is installed (several times faster
+    for large document lists); otherwise DRF's JSONRenderer. Both produce the
+    same JSON values as DRF's compact output.
+    """
+    encoder_class = FastJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return encode_json(data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF content negotiation accept `Accept: text/event-stream`.
+    Streaming views return a StreamingHttpResponse directly; this only renders
+    error payloads (e.g. authentication failures) as a single SSE event.
+    """
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return f"event: error\ndata: {json.dumps(data, default=str)}\n\n".encode(self.charset)
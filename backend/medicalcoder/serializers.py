@@ -1,7 +1,14 @@
 from django.contrib.auth import get_user_model, password_validation
+from django.conf import settings
 from django.contrib.auth.hashers import check_password
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
 from rest_framework import serializers
-from .models import MedicalDocument
+from .artifacts import CODE_FIELDS, code_summary, load_codes, update_codes
+from .exports import CODE_TYPES, FORMATS, parquet_available
+from .models import CodingJob, ExportJob, MedicalDocument
+from .renderers import RAW_JSON_SUPPORTED, RawJSON, orjson
 
 User = get_user_model()
 
@@ -52,6 +59,7 @@ class PasswordChangeSerializer(serializers.Serializer):
     def save(self, **kwargs):
         user = self.context["request"].user
         user.set_password(self.validated_data["new_password"][:72])
+        user.token_version += 1  # revoke tokens issued with the old password
         user.save()
         return user
 
@@ -75,6 +83,7 @@ class PasswordResetSerializer(serializers.Serializer):
     def save(self, **kwargs):
         user = self.validated_data["user"]
         user.set_password(self.validated_data["new_password"][:72])
+        user.token_version += 1  # revoke tokens issued with the old password
         user.save()
         return user
 
@@ -102,17 +111,169 @@ class MedicalDocumentSerializer(serializers.ModelSerializer):
             "id",
             "user",
             "file_path",
+            "content_hash",
+            "status",
             "icd_parent_codes",
             "icd_specified_codes",
             "cpt_codes",
             "modifiers",
             "hcpcs_codes",
+            "code_summary",
             "created_at",
             "updated_at",
         ]
-        read_only_fields = ["id", "user", "created_at", "updated_at"]
+        read_only_fields = ["id", "user", "content_hash", "status", "code_summary", "created_at", "updated_at"]
 
     def create(self, validated_data):
         user = self.context["request"].user
         validated_data["user"] = user
         return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        changes = {f: validated_data[f] for f in CODE_FIELDS if f in validated_data}
+        if changes and instance.payload_external:
+            for f in changes:
+                validated_data.pop(f)
+            update_codes(instance, changes)
+        elif changes:
+            instance._codes_cache = None
+            validated_data["code_summary"] = code_summary({**load_codes(instance), **changes})
+        return super().update(instance, validated_data)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # External payloads are expanded for single documents only; list views
+        # pass expand_payload=False and rely on code_summary
+        if instance.payload_external and self.context.get("expand_payload", True):
+            data.update(load_codes(instance))
+        return data
+
+
+class ExportRequestSerializer(serializers.Serializer):
+    """
+    Export format and filters, from query params (stream) or the job request body.
+    `file_format`, not `format`: DRF reserves ?format= for renderer selection.
+    """
+    file_format = serializers.ChoiceField(choices=list(FORMATS), default="csv")
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.ChoiceField(
+        choices=[c for c, _ in MedicalDocument.STATUS_CHOICES], default=MedicalDocument.STATUS_COMPLETED
+    )
+    # Comma-separated subset of icd10,cpt,hcpcs
+    code_types = serializers.CharField(required=False, default=",".join(CODE_TYPES))
+    all_users = serializers.BooleanField(default=False)
+
+    def validate_file_format(self, value):
+        if value == "parquet" and not parquet_available():
+            raise serializers.ValidationError("Parquet exports are not available (pyarrow is not installed).")
+        return value
+
+    def validate_code_types(self, value):
+        types = tuple(t.strip() for t in value.split(",") if t.strip())
+        unknown = set(types) - set(CODE_TYPES)
+        if unknown or not types:
+            raise serializers.ValidationError(f"Choose from: {', '.join(CODE_TYPES)}.")
+        return types
+
+    def validate(self, attrs):
+        if attrs.get("start") and attrs.get("end") and attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError({"end": "End date is before start date."})
+        return attrs
+
+    def job_filters(self):
+        """validated_data without the format, JSON-ready for ExportJob.filters."""
+        data = self.validated_data
+        filters = {
+            "status": data["status"],
+            "code_types": ",".join(data["code_types"]),
+            "all_users": data["all_users"],
+        }
+        for name in ("start", "end"):
+            if data.get(name):
+                filters[name] = data[name].isoformat()
+        return filters
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExportJob
+        fields = [
+            "id", "format", "filters", "status", "document_count", "row_count",
+            "error", "created_at", "started_at", "finished_at",
+        ]
+        read_only_fields = fields
+
+
+class CodingJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CodingJob
+        fields = [
+            "id", "original_name", "lane", "status", "attempts", "document", "error",
+            "created_at", "started_at", "finished_at",
+        ]
+        read_only_fields = fields
+
+
+# -----------------------------------------------------------------------------
+# Read-optimized list path
+# -----------------------------------------------------------------------------
+JSON_FIELDS = (*CODE_FIELDS, "code_summary")
+
+
+def _datetime_formatter():
+    """Same representation as serializers.DateTimeField, resolved once per call."""
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    convert = tz is not None and str(tz) != "UTC"  # DB values are already UTC
+
+    def fmt(value):
+        if convert:
+            value = value.astimezone(tz)
+        value = value.isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+    return fmt
+
+
+def iter_document_rows(queryset, chunk_size=None):
+    """
+    MedicalDocumentSerializer(queryset, many=True).data for list responses,
+    built from .values() rows without per-field serializer calls. With
+    `chunk_size`, rows are fetched with .iterator(chunk_size) so only one
+    chunk is held in memory at a time.
+
+    With orjson installed, JSON columns are read as text: orjson >= 3.9 embeds
+    them as-is (no decode/re-encode), older versions decode them with
+    orjson.loads, which is much cheaper than JSONField's json.loads.
+    """
+    fields = MedicalDocumentSerializer.Meta.fields
+    # Resolved now, not when a streaming response is finally iterated
+    fmt = _datetime_formatter()
+    if orjson is not None:
+        raw = {f"{name}__raw": Cast(name, TextField()) for name in JSON_FIELDS}
+        rows = queryset.values(*(f for f in fields if f not in JSON_FIELDS and f != "user"), "user_id", **raw)
+        wrap = RawJSON if RAW_JSON_SUPPORTED else orjson.loads
+    else:
+        rows = queryset.values(*(f for f in fields if f != "user"), "user_id")
+        wrap = None
+    if chunk_size:
+        rows = rows.iterator(chunk_size=chunk_size)
+
+    def generate():
+        for row in rows:
+            item = {}
+            for name in fields:
+                if name == "user":
+                    item[name] = row["user_id"]
+                elif name in ("created_at", "updated_at"):
+                    item[name] = fmt(row[name])
+                elif wrap is not None and name in JSON_FIELDS:
+                    text = row[f"{name}__raw"]
+                    item[name] = wrap(text) if text is not None else None
+                else:
+                    item[name] = row[name]
+            yield item
+    return generate()
+
+
+def document_rows(queryset):
+    return list(iter_document_rows(queryset))
@@ -0,0 +1,851 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .admission import AdmissionController, PipelineBusy, SharedSlots, check_shared_cache
+from .authentication import CACHED_FIELDS, CachedJWTAuthentication, _key
+from .checkpoints import CheckpointStore, checkpoint_scope, checkpointed
+from . import hashing_pool, hippa_pipeline
+from .code_retrieval import DEFAULT_TOP_K, MAX_CANDIDATES_FACTOR, CodeRetrievalIndex, load_labels, recall_at_k
+from . import code_generation
+from .coding_jobs import claim_jobs, release_jobs, requeue_expired, run_coding_job
+from .cpt_rules import extract_facts, precode_cpt
+from .icd_codeset import IcdCodeSet, parse_order_lines, write_codeset
+from .icd_hierarchy import hierarchy_text, load_all
+from .icd_index import IcdIndex, code_key, normalize_code
+from .management.commands.check_import_time import parse_importtime
+from .exports import iter_export_chunks, requeue_expired_exports
+from .models import CodingJob, ExportJob, MedicalDocument, PipelineSlot, UsageRollup, file_sha256
+from .note_compaction import build_prompt_context
+from .ocr_cache import PAGE_MARKER, OcrPageCache, split_ocr_text, stitch
+from .output_parser import OutputParseError, parse_ai_result, parse_parent_codes, parse_specified_codes
+from . import pipeline_stages
+from .progress import JobIdTaken, read_events, track
+from .prompts import prompt_for_parent_codes
+from .throttling import UploadUserThrottle
+from . import token_usage
+
+
+def _tempdir(test):
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return directory.name
+
+
+# -----------------------------
+# CPT RULES
+# -----------------------------
+class CptRulesTests(SimpleTestCase):
+    def test_psychotherapy_minutes(self):
+        self.assertEqual(extract_facts("Psychotherapy time: 38 minutes.").psychotherapy_minutes, 38)
+        self.assertEqual(extract_facts("45 minutes of supportive psychotherapy").psychotherapy_minutes, 45)
+        self.assertEqual(extract_facts("Spent 30 minutes in psychotherapy.").psychotherapy_minutes, 30)
+        self.assertEqual(extract_facts("Psychotherapy (40 minutes) focused on CBT.").psychotherapy_minutes, 40)
+        self.assertEqual(extract_facts("A 30-minute psychotherapy session.").psychotherapy_minutes, 30)
+
+    def test_total_time_from_clock_range(self):
+        self.assertEqual(extract_facts("Start time: 9:10 am, End time: 10:05 am").total_minutes, 55)
+
+    def test_psychotherapy_only(self):
+        result = precode_cpt("Individual psychotherapy provided. Psychotherapy time: 53 minutes. Via Zoom.")
+        self.assertFalse(result.needs_model)
+        self.assertEqual([c["code"] for c in result.cpt_codes], ["90837"])
+        self.assertEqual(result.cpt_codes[0]["modifier"], "95")
+
+    def test_em_with_psychotherapy_addon(self):
+        result = precode_cpt(
+            "Established patient, follow-up visit for medication management. "
+            "Total time: 45 minutes. Psychotherapy time: 20 minutes."
+        )
+        self.assertEqual([c["code"] for c in result.cpt_codes], ["99213", "90833"])
+        self.assertEqual(result.cpt_codes[0]["modifier"], "25")
+
+    def test_psychotherapy_in_history_not_coded(self):
+        result = precode_cpt("Prior psychotherapy with another provider in 2019. Follow-up visit. Total time: 45 minutes.")
+        self.assertTrue(result.needs_model)
+        self.assertEqual(result.cpt_codes, [])
+
+    def test_crisis_in_history_not_coded(self):
+        result = precode_cpt("Patient previously underwent crisis psychotherapy last year. Total time 60 minutes.")
+        self.assertTrue(result.needs_model)
+        self.assertEqual(result.facts.history_services, {"crisis", "psychotherapy"})
+
+    def test_history_heading_not_coded(self):
+        result = precode_cpt("Past psychiatric history:\nPsychotherapy and CBT in college.\n\nTotal time: 45 minutes.")
+        self.assertTrue(result.needs_model)
+
+    def test_current_psychotherapy_with_history_mention(self):
+        result = precode_cpt(
+            "Psychotherapy with the patient today, total time: 45 minutes. Prior psychotherapy in 2019 was helpful."
+        )
+        self.assertEqual([c["code"] for c in result.cpt_codes], ["90834"])
+
+    def test_unclear_note_goes_to_the_model(self):
+        result = precode_cpt("Patient seen. Plan discussed.")
+        self.assertTrue(result.needs_model)
+        self.assertEqual(result.reasons, ["No recognizable service type"])
+
+
+# -----------------------------
+# NOTE COMPACTION
+# -----------------------------
+class NoteCompactionTests(SimpleTestCase):
+    NOTE = (
+        "Chief Complaint: anxiety and low mood for several months.\n\n"
+        "Plan: Psychotherapy 45 minutes spent with patient today. Continue sertraline 50 mg daily "
+        "and follow up in four weeks for review."
+    )
+
+    def test_paragraphs_dropped_for_budget_counted_once(self):
+        # The time line copied out of the plan paragraph is not a third paragraph
+        _, report = build_prompt_context(self.NOTE, "cpt", budget=5)
+        self.assertEqual(report.dropped_paragraphs, 2)
+        _, report = build_prompt_context(self.NOTE, "cpt", budget=1000)
+        self.assertEqual(report.dropped_paragraphs, 0)
+
+    def test_note_without_headings_kept(self):
+        note = "Generalized anxiety for months, worse at work. Sleep is poor."
+        context, report = build_prompt_context(note, "parent")
+        self.assertEqual(context, note)
+        self.assertEqual(report.sections, ["visit"])
+
+
+# -----------------------------
+# OUTPUT PARSER
+# -----------------------------
+class OutputParserTests(SimpleTestCase):
+    def specified(self, *codes, **kwargs):
+        raw = json.dumps({"icd10_codes": [{"code": code, "description": "x"} for code in codes]})
+        return [item["code"] for item in parse_specified_codes(raw, **kwargs)["icd10_codes"]]
+
+    def test_parent_codes_from_fenced_json(self):
+        self.assertEqual(parse_parent_codes('```json\n["F41.1", "f32", "F41"]\n```'), ["F41", "F32"])
+
+    def test_parent_codes_without_json(self):
+        with self.assertRaises(OutputParseError):
+            parse_parent_codes("I could not find any codes.")
+
+    def test_repair_to_billable_prefix(self):
+        raw = json.dumps({"icd10_codes": [{"code": "F41.19", "description": "x"}]})
+        item = parse_specified_codes(raw)["icd10_codes"][0]
+        self.assertEqual((item["code"], item["repaired_from"]), ("F41.1", "F41.19"))
+
+    def test_no_repair_to_header(self):
+        # F31.7 exists but is not billable
+        self.assertEqual(self.specified("F31.79"), [])
+
+    def test_codes_outside_parents_dropped(self):
+        self.assertEqual(self.specified("F41.1", "F32.A", parent_codes=["F41"]), ["F41.1"])
+
+    def test_pipeline_result_keeps_specified_codes_under_parents(self):
+        result = parse_ai_result({
+            "icd_parent_codes": {"icd_codes": ["F41"]},
+            "icd_codes": {"icd10_codes": [{"code": "F41.1", "description": "x"}, {"code": "F43.10", "description": "x"}]},
+        })
+        self.assertEqual([item["code"] for item in result["icd_codes"]["icd10_codes"]], ["F41.1"])
+        self.assertEqual(result["icd_codes"]["dropped"], [{"code": "F43.10", "reason": "outside_parents"}])
+
+    def test_parse_errors_reported_per_section(self):
+        result = parse_ai_result({
+            "icd_parent_codes": {"icd_codes": ["F41"]},
+            "icd_codes": "no json here",
+            "cpt_codes": {"cpt_codes": [{"code": "90834", "description": "x", "modifier": "95"}]},
+        })
+        self.assertEqual(result["icd_codes"], {"icd10_codes": []})
+        self.assertEqual(list(result["parse_errors"]), ["specified"])
+        self.assertEqual(result["modifiers"][0]["code"], "95")
+
+
+# -----------------------------
+# CODING PIPELINE
+# -----------------------------
+def _completion(content, prompt_tokens, completion_tokens):
+    return {
+        "choices": [{"message": {"content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+    }
+
+
+class CodeGenerationTests(TestCase):
+    NOTE = "Generalized anxiety for months. Individual psychotherapy provided. Psychotherapy time: 53 minutes."
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("coder", password="pw")
+
+    def patch_model(self, specified_output):
+        def ask_model(prompt):
+            if prompt.startswith(prompt_for_parent_codes):
+                return _completion('["F41"]', 100, 5)
+            return _completion(specified_output, 200, 20)
+
+        patches = [
+            mock.patch.object(code_generation, "hipaa_main", return_value=self.NOTE),
+            mock.patch.object(code_generation, "ask_model", side_effect=ask_model),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return code_generation.ask_model
+
+    def run_pipeline(self, specified_output):
+        model = self.patch_model(specified_output)
+        with token_usage.accounting(self.user.pk) as usage:
+            result = code_generation.process_icd_codes("note.pdf")
+        return result, usage, model
+
+    def test_stages_run_through_run_stage(self):
+        specified = json.dumps({"icd10_codes": [{"code": "F41.1", "description": "Generalized anxiety disorder"}]})
+        result, usage, model = self.run_pipeline(specified)
+
+        self.assertEqual(model.call_count, 2)  # CPT is coded by the rules
+        parsed = parse_ai_result(result)
+        self.assertEqual(parsed["icd_parent_codes"]["icd_codes"], ["F41"])
+        self.assertEqual([item["code"] for item in parsed["icd_codes"]["icd10_codes"]], ["F41.1"])
+        self.assertEqual([item["code"] for item in parsed["cpt_codes"]["cpt_codes"]], ["90837"])
+        self.assertEqual(parsed["parse_errors"], {})
+
+        self.assertEqual(usage.stages["parent"]["prompt_tokens"], 100)
+        self.assertEqual(usage.stages["specified"]["completion_tokens"], 20)
+        self.assertEqual(usage.total_tokens, 325)
+        self.assertEqual(UsageRollup.objects.filter(user_id=usage.user_id).count(), 2)
+
+    def test_unparseable_stage_reported(self):
+        result, usage, model = self.run_pipeline("no codes here")
+
+        self.assertEqual(model.call_count, 1 + 1 + pipeline_stages.STAGE_RETRIES)
+        self.assertEqual(usage.stages["specified"]["calls"], 1 + pipeline_stages.STAGE_RETRIES)
+        parsed = parse_ai_result(result)
+        self.assertEqual(parsed["icd_codes"], {"icd10_codes": []})
+        self.assertEqual(list(parsed["parse_errors"]), ["specified:F41"])
+
+    @mock.patch.object(token_usage, "DOCUMENT_TOKEN_BUDGET", 100)
+    def test_budget_skips_refinement(self):
+        result, usage, model = self.run_pipeline("unused")
+
+        self.assertEqual(model.call_count, 1)
+        self.assertEqual(usage.stages["specified"]["skipped"], 1)
+        self.assertEqual([item["code"] for item in result["icd_codes"]["icd10_codes"]], ["F41"])
+
+    def test_coding_job_stores_token_usage(self):
+        path = os.path.join(_tempdir(self), "note.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4")
+        CodingJob.objects.create(user=self.user, file_path=path, original_name="note.pdf", content_hash=file_sha256(path))
+        self.patch_model(json.dumps({"icd10_codes": [{"code": "F41.1", "description": "x"}]}))
+
+        self.assertEqual(run_coding_job(claim_jobs("w1", 1)[0], "w1"), CodingJob.STATUS_COMPLETED)
+        document = MedicalDocument.objects.get()
+        self.assertEqual(document.total_tokens, 325)
+        self.assertEqual(document.token_usage["specified"]["prompt_tokens"], 200)
+        self.assertEqual(token_usage.used_today(self.user.pk), 325)
+
+
+# -----------------------------
+# ADMISSION AND THROTTLING
+# -----------------------------
+LANES = {
+    "interactive": {"weight": 8, "max_concurrent": 2, "max_queued": 4},
+    "backfill": {"weight": 1, "max_concurrent": 1, "max_queued": 4},
+}
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def controller(self, **kwargs):
+        options = {"max_concurrent": 2, "max_per_user": 1, "max_queued_per_user": 1,
+                   "queue_timeout": 0.05, "lanes": LANES}
+        return AdmissionController(**{**options, **kwargs})
+
+    def test_per_user_queue_limit(self):
+        controller = self.controller(queue_timeout=5)
+        controller.acquire(1)
+        waiter = threading.Thread(target=controller.acquire, args=(1,))
+        waiter.start()
+        while controller.snapshot()["interactive"]["queued"] == 0:
+            time.sleep(0.001)
+        with self.assertRaises(PipelineBusy) as busy:
+            controller.acquire(1)  # one already waiting
+        self.assertGreaterEqual(busy.exception.retry_after, 1)
+        controller.release(1)
+        waiter.join(1)
+        self.assertEqual(controller.snapshot()["interactive"]["running"], 1)
+
+    def test_queue_timeout(self):
+        controller = self.controller()
+        controller.acquire(1)
+        with self.assertRaises(PipelineBusy):
+            controller.acquire(1)
+        self.assertEqual(controller.snapshot()["interactive"]["queued"], 0)
+
+    def test_backfill_capped_below_total(self):
+        controller = self.controller(max_per_user=2)
+        controller.acquire(1, "backfill")
+        with self.assertRaises(PipelineBusy):
+            controller.acquire(1, "backfill")
+        controller.acquire(2)  # interactive still has a slot
+
+    def test_unknown_lane(self):
+        with self.assertRaises(ValueError):
+            self.controller().acquire(1, "bulk")
+
+
+class SharedSlotsTests(TestCase):
+    """Two controllers stand in for two web processes sharing the database."""
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create(username=f"user{i}").pk for i in range(3)]
+
+    def controller(self, **kwargs):
+        options = {"max_concurrent": 2, "max_per_user": 1, "max_queued_per_user": 1,
+                   "queue_timeout": 0.05, "lanes": LANES, "poll_seconds": 0.01}
+        options.update(kwargs)
+        shared = SharedSlots(options["max_concurrent"], options["max_per_user"], LANES, lease_seconds=60)
+        return AdmissionController(shared=shared, **options)
+
+    def test_caps_hold_across_processes(self):
+        first, second = self.controller(), self.controller()
+        first.acquire(self.users[0])
+        with self.assertRaises(PipelineBusy):
+            second.acquire(self.users[0])  # per-user cap
+        second.acquire(self.users[1])
+        with self.assertRaises(PipelineBusy):
+            first.acquire(self.users[2])  # global cap
+        self.assertEqual(PipelineSlot.objects.count(), 2)
+        second.release(self.users[1])
+        first.acquire(self.users[2])
+        self.assertEqual(sorted(PipelineSlot.objects.values_list("user_id", flat=True)), [self.users[0], self.users[2]])
+
+    def test_expired_slot_does_not_count(self):
+        for user_id in self.users[:2]:
+            PipelineSlot.objects.create(user_id=user_id, lane="interactive", worker="gone:1",
+                                        expires_at=timezone.now() - timedelta(seconds=1))
+        self.controller().acquire(self.users[0])
+        self.assertEqual(PipelineSlot.objects.count(), 1)
+
+    def test_per_process_cache_refused_with_several_workers(self):
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with self.settings(CACHES=locmem, WEB_CONCURRENCY=2):
+            with self.assertRaises(ImproperlyConfigured):
+                check_shared_cache()
+        with self.settings(CACHES=locmem, WEB_CONCURRENCY=1):
+            check_shared_cache()
+
+
+class TokenBucketThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.request = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=42))
+
+    def test_burst_then_wait(self):
+        throttle = UploadUserThrottle()
+        allowed = [throttle.allow_request(self.request, None) for _ in range(throttle.burst + 1)]
+        self.assertEqual(allowed, [True] * throttle.burst + [False])
+        self.assertAlmostEqual(throttle.wait(), 1 / throttle.refill_per_second, delta=1)
+
+    def test_buckets_are_per_user(self):
+        throttle = UploadUserThrottle()
+        for _ in range(throttle.burst):
+            throttle.allow_request(self.request, None)
+        other = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=43))
+        self.assertTrue(throttle.allow_request(other, None))
+
+
+class HashingPoolTests(SimpleTestCase):
+    @mock.patch.object(hashing_pool, "HASHING_WORKERS", 1)
+    @mock.patch.object(hashing_pool, "HASHING_TIMEOUT_SECONDS", 0.01)
+    def test_timeout_is_busy(self):
+        with self.assertRaises(hashing_pool.HashingBusy):
+            hashing_pool.run_hashing(time.sleep, 0.2)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user("cached", "cached@example.com", "s3cret-pass")
+        self.auth = CachedJWTAuthentication()
+        self.token = {"user_id": self.user.pk, "ver": self.user.token_version}
+
+    def test_cache_holds_no_password(self):
+        self.auth.get_user(self.token)
+        cached = cache.get(_key(self.user.pk))
+        self.assertEqual(set(cached), set(CACHED_FIELDS))
+        self.assertEqual((cached["username"], cached["is_active"]), ("cached", True))
+
+    def test_warm_cache_costs_no_query(self):
+        self.auth.get_user(self.token)
+        with self.assertNumQueries(0):
+            user = self.auth.get_user(self.token)
+            self.assertEqual((user.pk, user.email, user.is_staff), (self.user.pk, "cached@example.com", False))
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password("s3cret-pass"))  # never cached: loaded on access
+
+    def test_warm_me_endpoint_costs_no_query(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        client.get("/api/auth/me/")
+        with self.assertNumQueries(0):
+            response = client.get("/api/auth/me/")
+        self.assertEqual(response.data["data"], {"id": self.user.pk, "username": "cached", "email": "cached@example.com"})
+
+    def test_warm_document_list_queries(self):
+        MedicalDocument.objects.create(user=self.user, file_path="a.pdf")
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        client.get("/api/medical-documents/")
+        with self.assertNumQueries(1):  # the list's ETag; the user and the payload come from the cache
+            response = client.get("/api/medical-documents/")
+        self.assertEqual(len(response.data["data"]), 1)
+
+    def test_revoked_token(self):
+        self.auth.get_user(self.token)
+        self.user.token_version += 1
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+
+# -----------------------------
+# CHECKPOINTS
+# -----------------------------
+class CheckpointStoreTests(SimpleTestCase):
+    def test_round_trip_and_clear(self):
+        store = CheckpointStore("abc", root=_tempdir(self))
+        self.assertIsNone(store.get("ocr"))
+        store.put("ocr", "text")
+        store.put("specified:F41", {"icd10_codes": []})
+        self.assertEqual(store.get("ocr"), "text")
+        self.assertEqual(store.completed(), ["ocr", "specified:F41"])
+        store.clear()
+        self.assertEqual(store.completed(), [])
+
+    def test_checkpointed_runs_once(self):
+        calls = []
+
+        def stage():
+            calls.append(1)
+            return {"codes": ["F41"]}
+
+        with checkpoint_scope("doc") as store:
+            store.path = os.path.join(_tempdir(self), "doc")
+            first = checkpointed("parent", stage)
+            second = checkpointed("parent", stage)
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_stage_not_stored(self):
+        with checkpoint_scope("doc") as store:
+            store.path = os.path.join(_tempdir(self), "doc")
+            self.assertIsNone(checkpointed("ocr", lambda: None))
+            self.assertEqual(store.completed(), [])
+
+    def test_failed_download_does_not_redact_again(self):
+        redacted = {"ok": False}
+
+        def download(remote_path, local_dest):
+            if not redacted["ok"]:
+                return None
+            with open(local_dest, "w", encoding="utf-8") as f:
+                f.write("redacted text")
+            return local_dest
+
+        with mock.patch.object(hippa_pipeline, "run_ocr", return_value="ocr text"), \
+                mock.patch.object(hippa_pipeline, "get_cache", return_value=None), \
+                mock.patch.object(hippa_pipeline, "upload_to_sftp", return_value="in/doc.txt") as upload, \
+                mock.patch.object(hippa_pipeline, "run_hipaa_redaction",
+                                  return_value={"status": "success", "redacted_file": "out/doc.txt"}) as redaction, \
+                mock.patch.object(hippa_pipeline, "download_from_sftp", side_effect=download), \
+                checkpoint_scope("doc") as store:
+            store.path = os.path.join(_tempdir(self), "doc")
+            self.assertIsNone(hippa_pipeline.hipaa_main("note.pdf"))
+            self.assertEqual(store.get("redaction"), "out/doc.txt")
+            redacted["ok"] = True
+            self.assertEqual(hippa_pipeline.hipaa_main("note.pdf"), "redacted text")
+            self.assertEqual((upload.call_count, redaction.call_count), (1, 1))
+            self.assertEqual(store.completed(), ["download", "redaction"])
+
+            # A stored output that fails again is dropped, so the next run redacts again
+            store.discard("download")
+            redacted["ok"] = False
+            self.assertIsNone(hippa_pipeline.hipaa_main("note.pdf"))
+            self.assertEqual(store.completed(), [])
+
+
+# -----------------------------
+# PROGRESS
+# -----------------------------
+class ProgressTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_job_id_stays_with_its_owner(self):
+        with track("job-1", 1):
+            pass
+        with track("job-1", 1):  # a retry appends to the same log
+            pass
+        with self.assertRaises(JobIdTaken):
+            with track("job-1", 2):
+                pass
+        self.assertEqual([event["stage"] for event in read_events("job-1")], ["received", "received"])
+
+    def test_upload_with_another_users_job_id(self):
+        owner, other = (get_user_model().objects.create(username=name) for name in ("owner", "other"))
+        job_id = str(uuid.uuid4())
+        with track(job_id, owner.pk):
+            pass
+        client = APIClient()
+        client.force_authenticate(other)
+        upload = SimpleUploadedFile("note.pdf", b"%PDF-1.4", content_type="application/pdf")
+        response = client.post("/api/medical-documents/upload/", {"file": upload, "job_id": job_id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["code"], "JOB_ID_IN_USE")
+
+
+# -----------------------------
+# CODING JOB QUEUE
+# -----------------------------
+class ClaimJobsTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create(username="coder")
+        self.backfill = CodingJob.objects.create(user=user, file_path="/tmp/a.pdf", original_name="a.pdf", lane="backfill")
+        self.first = CodingJob.objects.create(user=user, file_path="/tmp/b.pdf", original_name="b.pdf")
+        self.second = CodingJob.objects.create(user=user, file_path="/tmp/c.pdf", original_name="c.pdf")
+        CodingJob.objects.filter(pk=self.second.pk).update(created_at=timezone.now() + timedelta(seconds=1))
+
+    def test_interactive_first_then_oldest(self):
+        jobs = claim_jobs("w1", 3)
+        self.assertEqual([job.pk for job in jobs], [self.first.pk, self.second.pk, self.backfill.pk])
+        self.assertEqual(claim_jobs("w2", 3), [])
+
+    def test_release_only_own_claims(self):
+        jobs = claim_jobs("w1", 2)
+        self.assertEqual(release_jobs("w2", [job.pk for job in jobs]), 0)
+        self.assertEqual(release_jobs("w1", [job.pk for job in jobs]), 2)
+        self.assertEqual([job.pk for job in claim_jobs("w2", 1)], [self.first.pk])
+
+    def test_lease_restarts_when_the_job_starts(self):
+        job = claim_jobs("w1", 1)[0]
+        # Prefetched: the claim is older than the lease by the time a thread starts it
+        CodingJob.objects.filter(pk=job.pk).update(claimed_at=timezone.now() - timedelta(hours=2))
+
+        requeued = []
+
+        def pipeline(path):  # a sweep while the job runs
+            requeued.append(requeue_expired(lease_seconds=3600))
+            return {"status": "error", "message": "stop here"}
+
+        with mock.patch("medicalcoder.pipeline.process_icd_codes", side_effect=pipeline):
+            self.assertEqual(run_coding_job(job, "w1"), CodingJob.STATUS_PENDING)
+        self.assertEqual(requeued, [0])
+
+    def test_retryable_failure_is_not_terminal(self):
+        cache.clear()
+        job = claim_jobs("w1", 1)[0]
+        with mock.patch("medicalcoder.pipeline.process_icd_codes", return_value={"status": "error", "message": "OCR down"}):
+            self.assertEqual(run_coding_job(job, "w1"), CodingJob.STATUS_PENDING)
+        stages = [event["stage"] for event in read_events(str(job.pk))]
+        self.assertEqual(stages, ["received", "retrying"])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (CodingJob.STATUS_PENDING, "OCR down"))
+
+
+# -----------------------------
+# DUPLICATE UPLOADS
+# -----------------------------
+class DuplicateUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username="uploader")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.path = os.path.join(_tempdir(self), "note.pdf")
+        with open(self.path, "wb") as f:
+            f.write(b"%PDF-1.4 same bytes")
+        self.content_hash = file_sha256(self.path)
+
+    def test_duplicate_of_is_per_user_and_completed_only(self):
+        other = get_user_model().objects.create(username="other")
+        MedicalDocument.objects.create(user=other, file_path="a.pdf", content_hash=self.content_hash)
+        MedicalDocument.objects.create(user=self.user, file_path="b.pdf", content_hash=self.content_hash,
+                                       status=MedicalDocument.STATUS_FAILED)
+        self.assertIsNone(MedicalDocument.objects.duplicate_of(self.user, self.content_hash))
+        mine = MedicalDocument.objects.create(user=self.user, file_path="c.pdf", content_hash=self.content_hash)
+        self.assertEqual(MedicalDocument.objects.duplicate_of(self.user, self.content_hash), mine)
+        self.assertIsNone(MedicalDocument.objects.duplicate_of(self.user, ""))
+
+    def test_create_returns_existing_document(self):
+        existing = MedicalDocument.objects.create(user=self.user, file_path="note.pdf", content_hash=self.content_hash)
+        response = self.client.post("/api/medical-documents/", {"file_path": self.path}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["code"], "DOCUMENT_DUPLICATE")
+        self.assertEqual(response.data["data"]["duplicate_of"], existing.pk)
+        self.assertEqual(MedicalDocument.objects.count(), 1)
+
+    def test_interactive_job_completes_with_existing_document(self):
+        existing = MedicalDocument.objects.create(user=self.user, file_path="note.pdf", content_hash=self.content_hash)
+        CodingJob.objects.create(user=self.user, file_path=self.path, original_name="note.pdf",
+                                 content_hash=self.content_hash)
+        job = claim_jobs("w1", 1)[0]
+        with mock.patch("medicalcoder.pipeline.process_icd_codes") as pipeline:
+            self.assertEqual(run_coding_job(job, "w1"), CodingJob.STATUS_COMPLETED)
+        pipeline.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.document_id, existing.pk)
+        self.assertEqual(MedicalDocument.objects.count(), 1)
+
+# -----------------------------
+# DOCUMENT LIST
+# -----------------------------
+class DocumentListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username="lister")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = MedicalDocument.objects.create(
+            user=self.user, file_path="a.pdf", icd_specified_codes={"icd10_codes": [{"code": "F41.1"}]},
+            code_summary={"icd10": 1},
+        )
+
+    def test_summary_by_default(self):
+        row = self.client.get("/api/medical-documents/").data["data"][0]
+        self.assertEqual(row["code_summary"], {"icd10": 1})
+        self.assertNotIn("icd_specified_codes", row)
+
+    def test_expand_codes(self):
+        row = self.client.get("/api/medical-documents/?expand=codes").data["data"][0]
+        self.assertEqual(row["icd_specified_codes"], {"icd10_codes": [{"code": "F41.1"}]})
+
+    def test_etag_follows_every_write_path(self):
+        etag = self.client.get("/api/medical-documents/")["ETag"]
+        self.assertEqual(self.client.get("/api/medical-documents/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        token_usage.UsageLedger(self.user.pk).attach(self.document)  # QuerySet.update(), no signal
+        response = self.client.get("/api/medical-documents/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        MedicalDocument.objects.filter(pk=self.document.pk).delete()
+        self.assertEqual(self.client.get("/api/medical-documents/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class DocumentQueryCountTests(TestCase):
+    """Reads cost the same number of queries for 2 documents as for 20 (no N+1)."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("counter", "counter@example.com", "unused-password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def seed(self, n):
+        MedicalDocument.objects.bulk_create(
+            MedicalDocument(user=self.user, file_path=f"/tmp/doc-{i}.pdf", icd_parent_codes={"icd_codes": ["F41"]})
+            for i in range(n)
+        )
+
+    def assertQueriesPerRead(self, expected, path, client=None):
+        for n in (2, 18):
+            self.seed(n)
+            url = path() if callable(path) else path
+            cache.clear()  # measure the cold read, not the payload cache
+            with self.subTest(documents=n), self.assertNumQueries(expected):
+                self.assertEqual((client or self.client).get(url).status_code, 200)
+
+    def test_summary_list(self):
+        # the list's ETag, then one query for the page
+        self.assertQueriesPerRead(2, "/api/medical-documents/")
+
+    def test_list_with_codes(self):
+        self.assertQueriesPerRead(2, "/api/medical-documents/?expand=codes")
+
+    def test_detail(self):
+        # updated_at for the validators, then the row
+        self.assertQueriesPerRead(2, lambda: f"/api/medical-documents/{MedicalDocument.objects.earliest('pk').pk}/")
+
+    def test_str_with_owner(self):
+        self.seed(5)
+        with self.assertNumQueries(1):
+            [str(doc) for doc in MedicalDocument.objects.for_user(self.user).with_owner()]
+
+    def test_admin_changelist(self):
+        client = Client()
+        client.force_login(self.user)
+        # session, user, two counts, the page (owners joined) and the degraded_mode filter
+        self.assertQueriesPerRead(6, "/admin/medicalcoder/medicaldocument/", client)
+
+
+# -----------------------------
+# EXPORTS
+# -----------------------------
+class ExportTests(TestCase):
+    def test_csv_formula_cells_escaped(self):
+        rows = [(1, 2, "=HYPERLINK(\"x\")", "2025-01-01", "cpt", "90834", "-x", "+1", "@SUM(A1)")]
+        body = b"".join(iter_export_chunks("csv", rows)).decode()
+        self.assertIn("'=HYPERLINK", body)
+        self.assertIn(",'-x,'+1,'@SUM(A1)", body)
+        self.assertIn(",90834,", body)
+
+    def test_requeue_expired(self):
+        user = get_user_model().objects.create(username="exporter")
+        old = timezone.now() - timedelta(days=1)
+        retry = ExportJob.objects.create(user=user, format="csv", status=ExportJob.STATUS_RUNNING,
+                                         started_at=old, attempts=1)
+        last = ExportJob.objects.create(user=user, format="csv", status=ExportJob.STATUS_RUNNING,
+                                        started_at=old, attempts=3)
+        fresh = ExportJob.objects.create(user=user, format="csv", status=ExportJob.STATUS_RUNNING,
+                                         started_at=timezone.now(), attempts=1)
+        self.assertEqual(requeue_expired_exports(lease_seconds=60), 1)
+        statuses = {job.pk: job.status for job in ExportJob.objects.all()}
+        self.assertEqual(statuses[retry.pk], ExportJob.STATUS_PENDING)
+        self.assertEqual(statuses[last.pk], ExportJob.STATUS_FAILED)
+        self.assertEqual(statuses[fresh.pk], ExportJob.STATUS_RUNNING)
+
+
+# -----------------------------
+# OCR PAGE CACHE
+# -----------------------------
+class OcrStitchTests(SimpleTestCase):
+    def test_split_and_stitch(self):
+        text = "header" + PAGE_MARKER.format(n=1) + "one" + PAGE_MARKER.format(n=2) + "two"
+        parts = split_ocr_text(text, 2)
+        self.assertEqual(parts, ["headerone", "two"])
+        self.assertEqual(stitch(parts), PAGE_MARKER.format(n=1) + "headerone" + PAGE_MARKER.format(n=2) + "two")
+
+    def test_markers_must_match_pages(self):
+        text = PAGE_MARKER.format(n=1) + "one" + PAGE_MARKER.format(n=3) + "three"
+        self.assertIsNone(split_ocr_text(text, 2))
+        self.assertIsNone(split_ocr_text("no markers", 1))
+
+
+class OcrPageCacheTests(SimpleTestCase):
+    def test_entries_expire_after_ttl_even_when_hit(self):
+        cache = OcrPageCache(_tempdir(self), ttl=60)
+        cache.put("bb22", "new page", 1.0)
+        with mock.patch("medicalcoder.ocr_cache.time.time", return_value=time.time() - 120):
+            cache.put("aa11", "old page", 1.0)
+        self.assertIsNone(cache.get("aa11"))
+        self.assertEqual(cache.get("bb22"), ("new page", 1.0))
+        cache.put("cc33", "stale", 1.0)
+        self.assertEqual(cache.prune(max_age_seconds=-1), 2)
+        self.assertIsNone(cache.get("bb22"))
+
+
+# -----------------------------
+# ICD INDEX AND CODE SET
+# -----------------------------
+ORDER_LINES = [
+    "00001 A00     0 Cholera                                                      Cholera",
+    "00002 A000    1 Cholera due to Vibrio cholerae 01, biovar cholerae           Cholera due to Vibrio cholerae 01, biovar cholerae",
+    "00003 A001    1 Cholera due to Vibrio cholerae 01, biovar eltor              Cholera due to Vibrio cholerae 01, biovar eltor",
+    "00004 E11     0 Type 2 diabetes mellitus                                     Type 2 diabetes mellitus",
+    "00005 E119    1 Type 2 diabetes mellitus without complications               Type 2 diabetes mellitus without complications",
+]
+
+
+class IcdIndexTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.index = IcdIndex(load_all())
+
+    def test_keys(self):
+        self.assertEqual(code_key(" f41.1"), "F411")
+        self.assertEqual(normalize_code("f411"), "F41.1")
+
+    def test_lookup_and_leaves(self):
+        self.assertTrue(self.index.is_valid("f41.1"))
+        self.assertTrue(self.index.is_leaf("F41.1"))
+        self.assertFalse(self.index.is_leaf("F41"))
+        self.assertEqual(self.index.nearest("F41.19").code, "F41.1")
+        self.assertTrue(self.index.is_within("F41.1", "F41"))
+
+    def test_uncovered_category_left_alone(self):
+        self.assertFalse(self.index.covers("A00.0"))
+
+
+class CodeRetrievalTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.index = CodeRetrievalIndex()
+
+    def test_matching_note_narrows_the_list(self):
+        scores = self.index.score(["Assessment: obstructive sleep apnea, adult. Plan: CPAP."])[0]
+        codes = self.index.select(scores, "G47")
+        self.assertEqual(codes[0], "G47.33")
+        self.assertLessEqual(len(codes), MAX_CANDIDATES_FACTOR * DEFAULT_TOP_K)
+
+    def test_unmatched_category_gets_full_hierarchy(self):
+        note = "Patient reports feeling well."
+        self.assertIsNone(self.index.select(self.index.score([note])[0], "G47"))
+        full = hierarchy_text([self.index.entries[r] for r in self.index.rows_by_category["G47"]])
+        self.assertEqual(self.index.candidates_for_note(note, ["G47"])["G47"], full)
+
+    def test_recall_on_labelled_notes(self):
+        labelled = load_labels(os.path.join(os.path.dirname(__file__), "testdata", "retrieval", "labels.jsonl"))
+        recall, fallback, counted = recall_at_k(self.index, labelled, (5, DEFAULT_TOP_K))
+        self.assertEqual(counted, len(labelled))
+        self.assertEqual(recall, {5: 1.0, DEFAULT_TOP_K: 1.0})
+        self.assertEqual(fallback[DEFAULT_TOP_K], 0.0)  # recalled from the narrowed list, not the full one
+
+
+class IcdCodeSetTests(SimpleTestCase):
+    def setUp(self):
+        path = os.path.join(_tempdir(self), "codeset.idx")
+        self.assertEqual(write_codeset(parse_order_lines(ORDER_LINES), path, 2025), 5)
+        self.codeset = IcdCodeSet(path)
+        self.addCleanup(self.codeset.close)
+
+    def test_parse_order_lines_chapters(self):
+        self.assertEqual([key for key, _, _ in parse_order_lines(ORDER_LINES, chapters="E")], ["E11", "E119"])
+
+    def test_lookup(self):
+        self.assertEqual(self.codeset.year, 2025)
+        entry = self.codeset.lookup("a00.1")
+        self.assertEqual((entry.code, entry.parent, entry.depth), ("A00.1", "A00", 1))
+        self.assertTrue(self.codeset.is_billable("E11.9"))
+        self.assertFalse(self.codeset.is_billable("E11"))
+        self.assertIsNone(self.codeset.lookup("E11.8"))
+        self.assertEqual([e.code for e in self.codeset.category_entries("A00")], ["A00", "A00.0", "A00.1"])
+
+    def test_index_falls_back_to_codeset(self):
+        index = IcdIndex(load_all(), self.codeset)
+        self.assertTrue(index.covers("E11.9"))
+        self.assertTrue(index.is_leaf("E11.9"))
+        self.assertEqual(index.nearest("E11.99").code, "E11.9")
+        self.assertTrue(index.is_valid("F41.1"))  # local hierarchy still answers its categories
+
+
+class ImportTimeTests(SimpleTestCase):
+    def test_parse_importtime(self):
+        stderr = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   _io\n"
+            "import time:      1500 |       4000 | django\n"
+        )
+        self.assertEqual(parse_importtime(stderr), [("_io", 120, 120, 1), ("django", 1500, 4000, 0)])
+
+    def test_worker_boot_skips_pipeline_modules(self):
+        # Fails (CommandError) when a pipeline-only module is imported at startup. The time
+        # budget is left to `manage.py check_import_time`; set IMPORT_TIME_TEST_BUDGET_MS to
+        # enforce one here too.
+        budget_ms = float(os.getenv("IMPORT_TIME_TEST_BUDGET_MS", "inf"))
+        out = StringIO()
+        call_command("check_import_time", runs=1, budget_ms=budget_ms, stdout=out)
+        self.assertIn("Total import time", out.getvalue())
@@ -0,0 +1,83 @@
+"""
+throttling.py — Token-bucket rate limits for pipeline uploads
+
+DRF throttles backed by the Django cache, so every worker process shares the
+buckets (AppConfig.ready() refuses a per-process cache when WEB_CONCURRENCY
+is above 1, see admission.check_shared_cache). A bucket holds up to `burst` tokens and
+refills at the scope's rate from REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"];
+each upload takes one token. An empty bucket answers 429 with Retry-After set
+to the time until the next token.
+
+    pipeline_upload_user   per user (per client IP when anonymous)
+    pipeline_upload        all users together
+
+Buckets are read and written without a cross-process lock, so simultaneous
+requests in different processes can overshoot by a token or two; the
+admission caps in admission.py are the hard limit.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+BUCKET_TTL_SECONDS = 24 * 60 * 60
+
+_local_lock = threading.Lock()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate:
+            requests, seconds = SimpleRateThrottle.parse_rate(None, rate)
+            self.refill_per_second = requests / seconds
+        else:
+            self.refill_per_second = None  # scope not configured: unlimited
+        self.burst = max(settings.THROTTLE_BURSTS.get(self.scope, 1), 1)
+        self._wait = None
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if self.refill_per_second is None:
+            return True
+        key = f"throttle-bucket:{self.scope}:{self.get_cache_key(request, view)}"
+        with _local_lock:
+            now = time.time()
+            tokens, updated = cache.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.refill_per_second)
+            if tokens >= 1:
+                cache.set(key, (tokens - 1, now), BUCKET_TTL_SECONDS)
+                return True
+            cache.set(key, (tokens, now), BUCKET_TTL_SECONDS)
+        self._wait = (1 - tokens) / self.refill_per_second
+        return False
+
+    def wait(self):
+        return self._wait
+
+
+class UploadUserThrottle(TokenBucketThrottle):
+    scope = "pipeline_upload_user"
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f"user-{request.user.pk}"
+        return f"ip-{self.get_ident(request)}"
+
+
+class UploadGlobalThrottle(TokenBucketThrottle):
+    scope = "pipeline_upload"
+
+    def get_cache_key(self, request, view):
+        return "all"
+
+
+UPLOAD_THROTTLES = [UploadUserThrottle, UploadGlobalThrottle]
@@ -0,0 +1,262 @@
+"""
+token_usage.py — Per-stage token/latency accounting and token budgets
+
+The upload views and coding workers open a ledger around the pipeline run
+(`with accounting(user_id) as usage:`); run_stage() records each call it
+makes into the active ledger (a context variable, as in progress.py):
+prompt and completion tokens and latency. Tokens come from the usage the
+API reports with the response (`usage.prompt_tokens` /
+`completion_tokens`); note_compaction.count_tokens estimates them only
+when the response carries none.
+
+    usage.attach(document)   per-stage usage + totals on the MedicalDocument
+    (on exit)                per-user, per-day, per-stage UsageRollup rows,
+                             written for failed runs too
+
+Budgets (tokens, 0 = unlimited) never fail a document; they degrade it:
+
+    DOCUMENT_TOKEN_BUDGET     tokens one document may use
+    USER_DAILY_TOKEN_BUDGET   tokens one user may use per day (UTC)
+
+    used >= TOKEN_BUDGET_COMPACT_AT (0.6)       "compact": note contexts are
+                                                built with COMPACT_FACTOR of
+                                                their budget (note_compaction)
+    used >= TOKEN_BUDGET_SKIP_REFINEMENT_AT (0.85)  "skip_refinement": the
+                                                specified-code stage returns
+                                                its fallback (parent codes)
+                                                instead of calling the model
+
+"used" is the larger of the two budget fractions, re-evaluated before every
+call, so a document degrades as it runs. The mode a document ended in is
+stored on it (MedicalDocument.degraded_mode).
+"""
+
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# CONFIGURATION
+# -----------------------------
+DOCUMENT_TOKEN_BUDGET = int(os.getenv("DOCUMENT_TOKEN_BUDGET", "0"))
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0"))
+COMPACT_AT = float(os.getenv("TOKEN_BUDGET_COMPACT_AT", "0.6"))
+SKIP_REFINEMENT_AT = float(os.getenv("TOKEN_BUDGET_SKIP_REFINEMENT_AT", "0.85"))
+COMPACT_FACTOR = float(os.getenv("TOKEN_BUDGET_COMPACT_FACTOR", "0.5"))
+
+MODE_FULL = ""
+MODE_COMPACT = "compact"
+MODE_SKIP_REFINEMENT = "skip_refinement"
+
+# Stages that only refine an earlier stage's answer and can be skipped
+REFINEMENT_STAGES = ("specified",)
+
+_current = contextvars.ContextVar("token_usage", default=None)
+
+
+def _count_tokens(text):
+    # Imported lazily: tiktoken is a pipeline-only dependency
+    try:
+        from .note_compaction import count_tokens
+    except ImportError:  # run as a script from medicalcoder/
+        from note_compaction import count_tokens
+    return count_tokens(text) if text else 0
+
+
+class UsageLedger:
+    """Token and latency totals per stage for one pipeline run."""
+
+    def __init__(self, user_id=None, document_budget=None, daily_budget=None, used_today=0):
+        self.user_id = user_id
+        self.document_budget = DOCUMENT_TOKEN_BUDGET if document_budget is None else document_budget
+        self.daily_budget = USER_DAILY_TOKEN_BUDGET if daily_budget is None else daily_budget
+        self.used_today = used_today
+        self.stages = {}
+        self.mode = MODE_FULL  # most degraded mode reached
+        self.started = time.monotonic()
+
+    @property
+    def total_tokens(self):
+        return sum(s["prompt_tokens"] + s["completion_tokens"] for s in self.stages.values())
+
+    def _stage(self, stage):
+        return self.stages.setdefault(stage, {
+            "calls": 0, "skipped": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0,
+        })
+
+    def record(self, stage, prompt_tokens=0, completion_tokens=0, seconds=0.0):
+        entry = self._stage(stage)
+        entry["calls"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["latency_ms"] += int(seconds * 1000)
+
+    def record_skip(self, stage):
+        self._stage(stage)["skipped"] += 1
+
+    def budget_used(self):
+        """Largest fraction of the document or daily budget used so far (0 when unlimited)."""
+        total = self.total_tokens
+        used = 0.0
+        if self.document_budget > 0:
+            used = total / self.document_budget
+        if self.daily_budget > 0:
+            used = max(used, (self.used_today + total) / self.daily_budget)
+        return used
+
+    def current_mode(self):
+        used = self.budget_used()
+        mode = MODE_SKIP_REFINEMENT if used >= SKIP_REFINEMENT_AT else MODE_COMPACT if used >= COMPACT_AT else MODE_FULL
+        if mode and mode != self.mode and (self.mode == MODE_FULL or mode == MODE_SKIP_REFINEMENT):
+            logger.info("Token budget %.0f%% used for user %s: %s mode", used * 100, self.user_id, mode)
+            self.mode = mode
+        return mode
+
+    def as_dict(self):
+        return {
+            "stages": self.stages,
+            "total_tokens": self.total_tokens,
+            "pipeline_ms": int((time.monotonic() - self.started) * 1000),
+            "mode": self.mode,
+        }
+
+    def attach(self, document):
+        """Store this run's usage on `document` (a saved MedicalDocument)."""
+        from django.utils import timezone
+
+        usage = self.as_dict()
+        updated_at = timezone.now()  # update() skips auto_now; list ETags read it
+        type(document).objects.filter(pk=document.pk).update(
+            token_usage=usage["stages"],
+            total_tokens=usage["total_tokens"],
+            pipeline_ms=usage["pipeline_ms"],
+            degraded_mode=usage["mode"],
+            updated_at=updated_at,
+        )
+        document.token_usage = usage["stages"]
+        document.total_tokens = usage["total_tokens"]
+        document.pipeline_ms = usage["pipeline_ms"]
+        document.degraded_mode = usage["mode"]
+        document.updated_at = updated_at
+
+    def save_rollups(self):
+        """Add this run's stage totals to today's UsageRollup rows for the user."""
+        if not self.user_id or not self.stages:
+            return
+        from django.db import transaction
+        from django.db.models import F
+        from django.utils import timezone
+
+        from .models import UsageRollup
+
+        day = timezone.now().date()
+        with transaction.atomic():
+            for stage, entry in self.stages.items():
+                rollup, _ = UsageRollup.objects.get_or_create(user_id=self.user_id, day=day, stage=stage)
+                UsageRollup.objects.filter(pk=rollup.pk).update(
+                    documents=F("documents") + 1,
+                    **{field: F(field) + value for field, value in entry.items()},
+                )
+
+
+def used_today(user_id):
+    """Tokens `user_id` has used today (UTC), from the rollups."""
+    from django.db.models import F, Sum
+    from django.utils import timezone
+
+    from .models import UsageRollup
+
+    if not user_id:
+        return 0
+    total = UsageRollup.objects.filter(user_id=user_id, day=timezone.now().date()).aggregate(
+        total=Sum(F("prompt_tokens") + F("completion_tokens"))
+    )["total"]
+    return total or 0
+
+
+@contextmanager
+def accounting(user_id=None):
+    """Make a new ledger the active one for code running inside the block."""
+    ledger = UsageLedger(user_id, used_today=used_today(user_id) if USER_DAILY_TOKEN_BUDGET > 0 else 0)
+    token = _current.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current.reset(token)
+        try:
+            ledger.save_rollups()
+        except Exception:
+            # Accounting is best-effort; never fail a pipeline run because of it
+            logger.exception("Could not save token usage rollups for user %s", user_id)
+
+
+# -----------------------------
+# PIPELINE SIDE
+# -----------------------------
+def _field(obj, name):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def split_response(raw):
+    """
+    (text, usage) of a model response.
+
+    `raw` is the response text, an OpenAI-style chat completion (object or
+    dict with "choices" and "usage"), or a (text, usage) pair. usage is
+    {"prompt_tokens", "completion_tokens"} as reported by the API, or None.
+    """
+    if isinstance(raw, tuple) and len(raw) == 2:
+        text, usage = raw
+    elif isinstance(raw, str) or raw is None:
+        return raw, None
+    else:
+        choices = _field(raw, "choices") or []
+        message = _field(choices[0], "message") if choices else None
+        text = _field(message, "content") if message is not None else None
+        usage = _field(raw, "usage")
+    if usage is None:
+        return text, None
+    prompt_tokens = _field(usage, "prompt_tokens")
+    completion_tokens = _field(usage, "completion_tokens")
+    if prompt_tokens is None and completion_tokens is None:
+        return text, None
+    return text, {"prompt_tokens": int(prompt_tokens or 0), "completion_tokens": int(completion_tokens or 0)}
+
+
+def record_call(stage, prompt, raw, seconds, usage=None):
+    """
+    Record one model call in the active ledger (no-op outside `accounting`).
+
+    `usage` is the API-reported token usage (split_response); without it
+    the tokens of `prompt` and `raw` are estimated.
+    """
+    ledger = _current.get()
+    if ledger is None:
+        return
+    if usage is not None:
+        ledger.record(stage, usage["prompt_tokens"], usage["completion_tokens"], seconds)
+    else:
+        ledger.record(stage, _count_tokens(prompt), _count_tokens(raw), seconds)
+
+
+def mode():
+    """Degraded mode the active ledger's budgets call for ("" when none)."""
+    ledger = _current.get()
+    return ledger.current_mode() if ledger is not None else MODE_FULL
+
+
+def compaction_factor():
+    """Multiplier for note_compaction's per-prompt budgets (1.0 unless compacting)."""
+    return COMPACT_FACTOR if mode() else 1.0
+
+
+def should_skip(stage):
+    """True when the budget calls for skipping this refinement stage; records the skip."""
+    if stage not in REFINEMENT_STAGES or mode() != MODE_SKIP_REFINEMENT:
+        return False
+    _current.get().record_skip(stage)
+    return True
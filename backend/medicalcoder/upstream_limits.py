@@ -0,0 +1,146 @@
+"""
+upstream_limits.py — Per-upstream concurrency limits by priority lane
+
+OCR, HIPAA redaction and the model each accept only so many parallel calls.
+Pipeline code wraps each call in `upstream_slot(name)`; the slot is taken in
+the lane of the running document (set by admission.admit(), "interactive"
+when unset):
+
+    UPSTREAM_LIMITS           = "ocr=4,redaction=4,model=8"   total per upstream
+    UPSTREAM_LIMITS_BACKFILL  = "ocr=2,redaction=2,model=4"   cap for one lane
+
+A freed slot goes to a waiting call from the highest-priority lane first, so
+backfill uses whatever interactive work leaves idle, up to its own cap, and
+never queues interactive calls behind it. A call that waits
+UPSTREAM_WAIT_SECONDS without a slot raises UpstreamBusy, which the API
+answers with 429 and Retry-After.
+
+The "model" slot is taken by pipeline_stages.run_stage(), which
+code_generation.py uses for every model call.
+
+Slots are per process. A pipeline run makes one upstream call at a time, so
+across web processes the shared admission cap (admission.py) also bounds
+the calls to each upstream at PIPELINE_MAX_CONCURRENT; these limits
+shape them further within a process (and in each coding worker process).
+
+No Django imports: hippa_pipeline.py also runs as a plain script.
+"""
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+
+# Highest priority first
+LANES = ("interactive", "backfill")
+DEFAULT_LANE = LANES[0]
+UPSTREAM_WAIT_SECONDS = float(os.getenv("UPSTREAM_WAIT_SECONDS", "600"))
+UPSTREAM_RETRY_AFTER_SECONDS = int(os.getenv("UPSTREAM_RETRY_AFTER_SECONDS", "30"))
+
+current_lane = contextvars.ContextVar("pipeline_lane", default=DEFAULT_LANE)
+
+
+def _parse_limits(value):
+    limits = {}
+    for part in (value or "").split(","):
+        if "=" in part:
+            name, limit = part.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+UPSTREAM_LIMITS = _parse_limits(os.getenv("UPSTREAM_LIMITS", "ocr=4,redaction=4,model=8"))
+DEFAULT_LANE_LIMITS = {"backfill": "ocr=2,redaction=2,model=4"}
+LANE_LIMITS = {
+    lane: _parse_limits(os.getenv(f"UPSTREAM_LIMITS_{lane.upper()}", DEFAULT_LANE_LIMITS.get(lane, "")))
+    for lane in LANES
+}
+
+
+class UpstreamBusy(RuntimeError):
+    """Waited UPSTREAM_WAIT_SECONDS without getting a slot for an upstream call (429 in the API)."""
+
+    retry_after = UPSTREAM_RETRY_AFTER_SECONDS
+
+
+class PrioritySlots:
+    """`capacity` slots shared by lanes, each with an optional cap, granted by lane priority."""
+
+    def __init__(self, capacity, lane_limits=None):
+        self.capacity = capacity
+        self.lane_limits = lane_limits or {}
+        self.in_use = 0
+        self.lane_in_use = {lane: 0 for lane in LANES}
+        self.waiting = {lane: 0 for lane in LANES}
+        self._cond = threading.Condition()
+
+    def _can_start(self, lane):
+        if self.in_use >= self.capacity:
+            return False
+        if self.lane_in_use[lane] >= self.lane_limits.get(lane, self.capacity):
+            return False
+        # Defer to higher-priority lanes that are waiting and could start
+        for other in LANES[:LANES.index(lane)]:
+            if self.waiting[other] and self.lane_in_use[other] < self.lane_limits.get(other, self.capacity):
+                return False
+        return True
+
+    def acquire(self, lane, timeout=None):
+        with self._cond:
+            self.waiting[lane] += 1
+            try:
+                if not self._cond.wait_for(lambda: self._can_start(lane), timeout):
+                    return False
+            finally:
+                self.waiting[lane] -= 1
+            self.in_use += 1
+            self.lane_in_use[lane] += 1
+            return True
+
+    def release(self, lane):
+        with self._cond:
+            self.in_use -= 1
+            self.lane_in_use[lane] -= 1
+            self._cond.notify_all()
+
+
+_lock = threading.Lock()
+_slots = {}
+
+
+def _get_slots(upstream):
+    slots = _slots.get(upstream)
+    if slots is None:
+        with _lock:
+            slots = _slots.get(upstream)
+            if slots is None:
+                capacity = UPSTREAM_LIMITS.get(upstream, 1)
+                lane_limits = {lane: limits[upstream] for lane, limits in LANE_LIMITS.items() if upstream in limits}
+                slots = _slots[upstream] = PrioritySlots(capacity, lane_limits)
+    return slots
+
+
+@contextmanager
+def upstream_slot(upstream, lane=None):
+    """Hold one of `upstream`'s slots (in the current lane) around a call to it."""
+    if upstream not in UPSTREAM_LIMITS:  # unconfigured upstream: not limited
+        yield
+        return
+    lane = lane or current_lane.get()
+    slots = _get_slots(upstream)
+    if not slots.acquire(lane, UPSTREAM_WAIT_SECONDS):
+        raise UpstreamBusy(f"No {upstream} capacity for {UPSTREAM_WAIT_SECONDS:.0f}s ({lane} lane).")
+    try:
+        yield
+    finally:
+        slots.release(lane)
+
+
+@contextmanager
+def in_lane(name):
+    """Run the block (and the upstream calls inside it) in priority lane `name`."""
+    token = current_lane.set(name)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
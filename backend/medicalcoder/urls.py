@@ -4,7 +4,9 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from .views import (
     RegisterView, MeView, PasswordChangeView, EmailUpdateView,
-    MedicalDocumentListCreateView, MedicalDocumentDetailView, MedicalDocumentUploadProcessView, MedicalDocumentUploadView, CustomLoginView
+    MedicalDocumentListCreateView, MedicalDocumentDetailView, MedicalDocumentUploadProcessView, MedicalDocumentUploadView, CustomLoginView,
+    MedicalDocumentProgressView, MedicalDocumentExportView, ExportJobListCreateView, ExportJobDetailView,
+    ExportJobDownloadView, CodingJobListCreateView, CodingJobDetailView
 )
 
 urlpatterns = [
@@ -24,4 +26,15 @@ urlpatterns = [
     path("medical-documents/<int:pk>/", MedicalDocumentDetailView.as_view(), name="medicaldocument_detail"),
     # path("medical-documents/upload/", MedicalDocumentUploadProcessView.as_view(), name="medicaldocument_upload"),
     path('medical-documents/upload/', MedicalDocumentUploadView.as_view(), name='medical-doc-upload'),
+    path("medical-documents/progress/<uuid:job_id>/", MedicalDocumentProgressView.as_view(), name="medicaldocument_progress"),
+
+    # Queued pipeline runs (manage.py run_coding_workers)
+    path("medical-documents/jobs/", CodingJobListCreateView.as_view(), name="codingjob_list_create"),
+    path("medical-documents/jobs/<uuid:pk>/", CodingJobDetailView.as_view(), name="codingjob_detail"),
+
+    # Code exports
+    path("medical-documents/export/", MedicalDocumentExportView.as_view(), name="medicaldocument_export"),
+    path("medical-documents/exports/", ExportJobListCreateView.as_view(), name="exportjob_list_create"),
+    path("medical-documents/exports/<uuid:pk>/", ExportJobDetailView.as_view(), name="exportjob_detail"),
+    path("medical-documents/exports/<uuid:pk>/download/", ExportJobDownloadView.as_view(), name="exportjob_download"),
 ]
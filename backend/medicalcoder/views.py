@@ -1,20 +1,44 @@
-from django.contrib.auth import get_user_model, authenticate
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from .serializers import (
     UserRegisterSerializer, UserSerializer,
-    PasswordChangeSerializer, EmailUpdateSerializer, PasswordResetSerializer, MedicalDocumentSerializer
+    PasswordChangeSerializer, EmailUpdateSerializer, PasswordResetSerializer, MedicalDocumentSerializer,
+    ExportJobSerializer, ExportRequestSerializer, CodingJobSerializer
 )
-from .api_response import ok, fail
-from .models import MedicalDocument
-from .serializers import MedicalDocumentSerializer
-from .code_generation import process_icd_codes
+from .admission import PipelineBusy, admit, request_lane
+from .api_response import ok, fail, stream_ok
+from .artifacts import create_document, document_codes, pipeline_artifacts
+from .authentication import TOKEN_VERSION_CLAIM
+from .checkpoints import checkpoint_scope
+from .coding_jobs import enqueue
+from .hashing_pool import HashingBusy
+from .http_cache import add_validators, cached_payload, detail_etag, list_etag, not_modified
+from .exports import FORMATS, export_queryset, iter_export_chunks, iter_export_rows, submit_export_job
+from .models import CodingJob, ExportJob, MedicalDocument, file_sha256
+from .serializers import MedicalDocumentSerializer, document_rows, iter_document_rows
+from .throttling import UPLOAD_THROTTLES
+from .pipeline import process_icd_codes
+from .output_parser import parse_ai_result
+from .progress import TERMINAL_STAGES, JobIdTaken, job_owner, new_job_id, read_events, shared_cache, track
+from .renderers import EventStreamRenderer
+from .token_usage import accounting
+from .upstream_limits import UpstreamBusy
 from rest_framework.parsers import MultiPartParser, FormParser
+import hashlib
 import os
 import tempfile
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from django.contrib.auth.hashers import make_password
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from rest_framework import serializers
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -65,22 +89,27 @@ from rest_framework.exceptions import AuthenticationFailed
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
     def validate(self, attrs):
         username = attrs.get("username")
-        password = attrs.get("password")
 
         # Check username existence first
         user_qs = User.objects.filter(username=username)
         if not user_qs.exists():
             raise AuthenticationFailed("No account found with this username.")
 
-        user = authenticate(username=username, password=password)
-        if user is None:
+        # Normal token generation authenticates once (one password hash per login)
+        try:
+            data = super().validate(attrs)
+        except AuthenticationFailed:
             raise AuthenticationFailed("Incorrect password. Please try again.")
 
-        # All good → continue with normal token generation
-        data = super().validate(attrs)
-        data.update({"user": UserSerializer(user).data})
+        data.update({"user": UserSerializer(self.user).data})
         return data
 
 
@@ -113,6 +142,16 @@ class CustomLoginView(TokenObtainPairView):
                 detail=str(e)
             )
 
+        except HashingBusy as e:
+            response = fail(
+                message="Too many sign-ins right now, please retry in a moment.",
+                code="LOGIN_BUSY",
+                http_status=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(e)
+            )
+            response["Retry-After"] = str(e.retry_after)
+            return response
+
         except serializers.ValidationError as e:
             return fail(
                 message="Invalid credentials format.",
@@ -159,8 +198,14 @@ class PasswordChangeView(APIView):
         try:
             serializer = PasswordChangeSerializer(data=request.data, context={"request": request})
             serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return ok(message="Password updated successfully.", code="PASSWORD_UPDATED")
+            user = serializer.save()
+            # Tokens issued before the change are revoked; hand out fresh ones
+            refresh = CustomTokenObtainPairSerializer.get_token(user)
+            return ok(
+                data={"refresh": str(refresh), "access": str(refresh.access_token)},
+                message="Password updated successfully.",
+                code="PASSWORD_UPDATED"
+            )
         except Exception as e:
             errors = getattr(e, "detail", None) or str(e)
             message = "Failed to update password."
@@ -240,6 +285,7 @@ class MedicalDocumentUploadProcessView(generics.GenericAPIView):
     """
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    throttle_classes = UPLOAD_THROTTLES
 
     def post(self, request, *args, **kwargs):
         uploaded = request.FILES.get("file")
@@ -255,15 +301,34 @@ class MedicalDocumentUploadProcessView(generics.GenericAPIView):
 
         # Write to a guaranteed temp path
         tmp_path = None
+        digest = hashlib.sha256()
         try:
             with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
                 tmp_path = tmp.name
                 for chunk in uploaded.chunks():
                     tmp.write(chunk)
+                    digest.update(chunk)
+
+            # The same file was coded before: return that document instead of
+            # paying for OCR, redaction and the model again (reprocess=1 forces a run)
+            reprocess = (request.data.get("reprocess") or request.query_params.get("reprocess")) in ("1", "true")
+            duplicate = None if reprocess else MedicalDocument.objects.duplicate_of(request.user, digest.hexdigest())
+            if duplicate is not None:
+                return ok(
+                    data={**MedicalDocumentSerializer(duplicate).data, "duplicate_of": duplicate.pk},
+                    message="This file was already processed; returning the existing document",
+                    code="DOCUMENT_DUPLICATE",
+                )
 
-            # Run existing pipeline on the temp file
-            ai_result = process_icd_codes(tmp_path)
+            # Run existing pipeline on the temp file (progress streamed per stage)
+            # Stage outputs are checkpointed under the content hash, so a retry
+            # of the same file resumes after the last completed stage
+            job_id = new_job_id(request.data.get("job_id"))
+            with track(job_id, request.user.id) as progress, admit(request.user.id, request_lane(request)), \
+                    checkpoint_scope(digest.hexdigest()) as checkpoints, accounting(request.user.id) as usage:
+                ai_result = process_icd_codes(tmp_path)
             if ai_result.get("status") != "success":
+                progress.publish("failed", message=ai_result.get("message"))
                 return fail(
                     message="AI code generation failed",
                     code="AI_PROCESS_FAILED",
@@ -271,38 +336,27 @@ class MedicalDocumentUploadProcessView(generics.GenericAPIView):
                     detail=ai_result.get("message")
                 )
 
-            # Parse outputs safely
-            icd_parent = ai_result.get("icd_parent_codes", {})  # {"icd_codes": [...]}
-            icd_specified = ai_result.get("icd_codes", {})      # {"icd_codes": [...] or raw text JSON}
-            cpt_data = ai_result.get("cpt_codes", {})
-
-            # Extract CPT codes list
-            cpt_only = cpt_data.get("cpt_codes", [])
-            
-            # Extract HCPCS codes separately
-            hcpcs_data = cpt_data.get("hcpcs_codes", [])
-            
-            # Extract modifiers from each CPT code entry
-            modifiers = []
-            for item in cpt_only:
-                if item.get("modifier"):
-                    modifiers.append({
-                        "code": item.get("modifier"),
-                        "description": item.get("description_modifier", "")
-                    })
+            # Parse outputs safely (a malformed section comes back empty and
+            # is listed in parsed["parse_errors"] instead of failing the upload;
+            # the errors are stored with the document and returned)
+            parsed = parse_ai_result(ai_result)
 
             # Store only the original filename (not server path)
-            doc = MedicalDocument.objects.create(
+            doc = create_document(
                 user=request.user,
                 file_path=original_name,
-                icd_parent_codes=icd_parent,
-                icd_specified_codes=icd_specified,
-                cpt_codes={"cpt": cpt_only},
-                modifiers={"Modifiers": modifiers},
-                hcpcs_codes=hcpcs_data,
+                content_hash=digest.hexdigest(),
+                codes=document_codes(parsed),
+                artifacts=pipeline_artifacts(ai_result, parsed["parse_errors"]),
             )
+            usage.attach(doc)
+            if checkpoints is not None:
+                checkpoints.clear()
 
             payload = MedicalDocumentSerializer(doc).data
+            if parsed["parse_errors"]:
+                payload["parse_errors"] = parsed["parse_errors"]
+            progress.publish("completed", document=payload)
             return ok(
                 data=payload,
                 message="Uploaded, processed by AI, and removed from server",
@@ -310,6 +364,8 @@ class MedicalDocumentUploadProcessView(generics.GenericAPIView):
                 http_status=status.HTTP_201_CREATED
             )
 
+        except (PipelineBusy, UpstreamBusy, JobIdTaken):
+            raise  # 429 + Retry-After (409 for a taken job id) from the exception handler
         except Exception as e:
             return fail(
                 message="Failed to process uploaded document",
@@ -326,26 +382,62 @@ class MedicalDocumentUploadProcessView(generics.GenericAPIView):
                     pass
 
 
+def expand_codes(request):
+    """`?expand=codes`: list responses carry the full code fields, not just code_summary."""
+    return "codes" in request.query_params.get("expand", "").split(",")
+
+
 class MedicalDocumentListCreateView(generics.ListCreateAPIView):
     """
-    GET: List all medical documents belonging to the authenticated user.
+    GET: List all medical documents belonging to the authenticated user as
+         summaries: id/file/owner/status/code_summary/timestamps (one query,
+         no code payloads). `?expand=codes` adds the full code fields; the
+         detail view always has them.
+         `?stream=1` writes the same envelope incrementally (flat memory, no payload cache).
     POST: Create a new medical document entry.
     """
     serializer_class = MedicalDocumentSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return MedicalDocument.objects.filter(user=self.request.user).order_by("-created_at")
+        return MedicalDocument.objects.for_user(self.request.user).order_by("-created_at")
+
+    def get_throttles(self):
+        # POST runs the pipeline; listing is not rate limited
+        if self.request.method == "POST":
+            return [throttle() for throttle in UPLOAD_THROTTLES]
+        return super().get_throttles()
 
     def list(self, request, *args, **kwargs):
         try:
-            queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return ok(
-                data=serializer.data,
+            etag = list_etag(request.user.id, request.query_params.urlencode())
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
+
+            if request.query_params.get("stream") in ("1", "true"):
+                queryset = self.get_queryset()
+                chunk_size = settings.DOCUMENT_STREAM_CHUNK_SIZE
+                if expand_codes(request):
+                    rows = iter_document_rows(queryset, chunk_size=chunk_size)
+                else:
+                    rows = queryset.summaries().iterator(chunk_size=chunk_size)
+                response = stream_ok(rows, message="Fetched user medical documents", code="DOCUMENT_LIST")
+                return add_validators(response, etag)
+
+            def build():
+                queryset = self.get_queryset()
+                if expand_codes(request):
+                    # Same output as the serializer with expand_payload=False
+                    return document_rows(queryset)
+                return list(queryset.summaries())
+
+            response = ok(
+                data=cached_payload(etag, build),
                 message="Fetched user medical documents",
                 code="DOCUMENT_LIST"
             )
+            return add_validators(response, etag)
         except Exception as e:
             return fail(
                 message="Failed to fetch documents",
@@ -368,9 +460,22 @@ class MedicalDocumentListCreateView(generics.ListCreateAPIView):
             # 2️⃣  Run the AI medical coding pipeline
             # -----------------------------------------------------------------
             print(f"[AI Pipeline] Processing file: {file_path}")
-            ai_result = process_icd_codes(file_path)
+            content_hash = file_sha256(file_path) if os.path.isfile(file_path) else ""
+            reprocess = (request.data.get("reprocess") or request.query_params.get("reprocess")) in ("1", "true")
+            duplicate = None if reprocess else MedicalDocument.objects.duplicate_of(user, content_hash)
+            if duplicate is not None:
+                return ok(
+                    data={**self.get_serializer(duplicate).data, "duplicate_of": duplicate.pk},
+                    message="This file was already processed; returning the existing document",
+                    code="DOCUMENT_DUPLICATE",
+                )
+            job_id = new_job_id(request.data.get("job_id"))
+            with track(job_id, user.id) as progress, admit(user.id, request_lane(request)), \
+                    checkpoint_scope(content_hash) as checkpoints, accounting(user.id) as usage:
+                ai_result = process_icd_codes(file_path)
 
             if ai_result.get("status") != "success":
+                progress.publish("failed", message=ai_result.get("message"))
                 return fail(
                     message="AI code generation failed",
                     code="AI_PROCESS_FAILED",
@@ -382,39 +487,28 @@ class MedicalDocumentListCreateView(generics.ListCreateAPIView):
             # -----------------------------------------------------------------
             # 3️⃣  Parse results
             # -----------------------------------------------------------------
-            icd_parent = ai_result.get("icd_parent_codes", {})
-            icd_specified = ai_result.get("icd_codes", {})
-            cpt_data = ai_result.get("cpt_codes", {})
-
-            # Extract CPT codes list
-            cpt_only = cpt_data.get("cpt_codes", [])
-            
-            # Extract HCPCS codes separately
-            hcpcs_data = cpt_data.get("hcpcs_codes", [])
-            
-            # Extract modifiers from each CPT code entry
-            modifiers = []
-            for item in cpt_only:
-                if item.get("modifier"):
-                    modifiers.append({
-                        "code": item.get("modifier"),
-                        "description": item.get("description_modifier", "")
-                    })
+            parsed = parse_ai_result(ai_result)
+            if parsed["parse_errors"]:
+                logger.warning("Unparseable model sections for %s: %s", file_path, parsed["parse_errors"])
 
             # -----------------------------------------------------------------
             # 4️⃣  Save to DB
             # -----------------------------------------------------------------
-            document = MedicalDocument.objects.create(
+            document = create_document(
                 user=user,
                 file_path=file_path,
-                icd_parent_codes=icd_parent,
-                icd_specified_codes=icd_specified,
-                cpt_codes={"cpt": cpt_only},
-                modifiers={"Modifiers": modifiers},
-                hcpcs_codes=hcpcs_data,
+                content_hash=content_hash,
+                codes=document_codes(parsed),
+                artifacts=pipeline_artifacts(ai_result, parsed["parse_errors"]),
             )
+            usage.attach(document)
+            if checkpoints is not None:
+                checkpoints.clear()
 
             payload = self.get_serializer(document).data
+            if parsed["parse_errors"]:
+                payload["parse_errors"] = parsed["parse_errors"]
+            progress.publish("completed", document=payload)
 
             # -----------------------------------------------------------------
             # 5️⃣  Return success response
@@ -426,6 +520,8 @@ class MedicalDocumentListCreateView(generics.ListCreateAPIView):
                 http_status=status.HTTP_201_CREATED
             )
 
+        except (PipelineBusy, UpstreamBusy, JobIdTaken):
+            raise  # 429 + Retry-After (409 for a taken job id) from the exception handler
         except Exception as e:
             return fail(
                 message="Failed to process or create document",
@@ -448,13 +544,22 @@ class MedicalDocumentDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     def retrieve(self, request, *args, **kwargs):
         try:
-            instance = self.get_object()
-            serializer = self.get_serializer(instance)
-            return ok(
-                data=serializer.data,
+            # Validators come from updated_at alone; a 304 skips loading the row
+            updated_at = self.get_queryset().filter(pk=kwargs["pk"]).values_list("updated_at", flat=True).first()
+            if updated_at is None:
+                self.get_object()  # unknown or foreign document: raises, handled below
+            etag = detail_etag(kwargs["pk"], updated_at)
+            unchanged = not_modified(request, etag, updated_at)
+            if unchanged is not None:
+                return unchanged
+
+            data = cached_payload(etag, lambda: dict(self.get_serializer(self.get_object()).data))
+            response = ok(
+                data=data,
                 message="Medical document details retrieved",
                 code="DOCUMENT_DETAIL"
             )
+            return add_validators(response, etag, updated_at)
         except Exception as e:
             return fail(
                 message="Failed to retrieve document",
@@ -500,23 +605,293 @@ class MedicalDocumentDetailView(generics.RetrieveUpdateDestroyAPIView):
             )
 
 class MedicalDocumentUploadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = UPLOAD_THROTTLES
+
     def post(self, request):
         try:
             uploaded_file = request.FILES.get('file')
             if not uploaded_file:
                 return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
  
+            # ?defer=1: queue for run_coding_workers and answer right away
+            if request.query_params.get("defer") in ("1", "true"):
+                job = enqueue(request.user, uploaded_file, request_lane(request))
+                return ok(
+                    data=CodingJobSerializer(job).data,
+                    message="Document queued for coding",
+                    code="CODING_QUEUED",
+                    http_status=status.HTTP_202_ACCEPTED,
+                )
+
             # Save temporarily to disk
             temp_dir = tempfile.mkdtemp()
             file_path = os.path.join(temp_dir, uploaded_file.name)
  
+            digest = hashlib.sha256()
             with open(file_path, 'wb+') as dest:
                 for chunk in uploaded_file.chunks():
                     dest.write(chunk)
+                    digest.update(chunk)
  
-            # Run HIPAA + code extraction pipeline
-            result = process_icd_codes(file_path)
+            # Run HIPAA + code extraction pipeline; clients can follow it on
+            # medical-documents/progress/<job_id>/ while this request runs
+            job_id = new_job_id(request.data.get("job_id"))
+            with track(job_id, request.user.id) as progress, admit(request.user.id, request_lane(request)), \
+                    checkpoint_scope(digest.hexdigest()) as checkpoints, accounting(request.user.id) as usage:
+                result = process_icd_codes(file_path)
+            if result.get("status") == "success":
+                result.update(parse_ai_result(result))
+                result["token_usage"] = usage.as_dict()
+                if checkpoints is not None:
+                    checkpoints.clear()
+                progress.publish("completed", result=result)
+            else:
+                progress.publish("failed", message=result.get("message"))
+            result["job_id"] = job_id
  
             return Response(result, status=status.HTTP_200_OK)
+        except (PipelineBusy, UpstreamBusy, JobIdTaken):
+            raise  # 429 + Retry-After (409 for a taken job id) from the exception handler
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MedicalDocumentProgressView(APIView):
+    """
+    GET: pipeline progress for one job id.
+
+    With `Accept: text/event-stream` and a shared cache (progress.py), a
+    Server-Sent Events stream: each event is `event: <stage>` with the JSON
+    event as data, ending after a "completed" or "failed" event or after
+    PROGRESS_STREAM_SECONDS, whichever comes first; reconnect with
+    `Last-Event-ID` to resume. Otherwise (or with ?format=json) one JSON poll:
+    {"events": [...], "done": bool, "poll_ms": ...} for events after
+    `?after=` / `Last-Event-ID`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    POLL_SECONDS = 0.5
+    POLL_MS = 1000  # suggested interval for JSON polling
+    START_TIMEOUT_SECONDS = 30
+    KEEPALIVE_SECONDS = 15
+
+    def get(self, request, job_id):
+        job_id = str(job_id)
+        owner = job_owner(job_id)
+        if owner not in (None, request.user.id):
+            raise Http404("Unknown job.")
+        try:
+            after = int(request.headers.get("Last-Event-ID") or request.query_params.get("after") or 0)
+        except ValueError:
+            after = 0
+
+        wants_stream = "text/event-stream" in request.headers.get("Accept", "")
+        if not wants_stream or request.query_params.get("format") == "json" or not shared_cache():
+            # A stream was asked for but cannot see other processes' events: answer one poll as JSON
+            request.accepted_renderer, request.accepted_media_type = JSONRenderer(), "application/json"
+            events = read_events(job_id, after) if owner is not None else []
+            return ok(data={
+                "events": events,
+                "done": any(event["stage"] in TERMINAL_STAGES for event in events),
+                "poll_ms": self.POLL_MS,
+            })
+
+        response = StreamingHttpResponse(
+            self._stream(job_id, request.user.id, after),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # disable nginx buffering
+        return response
+
+    def _stream(self, job_id, user_id, after):
+        started = last_sent = time.monotonic()
+        yield "retry: 2000\n\n"
+        while time.monotonic() - started < settings.PROGRESS_STREAM_SECONDS:
+            owner = job_owner(job_id)
+            if owner is None and time.monotonic() - started > self.START_TIMEOUT_SECONDS:
+                yield 'event: failed\ndata: {"message": "Job not found."}\n\n'
+                return
+            if owner not in (None, user_id):
+                return
+            for event in read_events(job_id, after):
+                after = event["seq"]
+                last_sent = time.monotonic()
+                yield f"id: {after}\nevent: {event['stage']}\ndata: {json.dumps(event, default=str)}\n\n"
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+            if time.monotonic() - last_sent > self.KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(self.POLL_SECONDS)
+
+
+# -------------------------------------------------------------------------
+# CODE EXPORTS (see exports.py)
+# -------------------------------------------------------------------------
+class MedicalDocumentExportView(APIView):
+    """
+    GET: Stream one row per document-code as CSV or JSONL.
+         ?file_format=csv|jsonl&start=YYYY-MM-DD&end=YYYY-MM-DD&status=&code_types=icd10,cpt,hcpcs
+         (&all_users=true for staff). Ranges over EXPORT_SYNC_MAX_DOCUMENTS
+         documents, and Parquet, need an export job instead.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = ExportRequestSerializer(data=request.query_params)
+        if not params.is_valid():
+            return fail(
+                message="Invalid export request",
+                code="EXPORT_INVALID",
+                fields=params.errors,
+            )
+        filters = params.validated_data
+        content_type, extension, streamable = FORMATS[filters["file_format"]]
+        queryset = export_queryset(request.user, filters)
+        if not streamable or queryset.count() > settings.EXPORT_SYNC_MAX_DOCUMENTS:
+            return fail(
+                message="Export too large to stream; create an export job (POST medical-documents/exports/)",
+                code="EXPORT_REQUIRES_JOB",
+                detail=f"Streaming supports csv/jsonl up to {settings.EXPORT_SYNC_MAX_DOCUMENTS} documents.",
+            )
+        rows = iter_export_rows(queryset, filters["code_types"])
+        response = StreamingHttpResponse(iter_export_chunks(filters["file_format"], rows), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="medical-codes.{extension}"'
+        return response
+
+
+class CodingJobListCreateView(generics.ListCreateAPIView):
+    """
+    GET: The user's queued pipeline runs, newest first.
+    POST: Queue a document (multipart key 'file', optional 'priority') for
+    `manage.py run_coding_workers`; follow it on medical-documents/progress/<id>/.
+    """
+    serializer_class = CodingJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def get_queryset(self):
+        return CodingJob.objects.filter(user=self.request.user).order_by("-created_at")
+
+    def get_throttles(self):
+        if self.request.method == "POST":
+            return [throttle() for throttle in UPLOAD_THROTTLES]
+        return super().get_throttles()
+
+    def list(self, request, *args, **kwargs):
+        return ok(
+            data=self.get_serializer(self.get_queryset()[:50], many=True).data,
+            message="Fetched coding jobs",
+            code="CODING_JOB_LIST",
+        )
+
+    def create(self, request, *args, **kwargs):
+        uploaded = request.FILES.get("file")
+        if not uploaded:
+            return fail(
+                message="No file provided. Use multipart/form-data with key 'file'.",
+                code="NO_FILE",
+                http_status=status.HTTP_400_BAD_REQUEST
+            )
+        job = enqueue(request.user, uploaded, request_lane(request))
+        return ok(
+            data=self.get_serializer(job).data,
+            message="Document queued for coding",
+            code="CODING_QUEUED",
+            http_status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class CodingJobDetailView(generics.RetrieveAPIView):
+    """GET: Queued pipeline run status; `document` is set once it completes."""
+    serializer_class = CodingJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CodingJob.objects.filter(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        return ok(
+            data=self.get_serializer(self.get_object()).data,
+            message="Coding job details retrieved",
+            code="CODING_JOB_DETAIL",
+        )
+
+
+class ExportJobListCreateView(generics.ListCreateAPIView):
+    """
+    GET: The user's export jobs, newest first.
+    POST: Queue an export job (same fields as the streaming export).
+    """
+    serializer_class = ExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user).order_by("-created_at")
+
+    def list(self, request, *args, **kwargs):
+        return ok(
+            data=self.get_serializer(self.get_queryset()[:50], many=True).data,
+            message="Fetched export jobs",
+            code="EXPORT_LIST",
+        )
+
+    def create(self, request, *args, **kwargs):
+        params = ExportRequestSerializer(data=request.data)
+        if not params.is_valid():
+            return fail(
+                message="Invalid export request",
+                code="EXPORT_INVALID",
+                fields=params.errors,
+            )
+        job = ExportJob.objects.create(
+            user=request.user, format=params.validated_data["file_format"], filters=params.job_filters()
+        )
+        submit_export_job(job)
+        return ok(
+            data=self.get_serializer(job).data,
+            message="Export job queued",
+            code="EXPORT_QUEUED",
+            http_status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class ExportJobDetailView(generics.RetrieveAPIView):
+    """
+    GET: Export job status.
+    GET download/: The finished export file.
+    """
+    serializer_class = ExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        return ok(
+            data=self.get_serializer(self.get_object()).data,
+            message="Export job details retrieved",
+            code="EXPORT_DETAIL",
+        )
+
+
+class ExportJobDownloadView(ExportJobDetailView):
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+        if job.status != ExportJob.STATUS_COMPLETED or not os.path.isfile(job.file_path):
+            return fail(
+                message="Export is not ready",
+                code="EXPORT_NOT_READY",
+                http_status=status.HTTP_409_CONFLICT,
+                detail=job.error or f"Job is {job.status}.",
+            )
+        content_type, extension, _ = FORMATS[job.format]
+        return FileResponse(
+            open(job.file_path, "rb"),
+            as_attachment=True,
+            filename=f"medical-codes-{job.created_at:%Y%m%d}.{extension}",
+            content_type=content_type,
+        )
@@ -1,11 +1,83 @@
 import http from './http'
 
-// Upload file
-export const uploadDocument = async (file) => {
+// Upload file (jobId lets the caller subscribe to progress before the upload returns)
+export const uploadDocument = async (file, jobId) => {
   const form = new FormData()
   form.append('file', file)
+  if (jobId) form.append('job_id', jobId)
   const { data } = await http.post('/medical-documents/upload/', form, {
     headers: { 'Content-Type': 'multipart/form-data' },
   })
   return data
 }
+
+// Follow pipeline progress for a job: a Server-Sent Events stream when the
+// server offers one (it closes streams after a minute; we resume with
+// Last-Event-ID), otherwise JSON polling.
+// fetch is used instead of EventSource so the Bearer token can be sent.
+// Returns a function that stops the subscription.
+const TERMINAL_STAGES = ['completed', 'failed']
+
+export const subscribeProgress = (jobId, onEvent) => {
+  const controller = new AbortController()
+  const token = localStorage.getItem('token')
+  const url = `${import.meta.env.VITE_API_BASE_URL}/medical-documents/progress/${jobId}/`
+  const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms))
+  let after = 0
+  let done = false
+
+  const handle = (event) => {
+    if (event.seq) after = event.seq
+    if (TERMINAL_STAGES.includes(event.stage)) done = true
+    onEvent(event)
+  }
+
+  const readStream = async (res) => {
+    const reader = res.body.pipeThrough(new TextDecoderStream()).getReader()
+    let buffer = ''
+    for (;;) {
+      const { value, done: ended } = await reader.read()
+      if (ended) break
+      buffer += value
+      let sep
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, sep)
+        buffer = buffer.slice(sep + 2)
+        const data = block
+          .split('\n')
+          .filter((line) => line.startsWith('data:'))
+          .map((line) => line.slice(5).trim())
+          .join('\n')
+        if (data) handle(JSON.parse(data))
+      }
+    }
+  }
+
+  const run = async () => {
+    while (!done) {
+      const res = await fetch(`${url}?after=${after}`, {
+        headers: {
+          Accept: 'text/event-stream, application/json',
+          'Last-Event-ID': String(after),
+          ...(token ? { Authorization: `Bearer ${token}` } : {}),
+        },
+        signal: controller.signal,
+      })
+      if (!res.ok) return
+
+      if ((res.headers.get('Content-Type') || '').includes('text/event-stream')) {
+        await readStream(res)
+        if (!done) await sleep(2000)
+      } else {
+        const { data } = await res.json()
+        data.events.forEach(handle)
+        if (!done) await sleep(data.poll_ms || 1000)
+      }
+    }
+  }
+
+  run().catch((err) => {
+    if (err.name !== 'AbortError') console.warn('⚠️ Progress stream closed:', err)
+  })
+  return () => controller.abort()
+}